@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+
+#
+# asyncio orchestration engine: the create/wait/snapshot/image steps as
+# coroutines over a non-blocking Compute REST client, so hundreds of VM
+# lifecycles overlap on one event loop instead of one thread per call.
+#
+import asyncio
+import time
+import uuid
+
+import readiness
+from operations import operation_scope
+from scheduler import default as default_scheduler
+
+try:
+    import aiohttp
+except ImportError:  # optional; only needed for AsyncCompute
+    aiohttp = None
+
+COMPUTE_API = "https://compute.googleapis.com/compute/v1/"
+SCOPES = ["https://www.googleapis.com/auth/cloud-platform"]
+
+# HTTP verb and path template for each method the engine uses.
+METHODS = {
+    "instances.insert": ("POST", "projects/{project}/zones/{zone}/instances"),
+    "instances.get": ("GET", "projects/{project}/zones/{zone}/instances/{instance}"),
+    "instances.delete": ("DELETE", "projects/{project}/zones/{zone}/instances/{instance}"),
+    "disks.createSnapshot": ("POST", "projects/{project}/zones/{zone}/disks/{disk}/createSnapshot"),
+    "images.insert": ("POST", "projects/{project}/global/images"),
+    "images.getFromFamily": ("GET", "projects/{project}/global/images/family/{family}"),
+    "firewalls.get": ("GET", "projects/{project}/global/firewalls/{firewall}"),
+    "firewalls.insert": ("POST", "projects/{project}/global/firewalls"),
+    "zoneOperations.wait": ("POST", "projects/{project}/zones/{zone}/operations/{operation}/wait"),
+    "regionOperations.wait": ("POST", "projects/{project}/regions/{region}/operations/{operation}/wait"),
+    "globalOperations.wait": ("POST", "projects/{project}/global/operations/{operation}/wait"),
+}
+# Methods taking a requestId, so that their retries are idempotent.
+REQUEST_ID_METHODS = {"instances.insert", "instances.delete", "disks.createSnapshot", "images.insert",
+                      "firewalls.insert"}
+
+
+class AsyncComputeError(Exception):
+    def __init__(self, status, content):
+        super().__init__(f"HTTP {status}: {content}")
+        self.status = status
+        self.content = content
+
+
+class AsyncCompute:
+    """Compute REST client on one aiohttp session with keep-alive connections.
+
+    At most `concurrency` requests are in flight; the OAuth token is shared
+    and refreshed off the event loop when it expires. Calls are paced and
+    retried by `scheduler` (the process-wide one by default).
+
+        async with AsyncCompute() as client:
+            operation = await client.call("instances.insert", project=..., zone=..., body=...)
+    """
+
+    def __init__(self, credentials=None, concurrency=100, scheduler=None):
+        if aiohttp is None:
+            raise ImportError("the async engine needs aiohttp: pip install aiohttp")
+        if credentials is None:
+            import google.auth
+            credentials, _ = google.auth.default(scopes=SCOPES)
+        self.credentials = credentials
+        self.concurrency = concurrency
+        self.scheduler = scheduler or default_scheduler()
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.token_lock = asyncio.Lock()
+        self.session = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.concurrency, keepalive_timeout=60)
+        self.session = aiohttp.ClientSession(base_url=COMPUTE_API, connector=connector)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+
+    async def token(self):
+        async with self.token_lock:
+            if not self.credentials.valid:
+                import google.auth.transport.requests
+                await asyncio.to_thread(self.credentials.refresh, google.auth.transport.requests.Request())
+        return self.credentials.token
+
+    async def call(self, method_id, body=None, **params):
+        verb, template = METHODS[method_id]
+        path_keys = [key for key in params if "{%s}" % key in template]
+        path = template.format(**{key: params.pop(key) for key in path_keys})
+        if method_id in REQUEST_ID_METHODS:
+            # One id for every attempt: a retry of an insert that went through returns its operation.
+            params.setdefault("requestId", str(uuid.uuid4()))
+
+        async def attempt():
+            headers = {"Authorization": "Bearer " + await self.token()}
+            async with self.semaphore:
+                async with self.session.request(verb, path, params=params or None, json=body, headers=headers) as response:
+                    if response.status >= 400:
+                        raise AsyncComputeError(response.status, await response.text())
+                    return await response.json()
+        return await self.scheduler.execute_async("compute." + method_id, attempt)
+
+
+class ThreadedAsyncCompute:
+    """Same interface as AsyncCompute over a discovery-style client.
+
+    Each call runs `.execute()` in a worker thread, which lets the engine
+    drive the fakecompute backend (or any googleapiclient service) offline.
+    """
+
+    def __init__(self, compute, concurrency=100):
+        self.compute = compute
+        self.semaphore = asyncio.Semaphore(concurrency)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    async def call(self, method_id, body=None, **params):
+        collection, method = method_id.split(".")
+        if body is not None:
+            params["body"] = body
+        request = getattr(getattr(self.compute, collection)(), method)(**params)
+        async with self.semaphore:
+            try:
+                return await asyncio.to_thread(request.execute)
+            except Exception as error:
+                if not hasattr(error, "resp"):
+                    raise
+                raise AsyncComputeError(error.resp.status, error.content) from error
+
+
+async def wait_operation(client, project, operation):
+    """Long-poll `operation` until DONE; raise if it failed."""
+    scope, location = operation_scope(operation)
+    params = {"project": project, "operation": operation["name"]}
+    if location:
+        params[scope] = location
+    while operation["status"] != "DONE":
+        operation = await client.call(f"{scope}Operations.wait", **params)
+    if "error" in operation:
+        raise Exception(operation["error"])
+    return operation
+
+
+async def ensure_firewall(client, project, rule):
+    """Insert `rule` unless it already exists."""
+    try:
+        await client.call("firewalls.get", project=project, firewall=rule["name"])
+    except AsyncComputeError as error:
+        if error.status != 404:
+            raise
+        await wait_operation(client, project, await client.call("firewalls.insert", project=project, body=rule))
+
+
+async def provision(client, project, zone, body):
+    """Insert one instance and wait for it; tags travel in the insert body."""
+    operation = await client.call("instances.insert", project=project, zone=zone, body=body)
+    await wait_operation(client, project, operation)
+    return await client.call("instances.get", project=project, zone=zone, instance=body["name"])
+
+
+async def snapshot_and_image(client, project, zone, disk, snapshot_name, image_name, labels=None):
+    """Snapshot `disk`, then build an image from the snapshot; return the image link."""
+    snapshot_body = {"name": snapshot_name, "sourceDisk": f"projects/{project}/zones/{zone}/disks/{disk}"}
+    if labels:
+        snapshot_body["labels"] = dict(labels)
+    operation = await client.call("disks.createSnapshot", project=project, zone=zone, disk=disk, body=snapshot_body)
+    await wait_operation(client, project, operation)
+    image_body = {"name": image_name, "sourceSnapshot": f"global/snapshots/{snapshot_name}"}
+    if labels:
+        image_body["labels"] = dict(labels)
+    operation = await client.call("images.insert", project=project, body=image_body)
+    await wait_operation(client, project, operation)
+    return f"projects/{project}/global/images/{image_name}"
+
+
+async def clone_instances(client, project, zone, new_instance_names, instance_properties, network_tag, concurrency):
+    """Async counterpart of part2.clone_instances with the same return values.
+
+    Every clone is one coroutine; at most `concurrency` lifecycles are
+    between insert and DONE at the same time.
+    """
+    lifecycles = asyncio.Semaphore(concurrency)
+    accepted = {}
+    records = {}
+    start_time = time.time()
+
+    async def clone(name):
+        async with lifecycles:
+            started = time.time()
+            body = dict(instance_properties, name=name, tags={"items": [network_tag]})
+            operation = await client.call("instances.insert", project=project, zone=zone, body=body)
+            operation = await wait_operation(client, project, operation)
+            records[name] = {"inserted": started, "api_done": time.time()}
+            accepted[name] = readiness.parse_timestamp(operation["insertTime"])
+            print(f"--- {name} took {time.time() - started} seconds ---")
+
+    await asyncio.gather(*(clone(name) for name in new_instance_names))
+    clones = await asyncio.gather(*(client.call("instances.get", project=project, zone=zone, instance=name)
+                                    for name in accepted))
+    return readiness.running_latencies(clones, accepted), records, time.time() - start_time
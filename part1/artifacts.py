@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+#
+# Content-addressed artifact store in a Cloud Storage bucket: scripts and
+# payloads are uploaded once under their sha256 and instances carry a short
+# URL in their metadata instead of the payload itself.
+#
+import hashlib
+import io
+import os
+import threading
+import urllib.parse
+
+from googleapiclient.errors import HttpError
+
+ARTIFACT_PREFIX = "artifacts/sha256/"
+
+
+class ArtifactStore:
+    """Upload-once storage of byte payloads under `bucket`/artifacts/sha256/<digest>.
+
+    put() returns the object name; an object that is already in the bucket
+    (checked once per process) is not uploaded again.
+
+        store = ArtifactStore(p1.build_storage(), bucket)
+        url = store.gs_url(store.put(script.encode(), ".sh"))
+    """
+
+    def __init__(self, storage, bucket):
+        self.storage = storage
+        self.bucket = bucket
+        self.known = set()
+        self.lock = threading.Lock()
+        self.uploaded = 0
+        self.skipped = 0
+
+    def put(self, data, suffix=""):
+        if isinstance(data, str):
+            data = data.encode()
+        name = ARTIFACT_PREFIX + hashlib.sha256(data).hexdigest() + suffix
+        with self.lock:
+            if name in self.known:
+                return name
+        if self.exists(name):
+            self.skipped += 1
+        else:
+            self.upload(name, data)
+            self.uploaded += 1
+        with self.lock:
+            self.known.add(name)
+        return name
+
+    def put_file(self, path):
+        with open(path, "rb") as artifact_file:
+            return self.put(artifact_file.read(), os.path.splitext(path)[1])
+
+    def exists(self, name):
+        try:
+            self.storage.objects().get(bucket=self.bucket, object=name).execute()
+            return True
+        except HttpError as error:
+            if error.resp.status != 404:
+                raise
+            return False
+
+    def upload(self, name, data):
+        from googleapiclient.http import MediaIoBaseUpload
+        media = MediaIoBaseUpload(io.BytesIO(data), mimetype="application/octet-stream", resumable=len(data) > 5 * 2**20)
+        print(f"Uploading {len(data)} bytes to gs://{self.bucket}/{name}")
+        try:
+            # ifGenerationMatch=0: only create, never overwrite a concurrent upload.
+            self.storage.objects().insert(bucket=self.bucket, name=name, media_body=media,
+                                          ifGenerationMatch=0).execute()
+        except HttpError as error:
+            if error.resp.status != 412:
+                raise
+
+    def gs_url(self, name):
+        """gs:// URL, as understood by the startup-script-url metadata key."""
+        return f"gs://{self.bucket}/{name}"
+
+    def download_url(self, name):
+        """JSON API media URL, for fetching with an OAuth token (e.g. curl on a VM)."""
+        return "https://storage.googleapis.com/storage/v1/b/%s/o/%s?alt=media" % (
+            self.bucket, urllib.parse.quote(name, safe=""))
+
+    def summary(self):
+        return f"{self.uploaded} uploaded, {self.skipped} already in gs://{self.bucket}"
+
+
+def startup_script_item(store, startup_script):
+    """Metadata item running `startup_script`: a startup-script-url reference when a store is given."""
+    if store is None:
+        return {"key": "startup-script", "value": startup_script}
+    return {"key": "startup-script-url", "value": store.gs_url(store.put(startup_script, ".sh"))}
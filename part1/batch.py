@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+#
+# Bulk Compute Engine calls grouped into googleapiclient HTTP batch requests.
+#
+import time
+from collections import namedtuple
+
+from scheduler import default as default_scheduler, error_status
+
+# Calls per HTTP batch round trip.
+BATCH_SIZE = 100
+
+BatchResult = namedtuple("BatchResult", ["key", "response", "error"])
+
+
+def execute_batch(compute, requests, batch_size=BATCH_SIZE, scheduler=None):
+    """Execute (key, request) pairs in batches of `batch_size`.
+
+    Returns one BatchResult per request, in input order. A failed call does
+    not abort the batch; its exception is reported in `error` instead. Each
+    call in a batch counts against its method's quota, so every request
+    takes a token from `scheduler` (the shared one by default) and calls
+    that fail transiently are retried in a later batch. Each call is traced
+    as its own span, from its first batch until its final answer.
+    """
+    scheduler = scheduler or default_scheduler()
+    tracer = scheduler.tracer
+    requests = list(requests)
+    results = [None] * len(requests)
+    attempts = [0] * len(requests)
+    started = [None] * len(requests)
+    retry = []
+
+    def callback(request_id, response, exception):
+        index = int(request_id)
+        method_id = requests[index][1].methodId
+        if exception is not None and scheduler.should_retry(method_id, exception, attempts[index]):
+            attempts[index] += 1
+            retry.append(index)
+            return
+        results[index] = BatchResult(requests[index][0], response, exception)
+        tracer.record(method_id, started[index], time.perf_counter(), batched=True, retries=attempts[index],
+                      status=200 if exception is None else error_status(exception))
+
+    pending = list(range(len(requests)))
+    while pending:
+        for start in range(0, len(pending), batch_size):
+            chunk = pending[start:start + batch_size]
+            time.sleep(max(scheduler.reserve(requests[index][1].methodId) for index in chunk))
+            batch = compute.new_batch_http_request(callback=callback)
+            for index in chunk:
+                started[index] = started[index] or time.perf_counter()
+                batch.add(requests[index][1], request_id=str(index))
+            with tracer.span("batch", "batch", size=len(chunk)):
+                batch.execute()
+        pending, retry[:] = sorted(retry), []
+        if pending:
+            time.sleep(scheduler.backoff(max(attempts[index] for index in pending) - 1))
+    return results
+
+
+def get_instances(compute, project, zone, names):
+    """Fetch many instances; results are keyed by instance name."""
+    return execute_batch(compute, [
+        (name, compute.instances().get(project=project, zone=zone, instance=name))
+        for name in names
+    ])
+
+
+def set_tags(compute, project, zone, instances, tags):
+    """Add `tags` to each instance resource, keeping the tags it already has.
+
+    `instances` are instance resources (as returned by get/list) so the
+    current tag fingerprint is known without another round trip.
+    """
+    requests = []
+    for instance in instances:
+        current = instance.get("tags", {})
+        tags_body = {
+            "items": sorted(set(current.get("items", [])) | set(tags)),
+            "fingerprint": current.get("fingerprint", ""),
+        }
+        requests.append((
+            instance["name"],
+            compute.instances().setTags(project=project, zone=zone, instance=instance["name"], body=tags_body),
+        ))
+    return execute_batch(compute, requests)
+
+
+def report_errors(results, action):
+    """Print each failed item and return the number of failures."""
+    failures = [result for result in results if result.error is not None]
+    for result in failures:
+        print(f'Could not {action} {result.key}: {result.error}')
+    return len(failures)
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+#
+# Process-wide clients and caches: nothing is built or fetched at import
+# time, and each client, image lookup or script read happens once.
+#
+import json
+import os
+import threading
+import time
+
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "lab5")
+IMAGE_TTL = 60 * 60
+SCRIPT_TTL = 60
+SCOPES = ["https://www.googleapis.com/auth/cloud-platform"]
+
+_lock = threading.Lock()
+_clients = {}
+_images = {}
+_scripts = {}
+
+
+def discovery_document(api, version):
+    """Discovery document from googleapiclient's bundled copy or the disk cache.
+
+    Only when neither exists is the document fetched, and it is then written
+    to CACHE_DIR so later processes skip the download.
+    """
+    from googleapiclient import discovery_cache
+    document = discovery_cache.get_static_doc(api, version)
+    if document:
+        return document
+    path = os.path.join(CACHE_DIR, f"{api}.{version}.json")
+    if os.path.exists(path):
+        return open(path).read()
+    import urllib.request
+    url = f"https://www.googleapis.com/discovery/v1/apis/{api}/{version}/rest"
+    document = urllib.request.urlopen(url).read().decode()
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with open(path, "w") as cache_file:
+        cache_file.write(document)
+    return document
+
+
+def cached_client(key, factory):
+    """Return the client stored under `key`, calling `factory()` the first time."""
+    with _lock:
+        if key not in _clients:
+            _clients[key] = factory()
+        return _clients[key]
+
+
+def compute_client(credentials=None, api="compute", version="v1", **kwargs):
+    """Build the discovery client once per process (and per credentials).
+
+    Requests go through a transport.HttpPool, so the client may be shared
+    by worker threads: each thread executes on its own keep-alive
+    connection and all of them reuse one token, under the shared
+    scheduler's rate limits and retries. Calls of methods that take a
+    requestId carry one, so those retries are idempotent.
+    """
+    def build():
+        from googleapiclient import discovery
+        import scheduler
+        import transport
+        scoped = credentials
+        if scoped is None:
+            import google.auth
+            scoped, _ = google.auth.default(scopes=SCOPES)
+        document = discovery_document(api, version)
+        pool = transport.HttpPool(scoped, scheduler=scheduler.default())
+        return discovery.build_from_document(document, http=pool.get(),
+                                             requestBuilder=pool.request_builder(request_id_methods(document)),
+                                             **kwargs)
+    return cached_client((api, version, credentials), build)
+
+
+def request_id_methods(document):
+    """Ids of the methods in a discovery document that take a requestId.
+
+    The server answers a repeated requestId with the operation of the first
+    request, so a retry of a call that did go through is not applied twice.
+    """
+    def methods(resource):
+        for method in resource.get("methods", {}).values():
+            yield method
+        for child in resource.get("resources", {}).values():
+            yield from methods(child)
+    return {method["id"] for method in methods(json.loads(document)) if "requestId" in method.get("parameters", {})}
+
+
+def storage_client(credentials=None):
+    """Cloud Storage JSON API client, built and cached like compute_client()."""
+    return compute_client(credentials, api="storage", version="v1")
+
+
+def image_link(compute, project, family, ttl=IMAGE_TTL):
+    """selfLink of the newest image in `family`, cached for `ttl` seconds."""
+    key = (compute, project, family)
+    with _lock:
+        cached = _images.get(key)
+    if cached and cached[0] > time.time():
+        return cached[1]
+    link = compute.images().getFromFamily(project=project, family=family).execute()["selfLink"]
+    with _lock:
+        _images[key] = (time.time() + ttl, link)
+    return link
+
+
+def read_script(path, ttl=SCRIPT_TTL):
+    """Contents of a startup script, re-read only after `ttl` seconds or when it changes on disk."""
+    mtime = os.path.getmtime(path)
+    with _lock:
+        cached = _scripts.get(path)
+        if cached and cached[0] > time.time() and cached[1] == mtime:
+            return cached[2]
+    contents = open(path).read()
+    with _lock:
+        _scripts[path] = (time.time() + ttl, mtime, contents)
+    return contents
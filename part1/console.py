@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+#
+# Startup-script stage timing from the serial console. The startup scripts
+# print "HW5-STAGE <stage> <epoch seconds>" to /dev/ttyS0 as each stage
+# (apt-get update, pip install, git clone, ...) starts, and "HW5-STAGE done"
+# when they finish. A ConsoleReader follows the serial port of many
+# instances at once with batched getSerialPortOutput calls; each call asks
+# only for the bytes after the `next` offset of the previous response, so
+# the console buffer is downloaded once however often it is polled.
+#
+# The timestamps come from the instance's own clock, so durations do not
+# depend on how soon after the fact the console is read.
+#
+import re
+import time
+
+import batch
+import readiness
+from scheduler import error_status
+
+MARKER = re.compile(r"HW5-STAGE (\S+) (\d+(?:\.\d+)?)")
+DONE = "done"
+SERIAL_PORT = 1
+POLL_INTERVAL = 2
+STAGE_DEADLINE = 30 * 60
+
+
+class ConsoleReader:
+    """Stage markers of `names`, read incrementally from their serial port."""
+
+    def __init__(self, compute, project, zone, names, port=SERIAL_PORT):
+        self.compute = compute
+        self.project = project
+        self.zone = zone
+        self.port = port
+        self.offsets = {name: 0 for name in names}
+        # Text after the last newline, completed by the next read.
+        self.partial = {name: "" for name in names}
+        self.markers = {name: [] for name in names}
+        # Bytes the console dropped (it is a ring buffer) before they were read.
+        self.missed = {name: 0 for name in names}
+        self.bytes_read = 0
+
+    def finished(self, name):
+        return any(stage == DONE for stage, _ in self.markers[name])
+
+    def poll(self):
+        """Read what every unfinished instance printed since the last poll."""
+        waiting = [name for name in self.offsets if not self.finished(name)]
+        instances = self.compute.instances()
+        results = batch.execute_batch(self.compute, [
+            (name, instances.getSerialPortOutput(project=self.project, zone=self.zone, instance=name,
+                                                 port=self.port, start=self.offsets[name]))
+            for name in waiting
+        ])
+        for result in results:
+            if result.error is not None:
+                # Not created or not booted yet; try again next round.
+                if error_status(result.error) not in (400, 404):
+                    print(f"Could not read the console of {result.key}: {result.error}")
+                continue
+            self.feed(result.key, result.response)
+
+    def feed(self, name, response):
+        start = int(response.get("start", self.offsets[name]))
+        if start > self.offsets[name]:
+            self.missed[name] += start - self.offsets[name]
+            self.partial[name] = ""
+        contents = response.get("contents", "")
+        self.offsets[name] = int(response.get("next", start + len(contents)))
+        self.bytes_read += len(contents)
+        lines = (self.partial[name] + contents).split("\n")
+        self.partial[name] = lines.pop()
+        for line in lines:
+            match = MARKER.search(line)
+            if match:
+                self.markers[name].append((match.group(1), float(match.group(2))))
+
+    def follow(self, deadline=STAGE_DEADLINE, interval=POLL_INTERVAL):
+        """Poll until every instance printed its done marker or `deadline` passes; returns durations()."""
+        give_up = time.time() + deadline
+        while True:
+            self.poll()
+            if all(self.finished(name) for name in self.offsets) or time.time() > give_up:
+                break
+            time.sleep(interval)
+        for name in self.offsets:
+            if not self.finished(name):
+                print(f"--- {name} did not finish its startup script within {deadline} seconds ---")
+            if self.missed[name]:
+                print(f"--- {name}: {self.missed[name]} console bytes were overwritten before they were read ---")
+        return self.durations()
+
+    def durations(self):
+        """{name: {stage: seconds}}, each stage lasting until the next marker."""
+        return {name: {stage: following[1] - started
+                       for (stage, started), following in zip(markers, markers[1:])}
+                for name, markers in self.markers.items()}
+
+
+def summarize(durations):
+    """p50/p95/max seconds of each stage across instances, in the order the stages ran."""
+    stages = list(dict.fromkeys(stage for stages in durations.values() for stage in stages))
+    summary = {}
+    for stage in stages:
+        values = [stages[stage] for stages in durations.values() if stage in stages]
+        summary[stage] = {
+            "count": len(values),
+            "p50": readiness.percentile(values, 50),
+            "p95": readiness.percentile(values, 95),
+            "max": max(values),
+        }
+    return summary
+
+
+def print_summary(title, summary):
+    for stage, stats in summary.items():
+        print(f"--- {title}: {stage} p50 {stats['p50']:.2f} s, p95 {stats['p95']:.2f} s, "
+              f"max {stats['max']:.2f} s ({stats['count']} instances) ---")
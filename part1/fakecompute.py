@@ -0,0 +1,1054 @@
+#!/usr/bin/env python3
+
+#
+# In-process stand-in for the `compute` v1 service, for benchmarking the
+# orchestration offline. Select it with COMPUTE_BACKEND=fake (see
+# part1.build_compute) and tune it with FAKE_COMPUTE_CONFIG, a JSON file
+# path or inline JSON holding FakeCompute keyword arguments, e.g.
+#
+#   COMPUTE_BACKEND=fake FAKE_COMPUTE_CONFIG='{"time_scale": 0.01}' \
+#       python part2/part2.py my-project my-bucket --copies 1000 --concurrency 200
+#
+# Resources, operations and status transitions follow the real API closely
+# enough for part1/part2 to run unchanged: operations finish after a sampled
+# latency, instances move PROVISIONING -> STAGING -> RUNNING, and the app on
+# port 5000 comes up a "boot" latency after RUNNING.
+#
+import base64
+import copy
+import datetime
+import hashlib
+import heapq
+import itertools
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter, deque
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+# (median seconds, lognormal sigma) per latency key. "api" is one HTTP round
+# trip, "boot" is RUNNING until the app serves when the startup script has to
+# install it ("boot-preinstalled" when it only starts it), every other key is
+# the completion time of the operation started by that method.
+DEFAULT_LATENCIES = {
+    "api": (0.08, 0.3),
+    "boot": (60, 0.3),
+    "boot-preinstalled": (8, 0.3),
+    "compute.instances.insert": (20, 0.2),
+    "compute.instances.bulkInsert": (25, 0.2),
+    "compute.instances.delete": (30, 0.2),
+    "compute.instances.setTags": (2, 0.3),
+    "compute.instances.setLabels": (2, 0.3),
+    "compute.instances.suspend": (15, 0.3),
+    "compute.instances.resume": (5, 0.3),
+    "compute.instances.stop": (30, 0.3),
+    "compute.instances.start": (10, 0.3),
+    "compute.firewalls.insert": (8, 0.3),
+    "compute.disks.createSnapshot": (30, 0.3),
+    "compute.images.insert": (40, 0.3),
+    "compute.machineImages.insert": (60, 0.3),
+    "compute.instanceTemplates.insert": (2, 0.3),
+    "compute.instanceGroupManagers.insert": (2, 0.3),
+    "compute.instanceGroupManagers.resize": (1, 0.3),
+    "compute.instanceGroupManagers.delete": (20, 0.3),
+    "compute.disks.delete": (5, 0.3),
+    "compute.images.delete": (10, 0.3),
+    "compute.snapshots.delete": (10, 0.3),
+    "compute.machineImages.delete": (10, 0.3),
+    "compute.instanceTemplates.delete": (2, 0.3),
+}
+DEFAULT_OPERATION_LATENCY = (5, 0.3)
+# Share of the boot latency each startup-script stage takes (see
+# part1/console.py); stages not listed get STAGE_WEIGHT.
+STAGE_WEIGHTS = {
+    "apt-update": 0.2,
+    "apt-install": 0.3,
+    "git-clone": 0.05,
+    "setup-install": 0.15,
+    "pip-install": 0.2,
+    "init-db": 0.05,
+}
+STAGE_WEIGHT = 0.05
+# Only top-level markers: indented ones belong to branches a first boot skips.
+STAGE_LINE = re.compile(r"^stage (\S+)\s*$", re.M)
+
+# Longest a zoneOperations().wait call blocks before returning, like the API.
+WAIT_TIMEOUT = 120
+
+EMPTY_FINGERPRINT = "42WmSpB8rSM="
+
+
+def http_error(status, reason, message):
+    resp = httplib2.Response({"status": status})
+    content = json.dumps({
+        "error": {"code": status, "message": message, "errors": [{"reason": reason, "message": message}]},
+    }).encode()
+    return HttpError(resp, content)
+
+
+def timestamp(when):
+    return datetime.datetime.fromtimestamp(when, datetime.timezone.utc).isoformat()
+
+
+def fingerprint(value):
+    if not value:
+        return EMPTY_FINGERPRINT
+    digest = hashlib.md5(json.dumps(value, sort_keys=True).encode()).digest()
+    return base64.b64encode(digest[:8]).decode()
+
+
+def resource_value(resource, path):
+    value = resource
+    for part in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def matches_filter(resource, expression):
+    """Evaluate the subset of list filters the orchestration uses.
+
+    Supports `field eq regex`, `field ne regex`, `field = value` and
+    `field != value` terms, optionally parenthesised and joined by AND.
+    """
+    if not expression:
+        return True
+    for term in re.split(r"\s+AND\s+|\)\s*\(", expression.strip()):
+        term = term.strip().strip("()").strip()
+        match = re.match(r'([\w.-]+)\s*(eq|ne|!=|=)\s*"?([^"]*)"?$', term)
+        if not match:
+            raise http_error(400, "invalid", f"Invalid list filter expression '{term}'")
+        field, operator, value = match.groups()
+        actual = resource_value(resource, field)
+        actual = "" if actual is None else str(actual)
+        if operator in ("eq", "ne"):
+            result = re.fullmatch(value, actual) is not None
+        else:
+            result = actual == value
+        if result != (operator in ("eq", "=")):
+            return False
+    return True
+
+
+class FakeRequest:
+    """Mirror of googleapiclient's HttpRequest: build now, run on execute()."""
+
+    def __init__(self, backend, method_id, handler, **kwargs):
+        self.backend = backend
+        self.methodId = method_id
+        self.handler = handler
+        self.kwargs = kwargs
+
+    def execute(self, http=None, num_retries=0):
+        def call():
+            self.backend.round_trip()
+            return self.backend.call(self)
+        if self.backend.scheduler is None:
+            return call()
+        return self.backend.scheduler.execute(self.methodId, call)
+
+
+class FakeBatch:
+    """Mirror of BatchHttpRequest: one round trip, one callback per request."""
+
+    def __init__(self, backend, callback=None):
+        self.backend = backend
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        if request_id is None:
+            request_id = str(len(self.requests) + 1)
+        self.requests.append((request_id, request, callback or self.callback))
+
+    def execute(self, http=None):
+        self.backend.round_trip()
+        for request_id, request, callback in self.requests:
+            try:
+                response, exception = self.backend.call(request), None
+            except HttpError as error:
+                response, exception = None, error
+            if callback is not None:
+                callback(request_id, response, exception)
+
+
+class _Collection:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def request(self, method, handler, **kwargs):
+        return FakeRequest(self.backend, f"compute.{self.name}.{method}", handler, **kwargs)
+
+    def list_next(self, previous_request, previous_response):
+        if not previous_response.get("nextPageToken"):
+            return None
+        return self.list(pageToken=previous_response["nextPageToken"], **previous_request.kwargs)
+
+    def list_store(self, store, kind, filter, maxResults, pageToken, **kwargs):
+        """list() over the resources in `store`, paged like the API."""
+        return self.request("list", lambda: self.backend.page(
+            [self.backend.view(item) for item in store.values()], filter, maxResults, pageToken, kind),
+            filter=filter, maxResults=maxResults, **kwargs)
+
+
+class _Instances(_Collection):
+    name = "instances"
+
+    def insert(self, project, zone, body, sourceInstanceTemplate=None):
+        return self.request("insert", lambda: self.backend.insert_instances(
+            project, zone, [self.backend.instance_body(body, sourceInstanceTemplate)], "compute.instances.insert"))
+
+    def bulkInsert(self, project, zone, body):
+        def handler():
+            count = body["count"]
+            pattern = body["namePattern"]
+            width = pattern.count("#")
+            bodies = []
+            for i in range(1, count + 1):
+                instance_body = copy.deepcopy(body["instanceProperties"])
+                instance_body["name"] = pattern.replace("#" * width, str(i).zfill(width))
+                bodies.append(instance_body)
+            return self.backend.insert_instances(project, zone, bodies, "compute.instances.bulkInsert")
+        return self.request("bulkInsert", handler)
+
+    def get(self, project, zone, instance):
+        return self.request("get", lambda: self.backend.view(self.backend.find_instance(zone, instance)))
+
+    def list(self, project, zone, filter=None, maxResults=500, pageToken=None, fields=None):
+        def handler():
+            instances = [self.backend.view(i) for i in self.backend.instance_store.get(zone, {}).values()]
+            return self.backend.page(instances, filter, maxResults, pageToken, "compute#instanceList")
+        return self.request("list", handler, project=project, zone=zone, filter=filter, maxResults=maxResults, fields=fields)
+
+    def setTags(self, project, zone, instance, body):
+        return self.request("setTags", lambda: self.backend.set_tags(project, zone, instance, body))
+
+    def setLabels(self, project, zone, instance, body):
+        return self.request("setLabels", lambda: self.backend.set_labels(project, zone, instance, body))
+
+    def suspend(self, project, zone, instance):
+        return self.request("suspend", lambda: self.backend.park_instance(project, zone, instance, "suspend"))
+
+    def stop(self, project, zone, instance):
+        return self.request("stop", lambda: self.backend.park_instance(project, zone, instance, "stop"))
+
+    def resume(self, project, zone, instance):
+        return self.request("resume", lambda: self.backend.wake_instance(project, zone, instance, "resume"))
+
+    def start(self, project, zone, instance):
+        return self.request("start", lambda: self.backend.wake_instance(project, zone, instance, "start"))
+
+    def delete(self, project, zone, instance):
+        return self.request("delete", lambda: self.backend.delete_instance(project, zone, instance))
+
+    def getSerialPortOutput(self, project, zone, instance, port=1, start=0):
+        return self.request("getSerialPortOutput", lambda: self.backend.serial_output(zone, instance, int(start)))
+
+
+class _Operations(_Collection):
+    def __init__(self, backend, name):
+        super().__init__(backend)
+        self.name = name
+
+    def get(self, project, operation, zone=None, region=None):
+        return self.request("get", lambda: self.backend.view_operation(operation))
+
+    def wait(self, project, operation, zone=None, region=None):
+        return self.request("wait", lambda: self.backend.wait_operation(operation))
+
+
+class _Firewalls(_Collection):
+    name = "firewalls"
+
+    def insert(self, project, body):
+        return self.request("insert", lambda: self.backend.insert_firewall(project, body))
+
+    def get(self, project, firewall):
+        return self.request("get", lambda: copy.deepcopy(self.backend.find(self.backend.firewall_store, firewall, "firewall")))
+
+    def patch(self, project, firewall, body):
+        return self.request("patch", lambda: self.backend.patch_firewall(project, firewall, body))
+
+    def list(self, project, filter=None, maxResults=500, pageToken=None, fields=None):
+        return self.request("list", lambda: self.backend.page(
+            copy.deepcopy(list(self.backend.firewall_store.values())), filter, maxResults, pageToken, "compute#firewallList"))
+
+
+class _Disks(_Collection):
+    name = "disks"
+
+    def createSnapshot(self, project, zone, disk, body):
+        return self.request("createSnapshot", lambda: self.backend.create_snapshot(project, zone, disk, body))
+
+    def list(self, project, zone, filter=None, maxResults=500, pageToken=None, fields=None):
+        return self.list_store(self.backend.disk_store.get(zone, {}), "compute#diskList", filter, maxResults, pageToken,
+                               project=project, zone=zone, fields=fields)
+
+    def delete(self, project, zone, disk):
+        return self.request("delete", lambda: self.backend.delete_disk(project, zone, disk))
+
+
+class _Snapshots(_Collection):
+    name = "snapshots"
+
+    def get(self, project, snapshot):
+        return self.request("get", lambda: copy.deepcopy(
+            self.backend.find(self.backend.snapshot_store, snapshot, "global/snapshots")))
+
+    def list(self, project, filter=None, maxResults=500, pageToken=None, fields=None):
+        return self.list_store(self.backend.snapshot_store, "compute#snapshotList", filter, maxResults, pageToken,
+                               project=project, fields=fields)
+
+    def delete(self, project, snapshot):
+        return self.request("delete", lambda: self.backend.delete_global(
+            project, self.backend.snapshot_store, "snapshots", snapshot))
+
+
+class _Images(_Collection):
+    name = "images"
+
+    def insert(self, project, body):
+        return self.request("insert", lambda: self.backend.insert_image(project, body))
+
+    def get(self, project, image):
+        return self.request("get", lambda: copy.deepcopy(self.backend.find(self.backend.image_store, image, "image")))
+
+    def getFromFamily(self, project, family):
+        return self.request("getFromFamily", lambda: self.backend.image_from_family(project, family))
+
+    def list(self, project, filter=None, maxResults=500, pageToken=None, fields=None):
+        return self.list_store(self.backend.image_store, "compute#imageList", filter, maxResults, pageToken,
+                               project=project, fields=fields)
+
+    def delete(self, project, image):
+        return self.request("delete", lambda: self.backend.delete_global(project, self.backend.image_store, "images", image))
+
+
+class _MachineImages(_Collection):
+    name = "machineImages"
+
+    def insert(self, project, body):
+        return self.request("insert", lambda: self.backend.insert_machine_image(project, body))
+
+    def get(self, project, machineImage):
+        return self.request("get", lambda: copy.deepcopy(
+            self.backend.find(self.backend.machine_image_store, machineImage, "global/machineImages")))
+
+    def list(self, project, filter=None, maxResults=500, pageToken=None, fields=None):
+        return self.list_store(self.backend.machine_image_store, "compute#machineImageList", filter, maxResults,
+                               pageToken, project=project, fields=fields)
+
+    def delete(self, project, machineImage):
+        return self.request("delete", lambda: self.backend.delete_global(
+            project, self.backend.machine_image_store, "machineImages", machineImage))
+
+
+class _InstanceTemplates(_Collection):
+    name = "instanceTemplates"
+
+    def insert(self, project, body):
+        return self.request("insert", lambda: self.backend.insert_instance_template(project, body))
+
+    def get(self, project, instanceTemplate):
+        return self.request("get", lambda: copy.deepcopy(
+            self.backend.find(self.backend.template_store, instanceTemplate, "global/instanceTemplates")))
+
+    def list(self, project, filter=None, maxResults=500, pageToken=None, fields=None):
+        return self.list_store(self.backend.template_store, "compute#instanceTemplateList", filter, maxResults,
+                               pageToken, project=project, fields=fields)
+
+    def delete(self, project, instanceTemplate):
+        return self.request("delete", lambda: self.backend.delete_template(project, instanceTemplate))
+
+
+class _InstanceGroupManagers(_Collection):
+    name = "instanceGroupManagers"
+
+    def insert(self, project, zone, body):
+        return self.request("insert", lambda: self.backend.insert_group(project, zone, body))
+
+    def get(self, project, zone, instanceGroupManager):
+        return self.request("get", lambda: self.backend.view_group(zone, instanceGroupManager))
+
+    def resize(self, project, zone, instanceGroupManager, size):
+        return self.request("resize", lambda: self.backend.resize_group(project, zone, instanceGroupManager, size))
+
+    def setInstanceTemplate(self, project, zone, instanceGroupManager, body):
+        return self.request("setInstanceTemplate", lambda: self.backend.set_group_template(
+            project, zone, instanceGroupManager, body))
+
+    def list(self, project, zone, filter=None, maxResults=500, pageToken=None, fields=None):
+        return self.list_store(self.backend.group_store.get(zone, {}), "compute#instanceGroupManagerList", filter,
+                               maxResults, pageToken, project=project, zone=zone, fields=fields)
+
+    def listManagedInstances(self, project, zone, instanceGroupManager):
+        return self.request("listManagedInstances", lambda: self.backend.managed_instances(zone, instanceGroupManager))
+
+    def delete(self, project, zone, instanceGroupManager):
+        return self.request("delete", lambda: self.backend.delete_group(project, zone, instanceGroupManager))
+
+
+class _Regions(_Collection):
+    name = "regions"
+
+    def get(self, project, region):
+        return self.request("get", lambda: {
+            "name": region,
+            "zones": [self.backend.self_link(project, f"zones/{zone}") for zone in self.backend.region_zones(region)],
+        })
+
+
+class _Zones(_Collection):
+    name = "zones"
+
+    def get(self, project, zone):
+        return self.request("get", lambda: {"name": zone, "status": "UP",
+                                            "selfLink": self.backend.self_link(project, f"zones/{zone}")})
+
+
+class _Objects(_Collection):
+    """Cloud Storage JSON API objects collection (see part1.build_storage)."""
+    name = "objects"
+
+    def request(self, method, handler, **kwargs):
+        return FakeRequest(self.backend, f"storage.objects.{method}", handler, **kwargs)
+
+    def get(self, bucket, object):
+        return self.request("get", lambda: copy.deepcopy(self.backend.find_object(bucket, object)["resource"]))
+
+    def insert(self, bucket, name, media_body=None, ifGenerationMatch=None):
+        return self.request("insert", lambda: self.backend.insert_object(bucket, name, media_body, ifGenerationMatch))
+
+
+class FakeCompute:
+    """In-memory Compute Engine with sampled latencies, failures and quotas.
+
+    `latencies` overrides DEFAULT_LATENCIES entries; `time_scale` multiplies
+    every sampled latency (0.01 turns a 20 s insert into 0.2 s).
+    `failure_rate` is the chance any call fails with HTTP 503 and
+    `operation_failure_rate` the chance an operation finishes with an error.
+    `quotas` maps a method id (e.g. "compute.instances.insert") to the calls
+    allowed per second before HTTP 429 rateLimitExceeded, and
+    `max_instances` caps the instances the project may hold and
+    `zone_capacity` maps a zone to the instances it can hold before inserts
+    fail with ZONE_RESOURCE_POOL_EXHAUSTED. `regions` maps a region to its
+    zones (default: the region name plus "-b", "-c" and "-d"). Requests
+    executed on their own go through `scheduler` (a scheduler.Scheduler)
+    when one is given, like the real client's requests do.
+    """
+
+    def __init__(self, latencies=None, time_scale=1.0, failure_rate=0.0, operation_failure_rate=0.0,
+                 quotas=None, max_instances=None, zone_capacity=None, regions=None, seed=None, scheduler=None):
+        self.latencies = dict(DEFAULT_LATENCIES, **{k: tuple(v) for k, v in (latencies or {}).items()})
+        self.time_scale = time_scale
+        self.failure_rate = failure_rate
+        self.operation_failure_rate = operation_failure_rate
+        self.quotas = quotas or {}
+        self.max_instances = max_instances
+        self.zone_capacity = zone_capacity or {}
+        self.regions_config = regions or {}
+        self.scheduler = scheduler
+        self.random = random.Random(seed)
+        self.lock = threading.RLock()
+        self.events = []
+        self.sequence = itertools.count(1)
+        self.recent_calls = {}
+        self.calls = Counter()
+
+        self.instance_store = {}
+        self.disk_store = {}
+        self.firewall_store = {}
+        self.snapshot_store = {}
+        self.image_store = {}
+        self.machine_image_store = {}
+        self.template_store = {}
+        self.group_store = {}
+        self.object_store = {}
+        self.operation_store = {}
+        self.serving = set()
+        self.addresses = {}
+
+    @classmethod
+    def from_env(cls, scheduler=None):
+        config = os.environ.get("FAKE_COMPUTE_CONFIG")
+        if not config:
+            return cls(scheduler=scheduler)
+        if os.path.exists(config):
+            config = open(config).read()
+        return cls(scheduler=scheduler, **json.loads(config))
+
+    # googleapiclient resource interface
+
+    def instances(self):
+        return _Instances(self)
+
+    def zoneOperations(self):
+        return _Operations(self, "zoneOperations")
+
+    def regionOperations(self):
+        return _Operations(self, "regionOperations")
+
+    def globalOperations(self):
+        return _Operations(self, "globalOperations")
+
+    def firewalls(self):
+        return _Firewalls(self)
+
+    def disks(self):
+        return _Disks(self)
+
+    def snapshots(self):
+        return _Snapshots(self)
+
+    def images(self):
+        return _Images(self)
+
+    def machineImages(self):
+        return _MachineImages(self)
+
+    def instanceTemplates(self):
+        return _InstanceTemplates(self)
+
+    def instanceGroupManagers(self):
+        return _InstanceGroupManagers(self)
+
+    def regions(self):
+        return _Regions(self)
+
+    def zones(self):
+        return _Zones(self)
+
+    def objects(self):
+        return _Objects(self)
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatch(self, callback)
+
+    def serves_http(self, ip, port=5000, timeout=2):
+        """Stand-in for an HTTP probe: True once the app is up and reachable."""
+        self.round_trip()
+        with self.lock:
+            self.advance()
+            if ip not in self.serving:
+                return False
+            instance = self.addresses[ip]
+            tags = set(instance["tags"].get("items", []))
+            return any(
+                tags & set(rule.get("targetTags", []))
+                and any(str(port) in allowed.get("ports", []) for allowed in rule["allowed"])
+                for rule in self.firewall_store.values()
+            )
+
+    # Simulation
+
+    def sample(self, key):
+        median, sigma = self.latencies.get(key, DEFAULT_OPERATION_LATENCY)
+        return self.random.lognormvariate(math.log(median), sigma) * self.time_scale
+
+    def round_trip(self):
+        time.sleep(self.sample("api"))
+
+    def schedule(self, delay, action):
+        heapq.heappush(self.events, (time.time() + delay, next(self.sequence), action))
+
+    def advance(self):
+        now = time.time()
+        while self.events and self.events[0][0] <= now:
+            _, _, action = heapq.heappop(self.events)
+            action()
+
+    def call(self, request):
+        with self.lock:
+            self.calls[request.methodId] += 1
+            limit = self.quotas.get(request.methodId)
+            if limit is not None:
+                window = self.recent_calls.setdefault(request.methodId, deque())
+                now = time.time()
+                while window and window[0] <= now - 1:
+                    window.popleft()
+                if len(window) >= limit:
+                    raise http_error(429, "rateLimitExceeded", f"Quota exceeded for {request.methodId}")
+                window.append(now)
+            if self.random.random() < self.failure_rate:
+                raise http_error(503, "backendError", "Backend Error")
+            self.advance()
+            return request.handler()
+
+    def find(self, collection, name, kind):
+        if name not in collection:
+            raise http_error(404, "notFound", f"The resource '{kind}/{name}' was not found")
+        return collection[name]
+
+    def find_instance(self, zone, name):
+        return self.find(self.instance_store.get(zone, {}), name, f"zones/{zone}/instances")
+
+    def view(self, instance):
+        return {key: copy.deepcopy(value) for key, value in instance.items() if not key.startswith("_")}
+
+    def page(self, items, expression, max_results, page_token, kind):
+        items = [item for item in items if matches_filter(item, expression)]
+        start = int(page_token or 0)
+        result = {"kind": kind, "items": items[start:start + max_results]}
+        if start + max_results < len(items):
+            result["nextPageToken"] = str(start + max_results)
+        if not result["items"]:
+            del result["items"]
+        return result
+
+    def start_operation(self, project, operation_type, target_link, method_id, zone=None,
+                        delay=None, on_done=None, error=None):
+        name = "operation-%d-%08x" % (next(self.sequence), self.random.getrandbits(32))
+        now = time.time()
+        operation = {
+            "kind": "compute#operation",
+            "id": str(self.random.getrandbits(63)),
+            "name": name,
+            "operationType": operation_type,
+            "targetLink": target_link,
+            "status": "RUNNING",
+            "progress": 0,
+            "insertTime": timestamp(now),
+            "startTime": timestamp(now),
+        }
+        if zone:
+            operation["zone"] = f"https://www.googleapis.com/compute/v1/projects/{project}/zones/{zone}"
+        operation["selfLink"] = target_link.rsplit("/", 2)[0] + "/operations/" + name
+        if error is None and self.random.random() < self.operation_failure_rate:
+            error = ("INTERNAL_ERROR", "Injected operation failure")
+        self.operation_store[name] = operation
+
+        def finish():
+            operation["status"] = "DONE"
+            operation["progress"] = 100
+            operation["endTime"] = timestamp(time.time())
+            if error:
+                operation["error"] = {"errors": [{"code": error[0], "message": error[1]}]}
+            elif on_done:
+                on_done()
+        self.schedule(self.sample(method_id) if delay is None else delay, finish)
+        return copy.deepcopy(operation)
+
+    def view_operation(self, name):
+        return copy.deepcopy(self.find(self.operation_store, name, "operations"))
+
+    def wait_operation(self, name):
+        operation = self.find(self.operation_store, name, "operations")
+        deadline = time.time() + WAIT_TIMEOUT * self.time_scale
+        while operation["status"] != "DONE" and time.time() < deadline:
+            self.lock.release()
+            try:
+                time.sleep(min(0.05, max(deadline - time.time(), 0)))
+            finally:
+                self.lock.acquire()
+            self.advance()
+        return copy.deepcopy(operation)
+
+    # Resources
+
+    def self_link(self, project, path):
+        return f"https://www.googleapis.com/compute/v1/projects/{project}/{path}"
+
+    def insert_instances(self, project, zone, bodies, method_id):
+        zone_instances = self.instance_store.setdefault(zone, {})
+        for body in bodies:
+            if body["name"] in zone_instances:
+                raise http_error(409, "alreadyExists", f"The resource 'projects/{project}/zones/{zone}/instances/{body['name']}' already exists")
+        total = sum(len(instances) for instances in self.instance_store.values())
+        target_link = self.self_link(project, f"zones/{zone}/instances/{bodies[0]['name']}")
+        if self.max_instances is not None and total + len(bodies) > self.max_instances:
+            return self.start_operation(project, "insert", target_link, method_id, zone, delay=self.sample("api"),
+                                        error=("QUOTA_EXCEEDED", f"Quota 'INSTANCES' exceeded. Limit: {self.max_instances}"))
+
+        zone_disks = self.disk_store.get(zone, {})
+        for body in bodies:
+            if body["name"] in zone_disks:
+                return self.start_operation(
+                    project, "insert", target_link, method_id, zone, delay=self.sample("api"),
+                    error=("RESOURCE_ALREADY_EXISTS",
+                           f"The resource 'projects/{project}/zones/{zone}/disks/{body['name']}' already exists"))
+
+        capacity = self.zone_capacity.get(zone)
+        if capacity is not None and len(zone_instances) + len(bodies) > capacity:
+            return self.start_operation(project, "insert", target_link, method_id, zone, delay=self.sample("api"),
+                                        error=("ZONE_RESOURCE_POOL_EXHAUSTED",
+                                               f"The zone 'projects/{project}/zones/{zone}' does not have enough resources available to fulfill the request."))
+
+        delays = [self.sample(method_id) for _ in bodies]
+        for body, delay in zip(bodies, delays):
+            self.create_instance(project, zone, body, delay)
+        return self.start_operation(project, "bulkInsert" if len(bodies) > 1 else "insert", target_link, method_id,
+                                    zone, delay=max(delays))
+
+    def create_instance(self, project, zone, body, delay):
+        name = body["name"]
+        number = next(self.sequence)
+        tags = body.get("tags", {}).get("items", [])
+        metadata = {item["key"]: item["value"] for item in body.get("metadata", {}).get("items", [])}
+        if "startup-script-url" in metadata:
+            bucket, _, object_name = metadata["startup-script-url"][len("gs://"):].partition("/")
+            metadata["startup-script"] = self.find_object(bucket, object_name)["data"].decode()
+        disk = body["disks"][0]
+        ip = "198.%d.%d.%d" % (18 + number // 65536 % 2, number // 256 % 256, number % 256)
+        instance = {
+            "kind": "compute#instance",
+            "id": str(number),
+            "name": name,
+            "zone": self.self_link(project, f"zones/{zone}"),
+            "machineType": body["machineType"],
+            "status": "PROVISIONING",
+            "creationTimestamp": timestamp(time.time()),
+            "tags": {"items": tags, "fingerprint": fingerprint(tags)} if tags else {"fingerprint": EMPTY_FINGERPRINT},
+            "labels": dict(body.get("labels", {})),
+            "labelFingerprint": fingerprint(body.get("labels", {})),
+            "metadata": body.get("metadata", {}),
+            "disks": [{"boot": True, "autoDelete": disk.get("autoDelete", True), "deviceName": name,
+                       "source": self.self_link(project, f"zones/{zone}/disks/{name}")}],
+            "networkInterfaces": [{
+                "network": self.self_link(project, "global/networks/default"),
+                "accessConfigs": [{"type": "ONE_TO_ONE_NAT", "name": "External NAT",
+                                   "natIP": ip}],
+            }],
+            "selfLink": self.self_link(project, f"zones/{zone}/instances/{name}"),
+            "_ip": ip,
+            "_console": "",
+        }
+        self.instance_store[zone][name] = instance
+        self.addresses[ip] = instance
+        self.disk_store.setdefault(zone, {})[name] = {
+            "name": name, "status": "CREATING", "autoDelete": disk.get("autoDelete", True),
+            "labels": dict(disk.get("initializeParams", {}).get("labels", {})),
+            "users": [instance["selfLink"]],
+            "selfLink": instance["disks"][0]["source"],
+        }
+
+        def staging():
+            if instance["status"] == "PROVISIONING":
+                instance["status"] = "STAGING"
+
+        def running():
+            if instance["status"] == "STAGING":
+                instance["status"] = "RUNNING"
+                instance["lastStartTimestamp"] = timestamp(time.time())
+                self.disk_store[zone][name]["status"] = "READY"
+                script = metadata.get("startup-script", "")
+                boot = self.sample("boot" if "apt-get" in script else "boot-preinstalled")
+                self.run_startup_script(instance, script, boot)
+                self.schedule(boot, booted)
+
+        def booted():
+            if instance["status"] != "RUNNING":
+                return
+            if "shutdown -h now" in metadata.get("startup-script", ""):
+                instance["status"] = "TERMINATED"
+            else:
+                self.serving.add(instance["_ip"])
+
+        self.schedule(delay * 0.4, staging)
+        self.schedule(delay, running)
+
+    def run_startup_script(self, instance, script, duration):
+        """Print the kernel banner now and the script's stage markers over `duration`, as a VM would."""
+        instance["_console"] += "[    0.000000] Linux version 5.15.0-1042-gcp (buildd@lcy02-amd64-021)\n"
+        stages = STAGE_LINE.findall(script)
+        weights = [STAGE_WEIGHTS.get(stage, STAGE_WEIGHT) for stage in stages if stage != "done"]
+        elapsed = 0
+        for stage in stages:
+            # Stamped with when the stage starts, not when the event happens to be processed.
+            def mark(stage=stage, at=time.time() + elapsed):
+                instance["_console"] += f"google_metadata_script_runner: HW5-STAGE {stage} {at:.6f}\n"
+            self.schedule(elapsed, mark)
+            if stage != "done":
+                elapsed += duration * STAGE_WEIGHTS.get(stage, STAGE_WEIGHT) / sum(weights)
+
+    def serial_output(self, zone, name, start):
+        """getSerialPortOutput: the console from byte `start` on, and where the next read starts."""
+        console = self.find_instance(zone, name)["_console"]
+        start = min(start, len(console))
+        return {"kind": "compute#serialPortOutput", "contents": console[start:],
+                "start": str(start), "next": str(len(console))}
+
+    def set_tags(self, project, zone, name, body):
+        instance = self.find_instance(zone, name)
+        if body.get("fingerprint") != instance["tags"]["fingerprint"]:
+            raise http_error(412, "conditionNotMet", "Supplied fingerprint does not match current metadata fingerprint.")
+
+        def apply():
+            instance["tags"] = {"items": list(body.get("items", [])), "fingerprint": fingerprint(body.get("items", []))}
+        return self.start_operation(project, "setTags", instance["selfLink"], "compute.instances.setTags", zone,
+                                    on_done=apply)
+
+    def set_labels(self, project, zone, name, body):
+        instance = self.find_instance(zone, name)
+        if body.get("labelFingerprint") != instance["labelFingerprint"]:
+            raise http_error(412, "conditionNotMet", "Labels fingerprint either invalid or resource labels have changed")
+
+        def apply():
+            instance["labels"] = dict(body.get("labels", {}))
+            instance["labelFingerprint"] = fingerprint(instance["labels"])
+        return self.start_operation(project, "setLabels", instance["selfLink"], "compute.instances.setLabels", zone,
+                                    on_done=apply)
+
+    def park_instance(self, project, zone, name, method):
+        """suspend (memory kept, SUSPENDED) or stop (TERMINATED) a RUNNING instance."""
+        instance = self.find_instance(zone, name)
+        if instance["status"] != "RUNNING":
+            raise http_error(400, "resourceNotReady", f"The resource '{instance['selfLink']}' is not ready")
+        instance["status"] = "SUSPENDING" if method == "suspend" else "STOPPING"
+        self.serving.discard(instance["_ip"])
+
+        def parked():
+            instance["status"] = "SUSPENDED" if method == "suspend" else "TERMINATED"
+        return self.start_operation(project, method, instance["selfLink"], f"compute.instances.{method}", zone,
+                                    on_done=parked)
+
+    def wake_instance(self, project, zone, name, method):
+        """resume a SUSPENDED instance (the app is still up) or start a TERMINATED one (it boots again)."""
+        instance = self.find_instance(zone, name)
+        if instance["status"] != ("SUSPENDED" if method == "resume" else "TERMINATED"):
+            raise http_error(400, "resourceNotReady", f"The resource '{instance['selfLink']}' is not ready")
+        instance["status"] = "RESUMING" if method == "resume" else "STAGING"
+
+        def running():
+            instance["status"] = "RUNNING"
+            instance["lastStartTimestamp"] = timestamp(time.time())
+            if method == "resume":
+                self.serving.add(instance["_ip"])
+            else:
+                # The app is already installed on the disk; only the service starts.
+                self.schedule(self.sample("boot-preinstalled"), lambda: instance["status"] == "RUNNING"
+                              and self.serving.add(instance["_ip"]))
+        return self.start_operation(project, method, instance["selfLink"], f"compute.instances.{method}", zone,
+                                    on_done=running)
+
+    def delete_instance(self, project, zone, name):
+        instance = self.find_instance(zone, name)
+        instance["status"] = "STOPPING"
+
+        def remove():
+            self.instance_store[zone].pop(name, None)
+            self.serving.discard(instance["_ip"])
+            self.addresses.pop(instance["_ip"], None)
+            disk = self.disk_store.get(zone, {}).get(name)
+            if disk and disk["autoDelete"]:
+                del self.disk_store[zone][name]
+            elif disk:
+                disk["users"] = []
+        return self.start_operation(project, "delete", instance["selfLink"], "compute.instances.delete", zone,
+                                    on_done=remove)
+
+    def insert_firewall(self, project, body):
+        if body["name"] in self.firewall_store:
+            raise http_error(409, "alreadyExists", f"The resource 'projects/{project}/global/firewalls/{body['name']}' already exists")
+        rule = dict(copy.deepcopy(body), selfLink=self.self_link(project, f"global/firewalls/{body['name']}"))
+        return self.start_operation(project, "insert", rule["selfLink"], "compute.firewalls.insert",
+                                    on_done=lambda: self.firewall_store.setdefault(body["name"], rule))
+
+    def patch_firewall(self, project, name, body):
+        rule = self.find(self.firewall_store, name, "global/firewalls")
+        return self.start_operation(project, "patch", rule["selfLink"], "compute.firewalls.patch",
+                                    on_done=lambda: rule.update(copy.deepcopy(body)))
+
+    def create_snapshot(self, project, zone, disk, body):
+        self.find(self.disk_store.get(zone, {}), disk, f"zones/{zone}/disks")
+        snapshot = {"name": body["name"], "id": str(self.random.getrandbits(63)), "status": "READY",
+                    "sourceDisk": body.get("sourceDisk"), "labels": dict(body.get("labels", {})),
+                    "selfLink": self.self_link(project, f"global/snapshots/{body['name']}")}
+        return self.start_operation(project, "createSnapshot", self.disk_store[zone][disk]["selfLink"],
+                                    "compute.disks.createSnapshot", zone,
+                                    on_done=lambda: self.snapshot_store.setdefault(body["name"], snapshot))
+
+    def insert_image(self, project, body):
+        if body["name"] in self.image_store:
+            raise http_error(409, "alreadyExists", f"The resource 'projects/{project}/global/images/{body['name']}' already exists")
+        image = dict(copy.deepcopy(body), status="PENDING", creationTimestamp=timestamp(time.time()),
+                     selfLink=self.self_link(project, f"global/images/{body['name']}"))
+        if "sourceSnapshot" in body:
+            snapshot = self.find(self.snapshot_store, body["sourceSnapshot"].rsplit("/", 1)[-1], "global/snapshots")
+            image["sourceSnapshotId"] = snapshot["id"]
+        self.image_store[body["name"]] = image
+
+        def ready():
+            image["status"] = "READY"
+        return self.start_operation(project, "insert", image["selfLink"], "compute.images.insert", on_done=ready)
+
+    def insert_machine_image(self, project, body):
+        if body["name"] in self.machine_image_store:
+            raise http_error(409, "alreadyExists", f"The resource 'projects/{project}/global/machineImages/{body['name']}' already exists")
+        _, zone, _, name = body["sourceInstance"].rsplit("/", 4)[-4:]
+        source = self.view(self.find_instance(zone, name))
+        properties = {key: source[key] for key in ("machineType", "disks", "metadata", "tags", "labels", "networkInterfaces")}
+        machine_image = {"name": body["name"], "status": "CREATING", "sourceInstance": body["sourceInstance"],
+                         "sourceInstanceProperties": properties,
+                         "selfLink": self.self_link(project, f"global/machineImages/{body['name']}")}
+        self.machine_image_store[body["name"]] = machine_image
+
+        def ready():
+            machine_image["status"] = "READY"
+        return self.start_operation(project, "insert", machine_image["selfLink"], "compute.machineImages.insert",
+                                    on_done=ready)
+
+    def insert_instance_template(self, project, body):
+        if body["name"] in self.template_store:
+            raise http_error(409, "alreadyExists", f"The resource 'projects/{project}/global/instanceTemplates/{body['name']}' already exists")
+        template = dict(copy.deepcopy(body), selfLink=self.self_link(project, f"global/instanceTemplates/{body['name']}"))
+        return self.start_operation(project, "insert", template["selfLink"], "compute.instanceTemplates.insert",
+                                    on_done=lambda: self.template_store.setdefault(body["name"], template))
+
+    def instance_body(self, body, template_link=None):
+        """`body` completed from its instance template or machine image, as insert() does."""
+        base = {}
+        if template_link:
+            base = self.find(self.template_store, template_link.rsplit("/", 1)[-1], "global/instanceTemplates")["properties"]
+        elif "sourceMachineImage" in body:
+            base = self.find(self.machine_image_store, body["sourceMachineImage"].rsplit("/", 1)[-1],
+                             "global/machineImages")["sourceInstanceProperties"]
+        merged = copy.deepcopy(base)
+        merged.update(copy.deepcopy(body))
+        return merged
+
+    def insert_group(self, project, zone, body):
+        groups = self.group_store.setdefault(zone, {})
+        if body["name"] in groups:
+            raise http_error(409, "alreadyExists", f"The resource 'projects/{project}/zones/{zone}/instanceGroupManagers/{body['name']}' already exists")
+        self.find(self.template_store, body["instanceTemplate"].rsplit("/", 1)[-1], "global/instanceTemplates")
+        group = dict(copy.deepcopy(body), targetSize=body.get("targetSize", 0), _members=[], _project=project,
+                     selfLink=self.self_link(project, f"zones/{zone}/instanceGroupManagers/{body['name']}"))
+        groups[body["name"]] = group
+        return self.start_operation(project, "insert", group["selfLink"], "compute.instanceGroupManagers.insert", zone,
+                                    on_done=lambda: self.converge_group(project, zone, group))
+
+    def find_group(self, zone, name):
+        return self.find(self.group_store.get(zone, {}), name, f"zones/{zone}/instanceGroupManagers")
+
+    def resize_group(self, project, zone, name, size):
+        group = self.find_group(zone, name)
+        group["targetSize"] = size
+        return self.start_operation(project, "compute.instanceGroupManagers.resize", group["selfLink"],
+                                    "compute.instanceGroupManagers.resize", zone,
+                                    on_done=lambda: self.converge_group(project, zone, group))
+
+    def set_group_template(self, project, zone, name, body):
+        """Template of the members created from now on; existing members keep theirs."""
+        group = self.find_group(zone, name)
+        self.find(self.template_store, body["instanceTemplate"].rsplit("/", 1)[-1], "global/instanceTemplates")
+
+        def apply():
+            group["instanceTemplate"] = body["instanceTemplate"]
+        return self.start_operation(project, "compute.instanceGroupManagers.setInstanceTemplate", group["selfLink"],
+                                    "compute.instanceGroupManagers.setInstanceTemplate", zone, on_done=apply)
+
+    def converge_group(self, project, zone, group):
+        """Create or delete members until the group holds targetSize instances, like the group manager."""
+        members = group["_members"]
+        while len(members) < group["targetSize"]:
+            name = "%s-%s" % (group["baseInstanceName"],
+                              "".join(self.random.choice("abcdefghijklmnopqrstuvwxyz0123456789") for _ in range(4)))
+            if name in self.instance_store.get(zone, {}):
+                continue
+            body = self.instance_body({"name": name}, group["instanceTemplate"])
+            self.instance_store.setdefault(zone, {})
+            self.create_instance(project, zone, body, self.sample("compute.instances.insert"))
+            members.append(name)
+        while len(members) > group["targetSize"]:
+            self.delete_instance(project, zone, members.pop())
+
+    def managed_instances(self, zone, name):
+        group = self.find_group(zone, name)
+        zone_instances = self.instance_store.get(zone, {})
+        managed = []
+        for member in group["_members"]:
+            instance = zone_instances.get(member)
+            status = instance["status"] if instance else "PROVISIONING"
+            managed.append({
+                "instance": self.self_link(group["_project"], f"zones/{zone}/instances/{member}"),
+                "instanceStatus": status,
+                "currentAction": "NONE" if status == "RUNNING" else "CREATING",
+            })
+        deleting = [instance for instance in zone_instances.values()
+                    if instance["name"].startswith(group["baseInstanceName"] + "-")
+                    and instance["name"] not in group["_members"]]
+        for instance in deleting:
+            managed.append({"instance": instance["selfLink"], "instanceStatus": instance["status"], "currentAction": "DELETING"})
+        return {"managedInstances": managed} if managed else {}
+
+    def view_group(self, zone, name):
+        group = self.find_group(zone, name)
+        managed = self.managed_instances(zone, name).get("managedInstances", [])
+        actions = Counter(instance["currentAction"].lower() for instance in managed)
+        view = {key: copy.deepcopy(value) for key, value in group.items() if not key.startswith("_")}
+        view["currentActions"] = {action: actions.get(action, 0) for action in ("none", "creating", "deleting")}
+        view["status"] = {"isStable": len(group["_members"]) == group["targetSize"] and actions.get("none", 0) == len(managed)}
+        return view
+
+    def delete_group(self, project, zone, name):
+        group = self.find_group(zone, name)
+
+        def remove():
+            group["targetSize"] = 0
+            self.converge_group(project, zone, group)
+            del self.group_store[zone][name]
+        return self.start_operation(project, "delete", group["selfLink"], "compute.instanceGroupManagers.delete", zone,
+                                    on_done=remove)
+
+    def delete_disk(self, project, zone, name):
+        disk = self.find(self.disk_store.get(zone, {}), name, f"zones/{zone}/disks")
+        if disk.get("users"):
+            raise http_error(400, "resourceInUseByAnotherResource",
+                             f"The disk resource '{disk['selfLink']}' is already being used by '{disk['users'][0]}'")
+        return self.start_operation(project, "delete", disk["selfLink"], "compute.disks.delete", zone,
+                                    on_done=lambda: self.disk_store[zone].pop(name, None))
+
+    def delete_template(self, project, name):
+        template = self.find(self.template_store, name, "global/instanceTemplates")
+        for groups in self.group_store.values():
+            for group in groups.values():
+                if group["instanceTemplate"].rsplit("/", 1)[-1] == name:
+                    raise http_error(400, "resourceInUseByAnotherResource",
+                                     f"The instance_template resource '{template['selfLink']}' is already being used by '{group['selfLink']}'")
+        return self.delete_global(project, self.template_store, "instanceTemplates", name)
+
+    def delete_global(self, project, store, collection, name):
+        """Delete a global image, snapshot, machine image or instance template."""
+        resource = self.find(store, name, f"global/{collection}")
+        return self.start_operation(project, "delete", resource["selfLink"], f"compute.{collection}.delete",
+                                    on_done=lambda: store.pop(name, None))
+
+    def find_object(self, bucket, name):
+        if (bucket, name) not in self.object_store:
+            raise http_error(404, "notFound", f"No such object: {bucket}/{name}")
+        return self.object_store[(bucket, name)]
+
+    def insert_object(self, bucket, name, media_body, if_generation_match=None):
+        if if_generation_match == 0 and (bucket, name) in self.object_store:
+            raise http_error(412, "conditionNotMet", "At least one of the pre-conditions you specified did not hold.")
+        data = media_body.getbytes(0, media_body.size()) if media_body is not None else b""
+        resource = {
+            "kind": "storage#object",
+            "bucket": bucket,
+            "name": name,
+            "size": str(len(data)),
+            "md5Hash": base64.b64encode(hashlib.md5(data).digest()).decode(),
+            "generation": str(next(self.sequence)),
+            "selfLink": f"https://www.googleapis.com/storage/v1/b/{bucket}/o/{name}",
+        }
+        self.object_store[(bucket, name)] = {"resource": resource, "data": data}
+        return copy.deepcopy(resource)
+
+    def region_zones(self, region):
+        return self.regions_config.get(region, [f"{region}-{suffix}" for suffix in "bcd"])
+
+    def image_from_family(self, project, family):
+        own = [image for image in self.image_store.values() if image.get("family") == family and image["status"] == "READY"]
+        if own:
+            return copy.deepcopy(max(own, key=lambda image: image["creationTimestamp"]))
+        # Public families (ubuntu-os-cloud, ...) always resolve.
+        name = f"{family}-v20240101"
+        return {"name": name, "family": family, "status": "READY",
+                "selfLink": self.self_link(project, f"global/images/{name}")}
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+
+#
+# Lifecycle timelines: when each new instance entered PROVISIONING,
+# STAGING and RUNNING, so a clone's total can be split into scheduling,
+# staging (disk restore) and boot. A Watcher polls on a background thread
+# while the instances are created, either with one filtered, projected list
+# call per round for every instance whose name has a prefix, or with
+# batched gets of named instances, so following a thousand clones costs
+# about as many calls as following one. PROVISIONING and RUNNING are dated
+# by the server (creationTimestamp and lastStartTimestamp, the clock
+# readiness.py dates "running" by); only STAGING, which has no timestamp
+# of its own, is dated by the poll that first saw it.
+#
+#     with lifecycle.Watcher(compute, project, zone, name_prefix="demo-copy-") as watcher:
+#         ...insert the clones...
+#     print(lifecycle.summarize(watcher.timelines, records))
+#
+import re
+import threading
+import time
+
+import batch
+import readiness
+import tracing
+from scheduler import error_status
+
+STATUSES = ("PROVISIONING", "STAGING", "RUNNING")
+# (phase, from, to): "inserted" and "ready" come from readiness records.
+# PROVISIONING is the wait for a host and resources, STAGING the boot disk
+# being restored and attached, and RUNNING until ready the guest booting
+# and its startup script.
+PHASES = (
+    ("request", "inserted", "PROVISIONING"),
+    ("scheduling", "PROVISIONING", "STAGING"),
+    ("staging", "STAGING", "RUNNING"),
+    ("boot", "RUNNING", "ready"),
+)
+POLL_INTERVAL = 1
+RUNNING_DEADLINE = 10 * 60
+LIST_FIELDS = "items(name,status,creationTimestamp,lastStartTimestamp),nextPageToken"
+
+
+class Watcher:
+    """Records when each watched instance entered each of STATUSES.
+
+    With `name_prefix` every instance whose name starts with it is
+    watched; otherwise only the names passed to watch(). PROVISIONING and
+    RUNNING come from the instance's own timestamps. STAGING is when a
+    poll first saw it (at most one `interval` late), capped at the RUNNING
+    time for an instance that went through STAGING between two polls.
+    """
+
+    def __init__(self, compute, project, zone, name_prefix=None, interval=POLL_INTERVAL):
+        self.compute = compute
+        self.project = project
+        self.zone = zone
+        self.name_prefix = name_prefix
+        self.interval = interval
+        self.names = set()
+        self.timelines = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def watch(self, names):
+        with self.lock:
+            self.names.update(names)
+
+    def statuses(self):
+        """{name: instance} of the prefix's instances, or of the named ones not RUNNING yet."""
+        if self.name_prefix:
+            instances = self.compute.instances()
+            request = instances.list(project=self.project, zone=self.zone,
+                                     filter=f'(name eq "{re.escape(self.name_prefix)}.*")', fields=LIST_FIELDS)
+            found = {}
+            while request is not None:
+                response = request.execute()
+                found.update((item["name"], item) for item in response.get("items", []))
+                request = instances.list_next(previous_request=request, previous_response=response)
+            return found
+        with self.lock:
+            waiting = [name for name in self.names if "RUNNING" not in self.timelines.get(name, {})]
+        found = {}
+        for result in batch.get_instances(self.compute, self.project, self.zone, waiting):
+            if result.error is None:
+                found[result.key] = result.response
+            elif error_status(result.error) != 404:
+                print(f"Could not get {result.key}: {result.error}")
+        return found
+
+    def poll(self):
+        instances = self.statuses()
+        # Taken after the response, so STAGING is never dated before it could have been seen.
+        seen = time.time()
+        for name, instance in instances.items():
+            if instance["status"] not in STATUSES:
+                continue
+            reached = STATUSES[:STATUSES.index(instance["status"]) + 1]
+            with self.lock:
+                timeline = self.timelines.setdefault(name, {})
+                timeline.setdefault("PROVISIONING", readiness.parse_timestamp(instance["creationTimestamp"]))
+                if "RUNNING" in reached and "RUNNING" not in timeline:
+                    started = instance.get("lastStartTimestamp")
+                    timeline["RUNNING"] = readiness.parse_timestamp(started) if started else seen
+                if "STAGING" in reached:
+                    timeline.setdefault("STAGING", min(seen, timeline.get("RUNNING", seen)))
+
+    def running(self):
+        with self.lock:
+            expected = self.names | set(self.timelines)
+            return bool(expected) and all("RUNNING" in self.timelines.get(name, {}) for name in expected)
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.poll()
+            self.stopped.wait(self.interval)
+
+    def start(self):
+        self.thread = threading.Thread(target=tracing.bind(self.run), name="lifecycle-watcher", daemon=True)
+        self.thread.start()
+        return self
+
+    def finish(self, deadline=RUNNING_DEADLINE):
+        """Keep polling until every watched instance is RUNNING (or `deadline` passes), then stop."""
+        give_up = time.time() + deadline
+        while not self.running() and time.time() < give_up:
+            time.sleep(self.interval)
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        return self.timelines
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.finish()
+
+
+def phase_seconds(timeline, record=None):
+    """{phase: seconds} of one instance, for the phases whose both ends are known.
+
+    "inserted" and "ready" are client times and the rest server times, so a
+    phase shorter than the clock skew between them counts as zero rather
+    than negative.
+    """
+    points = dict(record or {}, **timeline)
+    return {phase: max(0.0, points[end] - points[begin])
+            for phase, begin, end in PHASES if begin in points and end in points}
+
+
+def summarize(timelines, records=None):
+    """p50/p95/max seconds per phase across instances, and each phase's share of the p50 total.
+
+    `records` are readiness records of the same instances (see
+    readiness.probe_ready), supplying the "inserted" and "ready" ends.
+    """
+    per_instance = [phase_seconds(timeline, (records or {}).get(name)) for name, timeline in timelines.items()]
+    summary = {}
+    for phase, _, _ in PHASES:
+        values = [seconds[phase] for seconds in per_instance if phase in seconds]
+        summary[phase] = {
+            "count": len(values),
+            "p50": readiness.percentile(values, 50),
+            "p95": readiness.percentile(values, 95),
+            "max": max(values) if values else None,
+        }
+    total = sum(stats["p50"] for stats in summary.values() if stats["count"])
+    for stats in summary.values():
+        stats["share"] = stats["p50"] / total if stats["count"] and total > 0 else None
+    return summary
+
+
+def dominant(summary):
+    """The phase with the largest p50, or None when nothing was measured."""
+    measured = [phase for phase, stats in summary.items() if stats["count"]]
+    return max(measured, key=lambda phase: summary[phase]["p50"]) if measured else None
+
+
+def print_summary(title, summary):
+    for phase, stats in summary.items():
+        if stats["count"]:
+            share = f"{stats['share']:.0%}" if stats["share"] is not None else "none"
+            print(f"--- {title}: {phase} p50 {stats['p50']:.2f} s, p95 {stats['p95']:.2f} s, "
+                  f"{share} of the p50 total ---")
+    if dominant(summary):
+        print(f"--- {title}: {dominant(summary)} dominates ---")
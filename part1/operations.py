@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+#
+# Shared waiter for Compute Engine operations (zonal, regional and global).
+#
+import time
+
+import batch
+
+# Adaptive backoff between polling rounds when several operations are in flight.
+MIN_POLL_DELAY = 0.5
+MAX_POLL_DELAY = 10
+POLL_BACKOFF = 1.5
+
+
+def operation_scope(operation, zone=None):
+    """Return ('zone'|'region'|'global', location) for an operation.
+
+    `operation` is either the resource returned by an insert/delete call or
+    just its name, in which case `zone` decides between zonal and global.
+    """
+    if isinstance(operation, str):
+        return ("zone", zone) if zone else ("global", None)
+    if operation.get("zone"):
+        return "zone", operation["zone"].rsplit("/", 1)[-1]
+    if operation.get("region"):
+        return "region", operation["region"].rsplit("/", 1)[-1]
+    return "global", None
+
+
+def operation_request(compute, project, operation, method="get", zone=None):
+    """Build a get/wait request for `operation` against the right collection."""
+    name = operation if isinstance(operation, str) else operation["name"]
+    scope, location = operation_scope(operation, zone)
+    if scope == "zone":
+        collection = compute.zoneOperations()
+        return getattr(collection, method)(project=project, zone=location, operation=name)
+    if scope == "region":
+        collection = compute.regionOperations()
+        return getattr(collection, method)(project=project, region=location, operation=name)
+    collection = compute.globalOperations()
+    return getattr(collection, method)(project=project, operation=name)
+
+
+class OperationWaiter:
+    """Track many in-flight operations and yield each one as it finishes.
+
+    Operations may be added while iterating, which lets callers keep a fixed
+    number of inserts in flight. A single outstanding operation is waited on
+    with the server-side `operations().wait` long-poll; while several are in
+    flight each round gets all of them in batched calls (batch.execute_batch,
+    which takes scheduler tokens and retries transient errors), sleeping
+    between rounds for a delay that grows from MIN_POLL_DELAY to
+    MAX_POLL_DELAY and snaps back whenever something finishes.
+    """
+
+    def __init__(self, compute, project, zone=None, raise_on_error=True):
+        self.compute = compute
+        self.project = project
+        self.zone = zone
+        self.raise_on_error = raise_on_error
+        self.pending = {}
+
+    def add(self, operation):
+        name = operation if isinstance(operation, str) else operation["name"]
+        self.pending[name] = operation
+
+    def __len__(self):
+        return len(self.pending)
+
+    def __iter__(self):
+        delay = MIN_POLL_DELAY
+        while self.pending:
+            method = "wait" if len(self.pending) == 1 else "get"
+
+            if method == "wait":
+                (name, operation), = self.pending.items()
+                results = [batch.BatchResult(
+                    name, operation_request(self.compute, self.project, operation, method, self.zone).execute(), None)]
+            else:
+                results = batch.execute_batch(self.compute, [
+                    (name, operation_request(self.compute, self.project, operation, method, self.zone))
+                    for name, operation in self.pending.items()
+                ])
+
+            finished = []
+            for result in results:
+                if result.error is not None:
+                    raise result.error
+                if result.response["status"] == "DONE":
+                    finished.append(result.response)
+                    del self.pending[result.key]
+
+            for result in finished:
+                if self.raise_on_error and "error" in result:
+                    raise Exception(result["error"])
+                yield result
+
+            if finished:
+                delay = MIN_POLL_DELAY
+            elif method == "get":
+                time.sleep(delay)
+                delay = min(delay * POLL_BACKOFF, MAX_POLL_DELAY)
+
+
+def wait_for_operations(compute, project, operations, zone=None, raise_on_error=True):
+    """Yield the final resource of each operation in the order they finish."""
+    waiter = OperationWaiter(compute, project, zone, raise_on_error)
+    for operation in operations:
+        waiter.add(operation)
+    return iter(waiter)
+
+
+def wait_for_operation(
+    compute: object,
+    project: str,
+    zone: str,
+    operation,
+) -> dict:
+    """Block until one operation is DONE and return it; raise if it failed."""
+    name = operation if isinstance(operation, str) else operation["name"]
+    print(f'Waiting for operation {name} to finish...')
+    for result in wait_for_operations(compute, project, [operation], zone):
+        print("done.")
+        return result
@@ -2,43 +2,122 @@
 
 import argparse
 import os
+import re
 import time
 from pprint import pprint
 
-import googleapiclient.discovery
-import google.auth
+import clients
+import console
+import lifecycle
+import tracing
+from artifacts import ArtifactStore, startup_script_item
+from operations import wait_for_operation
+from reconcile import reconcile_firewall_and_tags
 
-credentials, project = google.auth.default()
-#service = googleapiclient.discovery.build('compute', 'v1', credentials=credentials)
+def build_compute(credentials=None):
+    """Compute client for the backend named by $COMPUTE_BACKEND.
+
+    "fake" selects the in-process fakecompute backend for offline runs;
+    anything else (the default) talks to the real API, as `credentials`
+    (a zero-argument function returning them, so the fake never loads
+    any) or the application default credentials.
+    """
+    if os.environ.get("COMPUTE_BACKEND") == "fake":
+        return clients.cached_client("fakecompute", build_fake_compute)
+    return clients.compute_client(credentials and credentials())
+
+def build_fake_compute():
+    """FakeCompute from $FAKE_COMPUTE_CONFIG, sharing the process-wide scheduler.
+
+    The fake runs `time_scale` times faster than the real API, so unless
+    the config sets its own quotas (which are per real second) the
+    scheduler's rates are sped up to match; left at the real quota rates
+    they would dominate every fake run.
+    """
+    import fakecompute
+    import scheduler
+    compute = fakecompute.FakeCompute.from_env(scheduler.default())
+    if not compute.quotas and 0 < compute.time_scale < 1:
+        scheduler.default().scale(1 / compute.time_scale)
+    return compute
+
+def build_storage(credentials=None):
+    """Storage client for the same backend build_compute() would pick.
+
+    The fake backend also serves the objects collection, so instances it
+    creates can resolve their startup-script-url.
+    """
+    if os.environ.get("COMPUTE_BACKEND") == "fake":
+        return build_compute()
+    return clients.storage_client(credentials and credentials())
+
+def build_async_compute(concurrency=100):
+    """Async client for the same backend build_compute() would pick."""
+    import aiocompute
+    if os.environ.get("COMPUTE_BACKEND") == "fake":
+        return aiocompute.ThreadedAsyncCompute(build_compute(), concurrency)
+    return aiocompute.AsyncCompute(concurrency=concurrency)
+
+# Only the instance fields the orchestration reads; nextPageToken keeps
+# pagination working under the projection.
+INSTANCE_FIELDS = (
+    "items(name,status,tags,labels,creationTimestamp,lastStartTimestamp,"
+    "networkInterfaces/accessConfigs/natIP),nextPageToken"
+)
+
+def instance_filter(name=None, name_prefix=None, labels=None):
+    """Server-side list filter matching an exact name, a name prefix and/or labels."""
+    terms = []
+    if name:
+        terms.append(f'(name eq "{re.escape(name)}")')
+    if name_prefix:
+        terms.append(f'(name eq "{re.escape(name_prefix)}.*")')
+    for key, value in (labels or {}).items():
+        terms.append(f'(labels.{key} eq "{re.escape(value)}")')
+    return " ".join(terms) or None
+
+def iter_instances(compute, project, zone, name=None, name_prefix=None, labels=None,
+                   fields=INSTANCE_FIELDS, page_size=500):
+    """Lazily yield the instances matching the filter, following nextPageToken.
+
+    Filtering and the field projection happen on the server, so the cost
+    scales with the instances a run owns rather than the whole zone.
+    """
+    request = compute.instances().list(
+        project=project, zone=zone, filter=instance_filter(name, name_prefix, labels),
+        maxResults=page_size, fields=fields)
+    while request is not None:
+        response = request.execute()
+        yield from response.get("items", [])
+        request = compute.instances().list_next(previous_request=request, previous_response=response)
 
 #
 # Stub code - just lists all instances
 #
-def list_instances(compute, project, zone):
-    result = compute.instances().list(project=project, zone=zone).execute()
-    return result['items'] if 'items' in result else None
+def list_instances(compute, project, zone, **filters):
+    instances = list(iter_instances(compute, project, zone, **filters))
+    return instances or None
 
-def create_instance(
-    compute: object,
-    project: str,
-    zone: str,
-    name: str,
-    bucket: str,
-) -> str:
- 
-    # Get the latest Ubuntu image.
-    image_response = (
-        compute.images()
-        .getFromFamily(project="ubuntu-os-cloud", family="ubuntu-2204-lts")
-        .execute()
-    )
-    source_disk_image = image_response["selfLink"]
+def run_labels(name):
+    """Labels marking resources as created by the run named `name` (see part2/teardown.py)."""
+    value = re.sub(r"[^a-z0-9_-]", "-", name.lower())[:63]
+    return {RUN_LABEL: value}
+
+def instance_config(zone, name, bucket, source_disk_image, startup_script=None, artifacts=None, labels=None,
+                    tags=None):
+    """Body for instances().insert of the Flask VM booting `source_disk_image`.
 
+    With an `artifacts` store the startup script is uploaded to the bucket
+    and referenced by startup-script-url instead of being inlined. `labels`
+    go on both the instance and its boot disk; network `tags` set here need
+    no setTags call (and tag fingerprint) later.
+    """
     # Configure the machine
     machine_type = "zones/%s/machineTypes/f1-micro" % zone
-    startup_script = open(
-        os.path.join(os.path.dirname(__file__), "startup-script.sh")
-    ).read()
+    if startup_script is None:
+        startup_script = clients.read_script(
+            os.path.join(os.path.dirname(__file__), "startup-script.sh")
+        )
 
     config = {
         "name": name,
@@ -68,43 +147,40 @@ def create_instance(
         ],
         "metadata": {
             "items": [
-                {
-                    "key": "startup-script",
-                    "value": startup_script,
-                },
+                startup_script_item(artifacts, startup_script),
                 {"key": "bucket", "value": bucket},
             ]
         },
     }
-    print(f'Instance {name} created')
-    return compute.instances().insert(project=project, zone=zone, body=config).execute()
+    if labels:
+        config["labels"] = dict(labels)
+        config["disks"][0]["initializeParams"]["labels"] = dict(labels)
+    if tags:
+        config["tags"] = {"items": list(tags)}
+    return config
 
-def wait_for_operation(
+def create_instance(
     compute: object,
     project: str,
     zone: str,
-    operation: str,
-) -> dict:
-    print(f'Waiting for operation {operation} to finish...')
-    while True:
-        result = (
-            compute.zoneOperations()
-            .get(project=project, zone=zone, operation=operation)
-            .execute()
-        )
-
-        if result["status"] == "DONE":
-            print("done.")
-            if "error" in result:
-                raise Exception(result["error"])
-            return result
+    name: str,
+    bucket: str,
+    artifacts=None,
+    labels=None,
+    tags=None,
+) -> str:
+ 
+    # Get the latest Ubuntu image.
+    source_disk_image = clients.image_link(compute, "ubuntu-os-cloud", "ubuntu-2204-lts")
 
-        time.sleep(1)
+    config = instance_config(zone, name, bucket, source_disk_image, artifacts=artifacts, labels=labels, tags=tags)
+    print(f'Instance {name} created')
+    return compute.instances().insert(project=project, zone=zone, body=config).execute()
 
-def create_firewall_rule(compute, project, instance, zone,fingerprint):
-    print("creating firewall rule...")
-    target="allow-5000"
-    firewall_rule_body = {
+NETWORK_TAG = "allow-5000"
+# Label key holding the name of the run that created a resource.
+RUN_LABEL = "hw5-run"
+FIREWALL_RULE = {
     "name": "allow-5000",
     "allowed": [
         {
@@ -113,25 +189,8 @@ def create_firewall_rule(compute, project, instance, zone,fingerprint):
         }
     ],
     "sourceRanges": ["0.0.0.0/0"],  # Allow access from anywhere
-    "targetTags": ["allow-5000"],
-    }
-    try:
-        request = compute.firewalls().insert(project=project, body=firewall_rule_body)
-        response = request.execute()
-    except Exception as e:
-        print('Could not create firewall rule. Check if the rule already exists')
-        pass
-    
-    tags_body = {
-        "items": [
-            target
-        ],
-        "fingerprint": fingerprint
-    }
-    requestAdd = compute.instances().setTags(project=project, zone=zone, instance=instance, body=tags_body)
-    response = requestAdd.execute()
-    print("Network tag added to instance:-\n", instance)
-    
+    "targetTags": [NETWORK_TAG],
+}
 
 def main(
     project: str,
@@ -139,23 +198,44 @@ def main(
     zone: str,
     instance_name: str,
     wait=True,
+    inline_scripts=False,
+    timeline=False,
+    stages=False,
 ) -> None:
 
-    compute = googleapiclient.discovery.build("compute", "v1")
+    compute = build_compute()
+    store = None if inline_scripts else ArtifactStore(build_storage(), bucket)
+    watcher = None
+    if timeline:
+        watcher = lifecycle.Watcher(compute, project, zone)
+        watcher.watch([instance_name])
+        watcher.start()
     print("Creating new instance")
-    operation = create_instance(compute, project, zone, instance_name, bucket)
-    wait_for_operation(compute, project, zone, operation["name"])
+    started = time.time()
+    with tracing.step("create instance"):
+        operation = create_instance(compute, project, zone, instance_name, bucket, store)
+        wait_for_operation(compute, project, zone, operation["name"])
 
     print("Getting all the running instances")
-    instances = list_instances(compute, project, zone)
+    with tracing.step("list instances"):
+        instances = list_instances(compute, project, zone, name=instance_name)
     print(f"Instances in project {project} and zone {zone}:")
     for instance in instances:
         print(f'INSTANCE:- {instance["name"]}')
 
+    print("\nCreating firewall and network tags")
+    with tracing.step("firewall and tags"):
+        reconcile_firewall_and_tags(compute, project, zone, instances, FIREWALL_RULE)
     for instance in instances:
-        print("\nCreating firewall and network tags")
-        create_firewall_rule(compute,project,instance['name'],zone,instance['tags']['fingerprint'])
         print(f'External_IP_address:- {instance["networkInterfaces"][0]["accessConfigs"][0]["natIP"]}\n')
+    if watcher:
+        lifecycle.print_summary(instance_name, lifecycle.summarize(watcher.finish(), {instance_name: {"inserted": started}}))
+    if stages:
+        print("Reading startup-script stages from the serial console...")
+        with tracing.step("startup stages"):
+            durations = console.ConsoleReader(compute, project, zone, [instance_name]).follow()
+        console.print_summary(instance_name, console.summarize(durations))
+    tracing.finish()
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
@@ -169,6 +249,20 @@ if __name__ == '__main__':
         help='Compute Engine zone to deploy to.')
     parser.add_argument(
         '--name', default='demo-remote-instance', help='New instance name.')
+    parser.add_argument(
+        '--inline-scripts', action='store_true',
+        help='Put the startup script itself in metadata instead of uploading it to the bucket.')
+    parser.add_argument(
+        '--timeline', action='store_true',
+        help='Time the instance\'s PROVISIONING, STAGING and RUNNING phases.')
+    parser.add_argument(
+        '--stages', action='store_true',
+        help='Follow the serial console until the startup script is done and time each of its stages.')
+    parser.add_argument(
+        '--trace', metavar='PATH',
+        help='Record every Compute call as a span and write them to PATH (.jsonl, else Chrome trace JSON).')
     
     args = parser.parse_args()
-    main(args.project_id, args.bucket_name, args.zone, args.name)
\ No newline at end of file
+    tracing.enable(args.trace)
+    main(args.project_id, args.bucket_name, args.zone, args.name, inline_scripts=args.inline_scripts,
+         timeline=args.timeline, stages=args.stages)
\ No newline at end of file
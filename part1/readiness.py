@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+
+#
+# Time-to-ready probing: follow each instance from API-done to RUNNING to
+# the first successful HTTP response on the app port.
+#
+import datetime
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import batch
+import tracing
+
+APP_PORT = 5000
+PROBE_TIMEOUT = 2
+PROBE_INTERVAL = 1
+READY_DEADLINE = 30 * 60
+PROBE_WORKERS = 32
+
+# Timestamps recorded per instance, in the order they happen.
+PHASES = ("api_done", "running", "ready")
+
+
+def serves_http(ip, port=APP_PORT, timeout=PROBE_TIMEOUT):
+    try:
+        urllib.request.urlopen(f"http://{ip}:{port}/", timeout=timeout)
+        return True
+    except Exception:
+        return False
+
+
+def parse_timestamp(timestamp):
+    return datetime.datetime.fromisoformat(timestamp).timestamp()
+
+
+def running_latencies(instances, accepted):
+    """{name: seconds} from each instance's insert being accepted until it was RUNNING.
+
+    `accepted` maps an instance name to the insertTime of its insert (or
+    bulkInsert) operation and the end is the instance's lastStartTimestamp,
+    so both ends come from the server's clock and per-instance inserts and
+    bulkInsert are measured alike. Instances not RUNNING yet are left out.
+    """
+    latencies = {}
+    for instance in instances:
+        name = instance["name"]
+        if "lastStartTimestamp" in instance:
+            latencies[name] = parse_timestamp(instance["lastStartTimestamp"]) - accepted[name]
+            print(f"--- {name} was RUNNING after {latencies[name]} seconds ---")
+        else:
+            print(f"--- {name} is {instance['status']}, not RUNNING yet ---")
+    return latencies
+
+
+def running_time(instance, record):
+    """When `instance` started RUNNING: its server-side lastStartTimestamp, if
+    that belongs to this record's insert (or wake), else now."""
+    if "lastStartTimestamp" in instance:
+        started = parse_timestamp(instance["lastStartTimestamp"])
+        if started >= record["inserted"]:
+            return started
+    return time.time()
+
+
+class Prober:
+    """Probes instances in the background from the moment each one is added.
+
+    Records (see probe_ready) can be added while other instances are still
+    being created, so no clone's "running" or "ready" time includes waiting
+    for the rest. Each round batch-gets the added instances not yet RUNNING
+    and probes http://natIP:port/ on the running ones in parallel with short
+    timeouts. An instance that has not served `deadline` seconds after it
+    was added is given up on and keeps no "ready" entry. A backend that
+    cannot be reached over HTTP (fakecompute) supplies its own serves_http.
+    """
+
+    def __init__(self, compute, project, zone, port=APP_PORT, deadline=READY_DEADLINE):
+        self.compute = compute
+        self.project = project
+        self.zone = zone
+        self.port = port
+        self.deadline = deadline
+        self.probe = getattr(compute, "serves_http", serves_http)
+        self.records = {}
+        self.give_up = {}
+        self.waiting = set()
+        self.lock = threading.Lock()
+        self.closed = threading.Event()
+        self.thread = None
+
+    def add(self, name, record):
+        with self.lock:
+            self.records[name] = record
+            self.give_up[name] = time.time() + self.deadline
+            self.waiting.add(name)
+
+    def start(self):
+        self.thread = threading.Thread(target=tracing.bind(self.run), name=f"prober-{self.zone}", daemon=True)
+        self.thread.start()
+        return self
+
+    def wait(self):
+        """Let the instances added so far finish (or time out), then stop; returns the records."""
+        self.closed.set()
+        if self.thread is not None:
+            self.thread.join()
+        return self.records
+
+    def run(self):
+        with ThreadPoolExecutor(max_workers=PROBE_WORKERS) as pool:
+            while True:
+                with self.lock:
+                    waiting = list(self.waiting)
+                if not waiting and self.closed.is_set():
+                    return
+                if waiting:
+                    self.probe_round(pool, waiting)
+                time.sleep(PROBE_INTERVAL)
+
+    def probe_round(self, pool, waiting):
+        records = self.records
+        not_running = [name for name in waiting if "running" not in records[name]]
+        for result in batch.get_instances(self.compute, self.project, self.zone, not_running):
+            if result.error is None and result.response["status"] == "RUNNING":
+                records[result.key]["running"] = running_time(result.response, records[result.key])
+                records[result.key]["ip"] = result.response["networkInterfaces"][0]["accessConfigs"][0]["natIP"]
+
+        running = [name for name in waiting if "running" in records[name]]
+        served = pool.map(lambda name: self.probe(records[name]["ip"], self.port), running)
+        finished = set()
+        for name, ok in zip(running, served):
+            if ok:
+                records[name]["ready"] = time.time()
+                finished.add(name)
+                print(f'--- {name} served port {self.port} after {records[name]["ready"] - records[name]["inserted"]} seconds ---')
+        now = time.time()
+        for name in waiting:
+            if name not in finished and now > self.give_up[name]:
+                finished.add(name)
+                print(f'--- {name} did not serve port {self.port} within {self.deadline} seconds ---')
+        with self.lock:
+            self.waiting -= finished
+
+
+def probe_ready(compute, project, zone, records, port=APP_PORT, deadline=READY_DEADLINE):
+    """Fill in the "running" and "ready" timestamps of every record.
+
+    `records` maps instance name to a dict holding at least "inserted" and
+    "api_done" (time.time() values); all of them are probed at once (see
+    Prober) until they serve or `deadline` passes.
+    """
+    prober = Prober(compute, project, zone, port, deadline)
+    for name, record in records.items():
+        prober.add(name, record)
+    prober.start().wait()
+    return records
+
+
+def percentile(values, q):
+    """Linearly interpolated q-th percentile (0-100) of `values`."""
+    values = sorted(values)
+    if not values:
+        return None
+    k = (len(values) - 1) * q / 100
+    f = int(k)
+    c = min(f + 1, len(values) - 1)
+    return values[f] + (values[c] - values[f]) * (k - f)
+
+
+def summarize(records):
+    """p50/p95/max seconds from insert to each phase, across instances."""
+    summary = {}
+    for phase in PHASES:
+        values = [record[phase] - record["inserted"] for record in records.values() if phase in record]
+        summary[phase] = {
+            "count": len(values),
+            "p50": percentile(values, 50),
+            "p95": percentile(values, 95),
+            "max": max(values) if values else None,
+        }
+    return summary
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+#
+# Append-only benchmark history: one JSON line per measured series (a clone
+# strategy in one run) with the run's configuration and the raw per-clone
+# seconds, plus the statistics used to compare a run against a baseline.
+#
+import datetime
+import json
+import math
+import os
+import uuid
+
+import readiness
+
+# Metrics a record can hold: the clone latency (insert accepted until RUNNING) and
+# the readiness phases, in seconds from insert.
+METRICS = ("latency",) + readiness.PHASES
+# Configuration fields that must match for two series to be comparable.
+SERIES_FIELDS = ("command", "strategy", "zone", "machine_type", "concurrency", "copies", "engine", "baked")
+
+
+def new_run_id():
+    return datetime.datetime.now().strftime("%Y%m%dT%H%M%S-") + uuid.uuid4().hex[:6]
+
+
+def record(run_id, config, latencies, total, phase_records=None):
+    """One results line: `latencies` maps clone to seconds, `phase_records`
+    are readiness.probe_ready records of the same clones, if probed."""
+    metrics = {"latency": sorted(latencies.values())}
+    for phase in readiness.PHASES:
+        values = [item[phase] - item["inserted"] for item in (phase_records or {}).values() if phase in item]
+        if values:
+            metrics[phase] = sorted(values)
+    return {
+        "run": run_id,
+        "time": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "config": config,
+        "total": total,
+        "metrics": metrics,
+    }
+
+
+def append(path, records):
+    """Add `records` to the end of `path`; earlier lines are never rewritten."""
+    with open(path, "a") as results_file:
+        for item in records:
+            results_file.write(json.dumps(item, sort_keys=True) + "\n")
+        results_file.flush()
+        os.fsync(results_file.fileno())
+
+
+def load(path):
+    """Every record in `path`, oldest first. A torn last line (interrupted write) is skipped."""
+    if not os.path.exists(path):
+        return []
+    records = []
+    with open(path) as results_file:
+        for line in results_file:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    return records
+
+
+def series_key(item):
+    config = item["config"]
+    return tuple(config.get(field) for field in SERIES_FIELDS)
+
+
+def series_name(key):
+    return " ".join(field if value is True else str(value)
+                    for field, value in zip(SERIES_FIELDS, key) if value not in (None, False))
+
+
+def runs(records):
+    """Run ids in the order they were first recorded."""
+    return list(dict.fromkeys(item["run"] for item in records))
+
+
+def mann_whitney(baseline, current):
+    """One-sided Mann-Whitney U test that `current` tends to be larger than `baseline`.
+
+    Rank-based, so a few slow outliers do not dominate the way they would
+    in a t-test. Uses the normal approximation with tie and continuity
+    corrections; returns (U, p-value), or (U, None) when either side has
+    fewer than 3 values.
+    """
+    n1, n2 = len(baseline), len(current)
+    values = sorted([(value, 0) for value in baseline] + [(value, 1) for value in current])
+    ranks = [0.0] * len(values)
+    ties = 0
+    i = 0
+    while i < len(values):
+        j = i
+        while j + 1 < len(values) and values[j + 1][0] == values[i][0]:
+            j += 1
+        for k in range(i, j + 1):
+            ranks[k] = (i + j) / 2 + 1
+        ties += (j - i + 1) ** 3 - (j - i + 1)
+        i = j + 1
+    rank_sum = sum(rank for rank, (_, side) in zip(ranks, values) if side == 1)
+    u = rank_sum - n2 * (n2 + 1) / 2
+    if n1 < 3 or n2 < 3:
+        return u, None
+    n = n1 + n2
+    sigma = math.sqrt(n1 * n2 / 12 * ((n + 1) - ties / (n * (n - 1))))
+    if sigma == 0:
+        return u, 1.0
+    z = (u - n1 * n2 / 2 - 0.5) / sigma
+    return u, 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def compare(baseline, current, alpha=0.05, min_change=0.05):
+    """p50/p95 of both samples, the test result and a verdict.
+
+    A regression needs both a significant test (p < `alpha`) and a p50
+    slower by at least `min_change` (a fraction), so tiny but consistent
+    shifts on large samples are not flagged.
+    """
+    base_p50, p50 = readiness.percentile(baseline, 50), readiness.percentile(current, 50)
+    _, p_value = mann_whitney(baseline, current)
+    change = (p50 - base_p50) / base_p50 if base_p50 else 0.0
+    _, p_faster = mann_whitney(current, baseline)
+    if p_value is None:
+        verdict = "too few samples"
+    elif p_value < alpha and change >= min_change:
+        verdict = "REGRESSION"
+    elif p_faster < alpha and change <= -min_change:
+        verdict = "improved"
+    else:
+        verdict = "no significant change"
+    return {
+        "baseline": {"count": len(baseline), "p50": base_p50, "p95": readiness.percentile(baseline, 95)},
+        "current": {"count": len(current), "p50": p50, "p95": readiness.percentile(current, 95)},
+        "change": change,
+        "p_value": p_value,
+        "verdict": verdict,
+    }
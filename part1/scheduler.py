@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+
+#
+# Quota-aware scheduling for Compute Engine calls: every call first takes a
+# token from the bucket of its method, and transient failures (429, 403
+# rateLimitExceeded, 5xx, dropped connections) are retried with exponential
+# backoff and full jitter. Override the per-second rates with COMPUTE_RATES,
+# a JSON object mapping a method id or group ("read", "operation", "write")
+# to calls per second, e.g. COMPUTE_RATES='{"compute.instances.insert": 5}'.
+# Each executed call is also traced as one span (see tracing.py). Writes
+# are only retried safely because the clients give every call of a method
+# that takes one a requestId (see transport.py and aiocompute.py).
+#
+import json
+import os
+import random
+import threading
+import time
+from collections import Counter
+
+import tracing
+
+# Calls per second per method, kept under the default per-project
+# per-minute rate quotas of each request group.
+DEFAULT_RATES = {
+    "read": 20,
+    "operation": 30,
+    "write": 10,
+}
+READ_METHODS = ("get", "list", "aggregatedList", "getFromFamily", "getSerialPortOutput")
+
+MAX_RETRIES = 6
+BASE_DELAY = 0.5
+MAX_DELAY = 32
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+RATE_LIMIT_REASONS = (b"rateLimitExceeded", b"userRateLimitExceeded")
+
+
+def method_group(method_id):
+    collection, method = method_id.split(".")[-2:]
+    if collection.endswith("Operations"):
+        return "operation"
+    return "read" if method in READ_METHODS else "write"
+
+
+def error_status(error):
+    """HTTP status of a googleapiclient HttpError or aiocompute.AsyncComputeError."""
+    if hasattr(error, "resp"):
+        return error.resp.status
+    return getattr(error, "status", None)
+
+
+def error_content(error):
+    content = getattr(error, "content", b"") or b""
+    return content.encode() if isinstance(content, str) else content
+
+
+def is_rate_limited(error):
+    status = error_status(error)
+    return status == 429 or (status == 403 and any(reason in error_content(error) for reason in RATE_LIMIT_REASONS))
+
+
+def is_retryable(error):
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    return error_status(error) in RETRY_STATUSES or is_rate_limited(error)
+
+
+class TokenBucket:
+    """`rate` tokens per second, holding at most `burst` of them.
+
+    reserve() always succeeds and returns how long the caller must wait
+    before its token is valid, so synchronous and asyncio callers share it.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or rate
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return 0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def drain(self):
+        """Spend the remaining burst after the server pushed back."""
+        with self.lock:
+            self.tokens = min(self.tokens, 0)
+
+
+class Scheduler:
+    """Per-method token buckets plus jittered retries, with counters.
+
+    `counters` holds "calls" (attempts made), "throttled" (calls delayed by
+    their bucket), "rate_limited" (429/403 answers), "retried" and "failed"
+    (transient errors still failing after `max_retries`). Calls run by
+    execute() are recorded as spans on `tracer` (the process-wide one by
+    default).
+    """
+
+    def __init__(self, rates=None, max_retries=MAX_RETRIES, base_delay=BASE_DELAY, max_delay=MAX_DELAY,
+                 tracer=None):
+        self.rates = dict(DEFAULT_RATES, **(rates or {}))
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.buckets = {}
+        self.counters = Counter()
+        self.lock = threading.Lock()
+        self.tracer = tracer or tracing.default()
+
+    @classmethod
+    def from_env(cls):
+        return cls(json.loads(os.environ.get("COMPUTE_RATES", "{}")))
+
+    def scale(self, factor):
+        """Multiply every rate by `factor`, e.g. for a backend that runs faster than real time."""
+        with self.lock:
+            self.rates = {key: rate * factor for key, rate in self.rates.items()}
+            self.buckets = {}
+
+    def bucket(self, method_id):
+        with self.lock:
+            if method_id not in self.buckets:
+                rate = self.rates.get(method_id, self.rates[method_group(method_id)])
+                self.buckets[method_id] = TokenBucket(rate)
+            return self.buckets[method_id]
+
+    def count(self, key, amount=1):
+        with self.lock:
+            self.counters[key] += amount
+
+    def reserve(self, method_id):
+        delay = self.bucket(method_id).reserve()
+        self.count("calls")
+        if delay:
+            self.count("throttled")
+        return delay
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def should_retry(self, method_id, error, attempt):
+        """Record `error` and decide whether attempt number `attempt` gets another go."""
+        if is_rate_limited(error):
+            self.count("rate_limited")
+            self.bucket(method_id).drain()
+        if not is_retryable(error):
+            return False
+        if attempt < self.max_retries:
+            self.count("retried")
+            return True
+        self.count("failed")
+        return False
+
+    def execute(self, method_id, call):
+        """Run `call()` under the method's rate, retrying transient errors."""
+        with self.tracer.span(method_id) as span:
+            throttled = 0
+            for attempt in range(self.max_retries + 1):
+                delay = self.reserve(method_id)
+                throttled += delay
+                time.sleep(delay)
+                try:
+                    result = call()
+                    span.set(status=200, retries=attempt, throttled=throttled)
+                    return result
+                except Exception as error:
+                    span.set(status=error_status(error), retries=attempt, throttled=throttled)
+                    if not self.should_retry(method_id, error, attempt):
+                        raise
+                time.sleep(self.backoff(attempt))
+
+    async def execute_async(self, method_id, call):
+        """Coroutine version of execute(); `call()` returns an awaitable."""
+        import asyncio
+        with self.tracer.span(method_id) as span:
+            throttled = 0
+            for attempt in range(self.max_retries + 1):
+                delay = self.reserve(method_id)
+                throttled += delay
+                await asyncio.sleep(delay)
+                try:
+                    result = await call()
+                    span.set(status=200, retries=attempt, throttled=throttled)
+                    return result
+                except Exception as error:
+                    span.set(status=error_status(error), retries=attempt, throttled=throttled)
+                    if not self.should_retry(method_id, error, attempt):
+                        raise
+                await asyncio.sleep(self.backoff(attempt))
+
+    def summary(self):
+        with self.lock:
+            counters = dict(self.counters)
+        return ", ".join(f"{key} {counters.get(key, 0)}"
+                         for key in ("calls", "throttled", "rate_limited", "retried", "failed"))
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default():
+    """The process-wide scheduler shared by every client."""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = Scheduler.from_env()
+        return _default
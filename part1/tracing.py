@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+
+#
+# Per-call tracing: every Compute Engine call that goes through a
+# scheduler.Scheduler (or batch.execute_batch) becomes a span with its
+# method, latency, throttle wait, retries and HTTP status, attributed to
+# the workflow step it ran in. Steps are spans too, opened with
+#
+#     with tracing.step("snapshot"):
+#         ...
+#
+# Tracing is off unless a path is given, by --trace or COMPUTE_TRACE.
+# A path ending in .jsonl gets one span per line; anything else gets
+# Chrome trace-event JSON, to be opened in chrome://tracing or Perfetto.
+#
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+_current_step = contextvars.ContextVar("current_step", default=None)
+
+
+class Span:
+    """One timed call or step; `args` end up in the exported event."""
+
+    def __init__(self, name, category, step, args):
+        self.name = name
+        self.category = category
+        self.step = step
+        self.args = args
+        self.thread = threading.get_ident()
+        self.start = time.perf_counter()
+        self.end = None
+
+    def set(self, **args):
+        self.args.update(args)
+
+
+class _NullSpan:
+    def set(self, **args):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Tracer:
+    """Collects spans in memory and writes them out once with export().
+
+    A disabled tracer (no `path`) hands out NULL_SPAN and records nothing.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.spans = []
+        self.open_steps = []
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter()
+        self.epoch = time.time()
+
+    @property
+    def enabled(self):
+        return self.path is not None
+
+    def current_step(self):
+        """The step the calling code runs in.
+
+        Threads that were not started through bind() do not see the
+        caller's step, so they fall back to the innermost open one.
+        """
+        step = _current_step.get()
+        if step is None:
+            with self.lock:
+                step = self.open_steps[-1] if self.open_steps else None
+        return step
+
+    @contextmanager
+    def span(self, name, category="call", **args):
+        if not self.enabled:
+            yield NULL_SPAN
+            return
+        span = Span(name, category, self.current_step(), args)
+        try:
+            yield span
+        except BaseException as error:
+            span.args.setdefault("error", type(error).__name__)
+            raise
+        finally:
+            self.finish(span)
+
+    @contextmanager
+    def step(self, name, **args):
+        """Span covering a workflow step; calls made inside get it as their parent."""
+        if not self.enabled:
+            yield NULL_SPAN
+            return
+        with self.span(name, "step", **args) as span:
+            token = _current_step.set(name)
+            with self.lock:
+                self.open_steps.append(name)
+            try:
+                yield span
+            finally:
+                with self.lock:
+                    self.open_steps.remove(name)
+                _current_step.reset(token)
+
+    def record(self, name, start, end, category="call", step=None, **args):
+        """Add a span timed elsewhere (perf_counter values), e.g. one entry of a batch."""
+        if not self.enabled:
+            return
+        span = Span(name, category, step or self.current_step(), args)
+        span.start = start
+        self.finish(span, end)
+
+    def finish(self, span, end=None):
+        span.end = time.perf_counter() if end is None else end
+        with self.lock:
+            self.spans.append(span)
+
+    def events(self):
+        """The spans as Chrome trace events (complete "X" events, times in microseconds)."""
+        with self.lock:
+            spans = sorted(self.spans, key=lambda span: span.start)
+        threads = {}
+        events = []
+        for span in spans:
+            tid = threads.setdefault(span.thread, len(threads) + 1)
+            events.append({
+                "name": span.name,
+                "cat": span.category,
+                "ph": "X",
+                "ts": round((span.start - self.origin) * 1e6),
+                "dur": round((span.end - span.start) * 1e6),
+                "pid": os.getpid(),
+                "tid": tid,
+                "args": dict(span.args, step=span.step),
+            })
+        for ident, tid in threads.items():
+            events.append({"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid,
+                           "args": {"name": "main" if ident == threading.main_thread().ident else f"worker-{tid}"}})
+        return events
+
+    def rows(self):
+        """The spans as flat records: wall-clock start and durations in seconds."""
+        with self.lock:
+            spans = sorted(self.spans, key=lambda span: span.start)
+        return [dict(span.args, name=span.name, category=span.category, step=span.step,
+                     start=self.epoch + span.start - self.origin, duration=span.end - span.start)
+                for span in spans]
+
+    def export(self, path=None):
+        """Write the spans to `path` (default: the tracer's own) and return it."""
+        path = path or self.path
+        with open(path, "w") as trace_file:
+            if path.endswith(".jsonl"):
+                for row in self.rows():
+                    trace_file.write(json.dumps(row) + "\n")
+            else:
+                json.dump({"traceEvents": self.events(), "displayTimeUnit": "ms"}, trace_file)
+        return path
+
+    def summary(self):
+        """Call count and total seconds per method, slowest first."""
+        totals = {}
+        with self.lock:
+            for span in self.spans:
+                if span.category == "call":
+                    count, seconds = totals.get(span.name, (0, 0))
+                    totals[span.name] = (count + 1, seconds + span.end - span.start)
+        return "\n".join(f"  {name}: {count} calls, {seconds:.2f}s"
+                         for name, (count, seconds) in sorted(totals.items(), key=lambda item: -item[1][1]))
+
+
+def bind(function):
+    """Wrap `function` so that it runs in the caller's step, on whatever thread calls it.
+
+    For work handed to a ThreadPoolExecutor: pool.map(tracing.bind(work), items).
+    """
+    context = contextvars.copy_context()
+
+    @functools.wraps(function)
+    def run(*args, **kwargs):
+        return context.copy().run(function, *args, **kwargs)
+
+    return run
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default():
+    """The process-wide tracer, writing to $COMPUTE_TRACE if it is set."""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = Tracer(os.environ.get("COMPUTE_TRACE"))
+        return _default
+
+
+def enable(path):
+    """Turn the process-wide tracer on, e.g. from a --trace flag."""
+    if path:
+        default().path = path
+
+
+def step(name, **args):
+    return default().step(name, **args)
+
+
+def finish():
+    """Export the process-wide trace, if tracing is on, and print where it went."""
+    tracer = default()
+    if not tracer.enabled:
+        return
+    print(f"Trace of {len(tracer.spans)} spans written to {tracer.export()}")
+    print(tracer.summary())
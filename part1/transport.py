@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+#
+# Thread-safe transport for discovery clients. httplib2.Http is not
+# thread-safe, so every worker thread gets its own authorized connection
+# (kept alive and reused for all of that thread's calls) while all threads
+# share one credentials object and its token. Executed requests go through
+# a scheduler.Scheduler, which rate-limits and retries them; a request that
+# can carry a requestId gets one when it is built, so every retry of it
+# (directly or in a batch) is deduplicated by the server.
+#
+import threading
+import uuid
+from urllib.parse import quote
+
+import google_auth_httplib2
+import httplib2
+from googleapiclient.http import HttpRequest
+
+HTTP_TIMEOUT = 60
+
+
+class HttpPool:
+    """Hands out one keep-alive AuthorizedHttp per thread over shared credentials."""
+
+    def __init__(self, credentials, timeout=HTTP_TIMEOUT, scheduler=None):
+        self.credentials = credentials
+        self.scheduler = scheduler
+        self.timeout = timeout
+        self.local = threading.local()
+        self.token_lock = threading.Lock()
+        self.connections = 0
+
+    def get(self):
+        http = getattr(self.local, "http", None)
+        if http is None:
+            http = google_auth_httplib2.AuthorizedHttp(self.credentials, http=httplib2.Http(timeout=self.timeout))
+            self.local.http = http
+            with self.token_lock:
+                self.connections += 1
+        return http
+
+    def refresh_token(self):
+        """Refresh the shared token once, instead of once per racing thread."""
+        if self.credentials.valid:
+            return
+        with self.token_lock:
+            if not self.credentials.valid:
+                self.credentials.refresh(google_auth_httplib2.Request(httplib2.Http(timeout=self.timeout)))
+
+    def request_builder(self, request_id_methods=()):
+        """HttpRequest subclass whose transport is the calling thread's connection.
+
+        `http` is resolved when the request (or a batch holding it) executes,
+        so a request built on one thread can safely run on another. Requests
+        of `request_id_methods` without a requestId get a random one.
+        """
+        pool = self
+
+        class PooledHttpRequest(HttpRequest):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                if self.methodId in request_id_methods and "requestId=" not in self.uri:
+                    separator = "&" if "?" in self.uri else "?"
+                    self.uri += separator + "requestId=" + quote(str(uuid.uuid4()))
+
+            @property
+            def http(self):
+                pool.refresh_token()
+                return pool.get()
+
+            @http.setter
+            def http(self, value):
+                pass
+
+            def execute(self, http=None, num_retries=0):
+                call = lambda: HttpRequest.execute(self, http=http, num_retries=num_retries)
+                if pool.scheduler is None:
+                    return call()
+                return pool.scheduler.execute(self.methodId, call)
+
+        return PooledHttpRequest
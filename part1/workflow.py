@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+
+#
+# Provisioning workflows as a DAG of steps. Each step names the steps it
+# needs; run() starts a step on a worker thread as soon as all of those are
+# done, so independent steps (a firewall rule and the VM it is for, an image
+# and the clones of the snapshot it is made from) overlap instead of
+# queueing behind each other. plan() does not run anything: it prints the
+# schedule and critical path that the per-step estimates give.
+#
+#     flow = workflow.Workflow()
+#     flow.add("instance", create_instance, estimate=25)
+#     flow.add("firewall", create_firewall, estimate=8)
+#     flow.add("snapshot", create_snapshot, after=["instance"], estimate=30)
+#     results = flow.run()
+#
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import tracing
+
+
+class Step:
+    """One node: `function(results)` runs once every step in `after` is done.
+
+    `results` maps the name of each finished step to what its function
+    returned; `estimate` is the expected duration in seconds, for plan().
+    """
+
+    def __init__(self, name, function, after=(), estimate=0):
+        self.name = name
+        self.function = function
+        self.after = tuple(after)
+        self.estimate = estimate
+
+
+class Workflow:
+    """Steps added in dependency order and run as concurrently as the order allows."""
+
+    def __init__(self):
+        self.steps = {}
+        self.durations = {}
+
+    def add(self, name, function, after=(), estimate=0):
+        """Add a step after the steps it depends on, which keeps the graph acyclic."""
+        if name in self.steps:
+            raise ValueError(f"step {name!r} is already in the workflow")
+        missing = [dependency for dependency in after if dependency not in self.steps]
+        if missing:
+            raise ValueError(f"step {name!r} depends on unknown steps {missing}")
+        self.steps[name] = Step(name, function, after, estimate)
+        return self.steps[name]
+
+    def schedule(self, durations=None):
+        """{step: (earliest start, earliest finish)} with unlimited workers.
+
+        Durations default to the estimates; run() passes the measured ones.
+        """
+        durations = durations or {name: step.estimate for name, step in self.steps.items()}
+        times = {}
+        for name, step in self.steps.items():
+            start = max((times[dependency][1] for dependency in step.after), default=0)
+            times[name] = (start, start + durations.get(name, 0))
+        return times
+
+    def critical_path(self, durations=None):
+        """The chain of steps that bounds the total duration, and that duration."""
+        times = self.schedule(durations)
+        if not times:
+            return [], 0
+        name = max(times, key=lambda step: times[step][1])
+        total = times[name][1]
+        path = [name]
+        while self.steps[name].after:
+            # The dependency that finished last is the one the step waited for.
+            name = max(self.steps[name].after, key=lambda dependency: times[dependency][1])
+            path.append(name)
+        return path[::-1], total
+
+    def plan(self):
+        """Print when each step would start and finish, the critical path and the estimated duration."""
+        times = self.schedule()
+        path, total = self.critical_path()
+        sequential = sum(step.estimate for step in self.steps.values())
+        latest = self.latest_finishes(total)
+        print("| step | after | estimate | start | finish | slack |")
+        print("|---|---|---|---|---|---|")
+        for name, step in self.steps.items():
+            start, finish = times[name]
+            # How long the step could slip without delaying the whole run.
+            slack = latest[name] - finish
+            print("| %s | %s | %.0f | %.0f | %.0f | %.0f |" % (
+                name, ", ".join(step.after) or "-", step.estimate, start, finish, slack))
+        print(f"\nCritical path: {' -> '.join(path)}")
+        print(f"--- Estimated duration {total:.0f} seconds (one step at a time: {sequential:.0f} seconds) ---")
+        return path, total
+
+    def latest_finishes(self, total):
+        """{step: latest finish that still ends the workflow by `total`}."""
+        latest = {}
+        for name in reversed(list(self.steps)):
+            dependents = [other for other in self.steps.values() if name in other.after]
+            latest[name] = min((latest[other.name] - other.estimate for other in dependents), default=total)
+        return latest
+
+    def run(self, max_workers=8):
+        """Run every step, each as soon as its dependencies are done; returns {step: result}.
+
+        Every step is a tracing step of its own. If one fails, no further
+        steps are started; the ones already running are waited for and the
+        first error is raised.
+        """
+        results = {}
+        lock = threading.Lock()
+        pending = dict(self.steps)
+        running = {}
+        error = None
+        started = time.time()
+
+        def run_step(step):
+            step_started = time.time()
+            with tracing.step(step.name):
+                result = step.function(results)
+            with lock:
+                results[step.name] = result
+                self.durations[step.name] = time.time() - step_started
+            return result
+
+        with ThreadPoolExecutor(max_workers=max_workers) as workers:
+            while pending or running:
+                if error is None:
+                    for name, step in list(pending.items()):
+                        if all(dependency in results for dependency in step.after):
+                            del pending[name]
+                            running[workers.submit(tracing.bind(run_step), step)] = name
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    if future.exception() is not None and error is None:
+                        print(f"Step {name} failed: {future.exception()}")
+                        error = future.exception()
+        if error is not None:
+            raise error
+        path, _ = self.critical_path(self.durations)
+        print(f"--- Workflow took {time.time() - started} seconds; "
+              f"critical path {' -> '.join(path)} ---")
+        return results
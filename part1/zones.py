@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+#
+# Multi-zone placement: expand a region into its zones, spread instance
+# names across zones, and recognise zones that ran out of capacity.
+#
+import itertools
+
+PLACEMENTS = ("spread", "failover")
+
+# Operation error codes meaning the zone (not the request) is the problem.
+CAPACITY_ERRORS = (
+    "ZONE_RESOURCE_POOL_EXHAUSTED",
+    "ZONE_RESOURCE_POOL_EXHAUSTED_WITH_DETAILS",
+)
+# Quotas are per project or region, so another zone would refuse the same
+# clones; these errors are reported instead of failed over.
+QUOTA_ERRORS = ("QUOTA_EXCEEDED",)
+
+
+def region_zones(compute, project, region):
+    """Names of the zones in `region` that are UP."""
+    result = compute.regions().get(project=project, region=region).execute()
+    names = sorted(link.rsplit("/", 1)[-1] for link in result["zones"])
+    up = set()
+    for zone in names:
+        if compute.zones().get(project=project, zone=zone).execute().get("status", "UP") == "UP":
+            up.add(zone)
+    return [zone for zone in names if zone in up]
+
+
+def place(names, zones):
+    """Spread `names` round-robin over `zones`; returns {zone: [names]}."""
+    placement = {zone: [] for zone in zones}
+    for name, zone in zip(names, itertools.cycle(zones)):
+        placement[zone].append(name)
+    return placement
+
+
+def localize(properties, zone):
+    """Instance properties with the machine type moved to `zone`."""
+    if "machineType" not in properties:
+        return properties
+    machine_type = properties["machineType"].rsplit("/", 1)[-1]
+    return dict(properties, machineType="zones/%s/machineTypes/%s" % (zone, machine_type))
+
+
+def is_capacity_error(error):
+    """True if an operation `error` says the zone is out of resources."""
+    return any(item.get("code") in CAPACITY_ERRORS for item in error.get("errors", []))
+
+
+def is_quota_error(error):
+    """True if an operation `error` says a project or regional quota is used up."""
+    return any(item.get("code") in QUOTA_ERRORS for item in error.get("errors", []))
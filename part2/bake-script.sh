@@ -0,0 +1,40 @@
+#!/bin/bash
+# Bake stage: install everything the Flask app needs into the boot disk,
+# register it as a service and power off so the disk can become an image.
+# Stage markers on the serial console, timed by part1/console.py.
+stage() { echo "HW5-STAGE $1 $(date +%s.%N)" > /dev/ttyS0; }
+stage apt-update
+sudo apt-get update
+stage apt-install
+sudo apt-get install -y python3 python3-pip git
+stage git-clone
+sudo git clone https://github.com/cu-csci-4253-datacenter/flask-tutorial /opt/flask-tutorial
+cd /opt/flask-tutorial
+stage setup-install
+sudo python3 setup.py install
+stage pip-install
+sudo pip3 install -e .
+
+stage init-db
+export FLASK_APP=flaskr
+sudo -E flask init-db
+stage register-service
+
+sudo tee /etc/systemd/system/flaskr.service > /dev/null <<'UNIT'
+[Unit]
+Description=flask-tutorial app
+After=network-online.target
+
+[Service]
+WorkingDirectory=/opt/flask-tutorial
+Environment=FLASK_APP=flaskr
+ExecStart=/usr/local/bin/flask run -h 0.0.0.0
+Restart=on-failure
+
+[Install]
+WantedBy=multi-user.target
+UNIT
+sudo systemctl enable flaskr.service
+stage done
+
+sudo shutdown -h now
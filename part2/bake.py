@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+#
+# Bake an image with the Flask app pre-installed so clones boot straight
+# into serving instead of re-running the whole install at every boot.
+#
+import copy
+import os
+import time
+
+import clients
+import part1 as p1
+import console
+import readiness
+from operations import wait_for_operation, wait_for_operations
+
+# Baking runs apt/pip once; a bigger machine than the clones' f1-micro keeps
+# it short. The resulting image works with any machine type.
+BAKE_MACHINE_TYPE = "e2-medium"
+BAKE_TIMEOUT = 30 * 60
+IMAGE_FAMILY = "flask-baked"
+
+
+def read_script(name):
+    return clients.read_script(os.path.join(os.path.dirname(__file__), name))
+
+
+def bake_image(compute, project, zone, source_image_name, image_name, family=IMAGE_FAMILY):
+    """Run bake-script.sh on a throwaway VM and capture its disk as an image.
+
+    The bake VM boots from `source_image_name` (the image made from the base
+    snapshot), installs the app as a systemd service and powers itself off.
+    Returns the selfLink of the baked image.
+    """
+    bake_vm = image_name + "-vm"
+    config = {
+        "name": bake_vm,
+        "machineType": "zones/%s/machineTypes/%s" % (zone, BAKE_MACHINE_TYPE),
+        "disks": [
+            {
+                "boot": True,
+                "autoDelete": True,
+                "initializeParams": {
+                    "sourceImage": f"projects/{project}/global/images/{source_image_name}",
+                },
+            }
+        ],
+        "networkInterfaces": [
+            {
+                "network": "global/networks/default",
+                "accessConfigs": [{"type": "ONE_TO_ONE_NAT", "name": "External NAT"}],
+            }
+        ],
+        "metadata": {
+            "items": [
+                {"key": "startup-script", "value": read_script("bake-script.sh")},
+            ]
+        },
+    }
+    print(f'Baking image {image_name} on {bake_vm}...')
+    operation = compute.instances().insert(project=project, zone=zone, body=config).execute()
+    wait_for_operation(compute, project, zone, operation)
+
+    # The bake script shuts the VM down once everything is installed. Its
+    # console is read while it runs, to show where the install time goes.
+    reader = console.ConsoleReader(compute, project, zone, [bake_vm])
+    deadline = time.time() + BAKE_TIMEOUT
+    while True:
+        reader.poll()
+        instance = compute.instances().get(project=project, zone=zone, instance=bake_vm).execute()
+        if instance["status"] == "TERMINATED":
+            break
+        if time.time() > deadline:
+            raise Exception(f'{bake_vm} did not finish baking within {BAKE_TIMEOUT} seconds')
+        time.sleep(10)
+    reader.poll()
+    console.print_summary(bake_vm, console.summarize(reader.durations()))
+
+    image_body = {
+        "name": image_name,
+        "family": family,
+        "sourceDisk": f"projects/{project}/zones/{zone}/disks/{bake_vm}",
+    }
+    operation = compute.images().insert(project=project, body=image_body).execute()
+    wait_for_operation(compute, project, None, operation)
+    operation = compute.instances().delete(project=project, zone=zone, instance=bake_vm).execute()
+    wait_for_operation(compute, project, zone, operation)
+
+    image = compute.images().get(project=project, image=image_name).execute()
+    print(f'Baked image {image_name} is ready\n')
+    return image["selfLink"]
+
+
+def baked_instance_properties(instance_properties, image_link):
+    """Turn clone properties into ones that boot the baked image and only start the app."""
+    properties = copy.deepcopy(instance_properties)
+    properties["disks"][0]["initializeParams"] = {"sourceImage": image_link}
+    # The one-line start script stays inline, replacing a startup-script-url too.
+    items = [item for item in properties["metadata"]["items"] if not item["key"].startswith("startup-script")]
+    properties["metadata"]["items"] = [{"key": "startup-script", "value": read_script("startup-script-serve.sh")}] + items
+    return properties
+
+
+def measure_boot_saving(compute, project, zone, snapshot_properties, baked_properties, name_prefix):
+    """Create one snapshot clone and one baked clone side by side.
+
+    Returns the seconds from insert until each one served HTTP on port 5000,
+    keyed by "snapshot" and "baked".
+    """
+    print("Measuring time to serving for snapshot and baked clones...")
+    records = {}
+    operations = []
+    for source, properties in (("snapshot", snapshot_properties), ("baked", baked_properties)):
+        instance_config = dict(properties, name=f"{name_prefix}-{source}")
+        instance_config["tags"] = {"items": [p1.NETWORK_TAG]}
+        records[instance_config["name"]] = {"inserted": time.time()}
+        operations.append(compute.instances().insert(project=project, zone=zone, body=instance_config).execute())
+    for operation in wait_for_operations(compute, project, operations, zone):
+        records[operation["targetLink"].rsplit("/", 1)[-1]]["api_done"] = time.time()
+
+    readiness.probe_ready(compute, project, zone, records, deadline=BAKE_TIMEOUT)
+    boot_times = {}
+    for source in ("snapshot", "baked"):
+        record = records[f"{name_prefix}-{source}"]
+        if "ready" not in record:
+            raise Exception(f'{name_prefix}-{source} did not serve within {BAKE_TIMEOUT} seconds')
+        boot_times[source] = record["ready"] - record["inserted"]
+    return boot_times
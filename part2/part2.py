@@ -4,28 +4,53 @@ import argparse
 import sys
 import os
 import time
-from pprint import pprint
+import math
+from concurrent.futures import ThreadPoolExecutor
 
 main_script_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '../part1'))
 sys.path.append(main_script_dir)
 
 import part1 as p1
-import googleapiclient.discovery
-import google.auth
-from typing import Any
-
-credentials, project = google.auth.default()
-service = googleapiclient.discovery.build('compute', 'v1', credentials=credentials)
+from reconcile import reconcile_firewall
+import bake
+import batch
+import sources
+import readiness
+import results
+from operations import OperationWaiter, wait_for_operation
+import clients
+from artifacts import ArtifactStore, startup_script_item
+import zones
+import scheduler
+import tracing
+import workflow
+import lifecycle
+import console
 
 #
 # Stub code - just lists all instances
 #
 file_path = "part2/TIMING.md"
+# Every run's measurements are appended here; see report.py.
+results_path = "part2/results.jsonl"
 copies = 3
-
-def list_instances(compute, project, zone):
-    result = compute.instances().list(project=project, zone=zone).execute()
-    return result['items'] if 'items' in result else None
+# Threads issuing insert calls; each gets its own connection from the client's pool.
+INSERT_WORKERS = 16
+# Typical seconds each step of the workflow takes, for --plan.
+STEP_ESTIMATES = {
+    "base instance": 25,
+    "firewall": 10,
+    "snapshot": 35,
+    "image": 45,
+    "bake": 480,
+    "measure boot": 90,
+    "insert": 22,
+    "bulkInsert": 30,
+    "probe": 60,
+    "stages": 60,
+}
+# Extra seconds a clone source needs before the first insert (see sources.clone_source).
+SOURCE_ESTIMATES = {"snapshot": 0, "image": 0, "machine-image": 65, "template": 3}
 
 def create_instance(
     compute: object,
@@ -34,15 +59,10 @@ def create_instance(
     name: str,
     bucket: str,
 ) -> str:
-    image_response = (
-        compute.images()
-        .getFromFamily(project="ubuntu-os-cloud", family="ubuntu-2204-lts")
-        .execute()
-    )
-    source_disk_image = image_response["selfLink"]
+    source_disk_image = clients.image_link(compute, "ubuntu-os-cloud", "ubuntu-2204-lts")
 
     machine_type = "zones/%s/machineTypes/f1-micro" % zone
-    startup_script = open(os.path.join(os.path.dirname(__file__), "startup-script.sh")).read()
+    startup_script = clients.read_script(os.path.join(os.path.dirname(__file__), "startup-script.sh"))
 
     config = {
         "name": name,
@@ -82,51 +102,6 @@ def create_instance(
     }
     return compute.instances().insert(project=project, zone=zone, body=config).execute()
 
-def wait_for_operation(
-    compute: object,
-    project: str,
-    zone: str,
-    operation: str,
-) -> dict:
-    print(f'Waiting for operation {operation} to finish...')
-    while True:
-        result = (
-            compute.zoneOperations()
-            .get(project=project, zone=zone, operation=operation)
-            .execute()
-        )
-
-        if result["status"] == "DONE":
-            print("done.")
-            if "error" in result:
-                raise Exception(result["error"])
-            return result
-
-        time.sleep(1)
-
-def create_firewall_rule(compute, project, instance, zone,fingerprint):
-    target="allow-5000"
-    firewall_rule_body = {
-    "name": "allow-5000",
-    "allowed": [
-        {
-            "IPProtocol": "tcp",
-            "ports": ["5000"]
-        }
-    ],
-    "sourceRanges": ["0.0.0.0/0"],
-    "targetTags": [f"allow-5000"],
-    }
-    try:
-        request = compute.firewalls().insert(project=project, body=firewall_rule_body)
-        response = request.execute()
-    except Exception as e:
-        print('Could not create firewall rule. Check if the rule already exists')
-        pass
-
-    print("\nFirewall rule added to instance:-", instance)
-    return target
-
 def setTags(compute, project, instance, zone, fingerprint,target):
     tags_body = {
         "items": [
@@ -138,11 +113,13 @@ def setTags(compute, project, instance, zone, fingerprint,target):
     response = requestAdd.execute()
 
 
-def create_snapshot(compute,project, zone, disk_name, snapshot_name):
+def create_snapshot(compute,project, zone, disk_name, snapshot_name, labels=None):
     snapshot_body = {
         'name': snapshot_name,
         'sourceDisk': f'projects/{project}/zones/{zone}/disks/{disk_name}'
     }
+    if labels:
+        snapshot_body['labels'] = dict(labels)
 
     snapshot = compute.disks().createSnapshot(
         project=project,
@@ -154,18 +131,16 @@ def create_snapshot(compute,project, zone, disk_name, snapshot_name):
     # print(f'Snapshot created: {snapshot_name}')
     return snapshot
 
-def create_image_from_snapshot(compute, project, snapshot_name,image_name):
-    image_snapshot_body = {
-        "name": image_name,
-        "sourceSnapshot": "global/snapshots/%s"%(snapshot_name)
-    }
-    return compute.images().insert(project=project, body=image_snapshot_body).execute()
+def snapshot_instance_properties(project, zone, snapshot_name, bucket, artifacts=None, labels=None):
+    """Instance body shared by every clone restored from `snapshot_name`.
 
-def create_instance_from_snapshot(compute, project, zone, instance_name, snapshot_name,bucket):
+    With an `artifacts` store the startup script is referenced by URL, so
+    every clone's insert carries a short link instead of the script.
+    `labels` go on the clones and their disks, so teardown.py finds both.
+    """
     source_snapshot_url = f"projects/{project}/global/snapshots/{snapshot_name}"
-    startup_script = open(os.path.join(os.path.dirname(__file__), "startup-script.sh")).read()
-    instance_config = {
-        "name": instance_name,
+    startup_script = clients.read_script(os.path.join(os.path.dirname(__file__), "startup-script.sh"))
+    properties = {
         "machineType": f"zones/%s/machineTypes/f1-micro" % zone,
         "disks": [
             {
@@ -194,16 +169,326 @@ def create_instance_from_snapshot(compute, project, zone, instance_name, snapsho
         ],
         "metadata": {
             "items": [
-                {
-                    "key": "startup-script",
-                    "value": startup_script,
-                },
+                startup_script_item(artifacts, startup_script),
                  {"key": "bucket", "value": bucket},
             ]
         }
     }
-    response = compute.instances().insert(project=project, zone=zone, body=instance_config).execute()
-    return response
+    if labels:
+        properties["labels"] = dict(labels)
+        properties["disks"][0]["initializeParams"]["labels"] = dict(labels)
+    return properties
+
+def create_instances_bulk(compute, project, zone, name_pattern, count, instance_properties, network_tag):
+    """Provision `count` clones with a single instances().bulkInsert request.
+
+    `name_pattern` uses `#` placeholders for the sequence number, e.g.
+    "demo-bulk-####". The tag goes straight into the shared properties so no
+    setTags round trip is needed afterwards.
+    """
+    instance_properties = dict(instance_properties)
+    # bulkInsert takes the bare machine type name, not a zonal URL.
+    instance_properties["machineType"] = "f1-micro"
+    instance_properties["tags"] = {"items": [network_tag]}
+    bulk_body = {
+        "count": count,
+        "namePattern": name_pattern,
+        "instanceProperties": instance_properties,
+    }
+    return compute.instances().bulkInsert(project=project, zone=zone, body=bulk_body).execute()
+
+def clone_instances_bulk(compute, project, zone, name_pattern, count, instance_properties, network_tag, prober=None):
+    """Create the clones with bulkInsert and report each one's RUNNING time.
+
+    The RUNNING time of a clone is measured as in clone_instances (see
+    readiness.running_latencies), from the moment the bulkInsert operation
+    was accepted. Only clones with this run's labels that did not exist
+    before the request are counted, so clones a previous run left behind
+    under the same name pattern are not. Returns the per-clone RUNNING times, the
+    per-clone readiness records (see readiness.probe_ready) and the total
+    wall-clock time. With a `prober` the clones are probed as soon as the
+    operation is done.
+    """
+    prefix = name_pattern.rstrip("#")
+    labels = instance_properties.get("labels")
+    existing = {clone["name"] for clone in p1.iter_instances(compute, project, zone, name_prefix=prefix, labels=labels)}
+    start_time = time.time()
+    operation = create_instances_bulk(compute, project, zone, name_pattern, count, instance_properties, network_tag)
+    result = wait_for_operation(compute, project, zone, operation)
+    api_done = time.time()
+    accepted = readiness.parse_timestamp(result["insertTime"])
+
+    clones = [clone for clone in p1.iter_instances(compute, project, zone, name_prefix=prefix, labels=labels)
+              if clone["name"] not in existing]
+    records = {}
+    for clone in clones:
+        records[clone["name"]] = {"inserted": start_time, "api_done": api_done}
+        if prober:
+            prober.add(clone["name"], records[clone["name"]])
+    latencies = readiness.running_latencies(clones, {clone["name"]: accepted for clone in clones})
+    return latencies, records, time.time() - start_time
+
+def clone_estimate(copies, concurrency, source, zone_count=1):
+    """Seconds to clone `copies` instances from `source`, `concurrency` inserts at a time per zone."""
+    return SOURCE_ESTIMATES[source] + math.ceil(copies / zone_count / concurrency) * STEP_ESTIMATES["insert"]
+
+def clone_instances(compute, project, zone, new_instance_names, instance_properties, fingerprint, network_tag, concurrency=1,
+                    insert_params=None, failures=None, prober=None):
+    """Create clones from `instance_properties` keeping up to `concurrency` inserts in flight.
+
+    Inserts are issued up front (bounded by the concurrency limit) from up to
+    INSERT_WORKERS threads sharing the pooled client, and the outstanding
+    operations are tracked by one OperationWaiter, so N clones no longer cost
+    N back-to-back provisioning latencies. `insert_params` are extra
+    insert() arguments (see sources.clone_source); clones whose properties
+    already carry `network_tag` skip the setTags call. When a `failures`
+    dict is given, clones whose operation fails are recorded there (name to
+    operation error) instead of aborting the run. With a `prober` (a
+    readiness.Prober) each clone is probed from its api_done on, while the
+    others are still being created. Returns the latency of each clone (its
+    insert accepted until RUNNING, see readiness.running_latencies, the same
+    measure as clone_instances_bulk), the per-clone readiness records (see
+    readiness.probe_ready) and the total wall-clock time.
+    """
+    pending = list(new_instance_names)
+    in_flight = {}
+    accepted = {}
+    records = {}
+    waiter = OperationWaiter(compute, project, zone, raise_on_error=failures is None)
+    start_time = time.time()
+
+    def insert(new_instance_name):
+        print("new instance: " + new_instance_name)
+        started = time.time()
+        instance_config = dict(instance_properties, name=new_instance_name)
+        operation = compute.instances().insert(
+            project=project, zone=zone, body=instance_config, **(insert_params or {})).execute()
+        return new_instance_name, started, operation
+
+    def issue_inserts(workers):
+        free = concurrency - len(in_flight)
+        names, pending[:] = pending[:free], pending[free:]
+        for new_instance_name, started, operation in workers.map(tracing.bind(insert), names):
+            in_flight[operation['name']] = (new_instance_name, started)
+            waiter.add(operation)
+
+    with ThreadPoolExecutor(max_workers=min(concurrency, INSERT_WORKERS)) as workers:
+        issue_inserts(workers)
+        for result in waiter:
+            new_instance_name, started = in_flight.pop(result['name'])
+            if "error" in result:
+                failures[new_instance_name] = result["error"]
+                print(f"--- {new_instance_name} failed: {result['error']} ---")
+                issue_inserts(workers)
+                continue
+            records[new_instance_name] = {"inserted": started, "api_done": time.time()}
+            accepted[new_instance_name] = readiness.parse_timestamp(result["insertTime"])
+            if prober:
+                prober.add(new_instance_name, records[new_instance_name])
+            if network_tag not in instance_properties.get("tags", {}).get("items", []):
+                setTags(compute, project, new_instance_name, zone, fingerprint, network_tag)
+            print(f"--- {new_instance_name} took {time.time() - started} seconds ---")
+            issue_inserts(workers)
+    clones = [result.response for result in batch.get_instances(compute, project, zone, list(accepted))
+              if result.error is None]
+    latencies = readiness.running_latencies(clones, accepted)
+    return latencies, records, time.time() - start_time
+
+
+def deploy_zones(compute, project, clone_zones, new_instance_names, instance_properties, fingerprint, network_tag,
+                 concurrency=1, insert_params=None, policy="spread", probers=None):
+    """Clone into every zone of `clone_zones` at the same time.
+
+    Names are spread round-robin (zones.place) and each zone runs its own
+    clone_instances, with its own OperationWaiter and up to `concurrency`
+    inserts in flight, on a worker thread. A zone that refuses clones for lack
+    of capacity is marked capacity-limited; with the "failover" policy its
+    refused clones are placed again on the zones that still have room. A
+    quota error is raised once every zone has finished, since no other zone
+    of the project would accept those clones either. `probers`, if given, maps a zone to the readiness.Prober of its clones.
+    Returns {zone: {"latencies", "records", "total", "placed", "refused",
+    "capacity_limited"}}.
+    """
+    results = {zone: {"latencies": {}, "records": {}, "total": 0, "placed": 0, "refused": {}, "capacity_limited": False}
+               for zone in clone_zones}
+    remaining = list(new_instance_names)
+    healthy = list(clone_zones)
+    while remaining and healthy:
+        placement = zones.place(remaining, healthy)
+
+        def deploy(zone):
+            failures = {}
+            with tracing.step(f"zone {zone}", clones=len(placement[zone])):
+                latencies, records, total = clone_instances(
+                    compute, project, zone, placement[zone], zones.localize(instance_properties, zone),
+                    fingerprint, network_tag, concurrency, insert_params, failures, (probers or {}).get(zone))
+            return zone, latencies, records, total, failures
+
+        remaining = []
+        quota_errors = []
+        busy = [zone for zone in healthy if placement[zone]]
+        with ThreadPoolExecutor(max_workers=len(busy)) as pool:
+            for zone, latencies, records, total, failures in pool.map(tracing.bind(deploy), busy):
+                result = results[zone]
+                result["latencies"].update(latencies)
+                result["records"].update(records)
+                result["total"] += total
+                result["placed"] += len(placement[zone])
+                result["refused"].update(failures)
+                refused = [name for name, error in failures.items() if zones.is_capacity_error(error)]
+                if refused:
+                    print(f"Zone {zone} is capacity-limited: {len(refused)} clones refused")
+                    result["capacity_limited"] = True
+                    remaining.extend(refused)
+                quota_errors.extend(error for error in failures.values() if zones.is_quota_error(error))
+        if quota_errors:
+            raise Exception(f'{len(quota_errors)} clones exceeded a quota: {quota_errors[0]["errors"][0]["message"]}')
+        if policy != "failover":
+            break
+        healthy = [zone for zone in healthy if not results[zone]["capacity_limited"]]
+    if remaining:
+        print(f"{len(remaining)} clones could not be placed in any zone")
+    return results
+
+
+def record_results(run_config, sections, section_configs, phase_records):
+    """Append one results line per section to results_path.
+
+    `run_config` is shared by every section and `section_configs` holds
+    what differs per section title (strategy, zone); `phase_records` maps a
+    title to its readiness records when the clones were probed.
+    """
+    run_id = results.new_run_id()
+    results.append(results_path, [
+        results.record(run_id, dict(run_config, **section_configs.get(title, {})), latencies, total_time,
+                       phase_records.get(title))
+        for title, latencies, total_time in sections
+    ])
+    print(f"Results of run {run_id} appended to {results_path} (compare with part2/report.py)")
+
+
+def machine_type_name(properties):
+    return properties.get("machineType", "").rsplit("/", 1)[-1] or None
+
+
+def write_timing(sections, boot_times=None, readiness_summaries=None, zone_results=None, lifecycles=None,
+                 stage_summaries=None):
+    """Write each clone mode's latencies to TIMING.md, with a summary table.
+
+    TIMING.md only describes the latest run; the history is in results_path.
+
+    `boot_times` optionally maps "snapshot"/"baked" to the seconds from
+    insert until the clone served HTTP on port 5000. `readiness_summaries`
+    maps a section title to its readiness.summarize() result,
+    `zone_results` is what deploy_zones returned, and `lifecycles` and
+    `stage_summaries` map a section title to its lifecycle.summarize() and
+    console.summarize() result.
+    """
+    with open(file_path, "w") as md_file:
+        for title, latencies, total_time in sections:
+            md_file.write(f"## {title}\n\n")
+            for i, latency in enumerate(latencies.values()):
+                md_file.write("--- Clone %d took %s seconds ---\n" % (i+1, latency))
+            md_file.write("--- %d clones took %s seconds in total ---\n\n" % (len(latencies), total_time))
+
+        md_file.write("| mode | clones | mean clone latency (s) | max clone latency (s) | total wall-clock (s) |\n")
+        md_file.write("|---|---|---|---|---|\n")
+        for title, latencies, total_time in sections:
+            values = list(latencies.values()) or [0]
+            md_file.write("| %s | %d | %.2f | %.2f | %.2f |\n"
+                          % (title, len(latencies), sum(values) / len(values), max(values), total_time))
+
+        if boot_times:
+            md_file.write("\n## Time to serving\n\n")
+            for source, seconds in boot_times.items():
+                md_file.write("--- Clone from %s served port 5000 after %s seconds ---\n" % (source, seconds))
+            md_file.write("--- Baking saved %s seconds per clone ---\n"
+                          % (boot_times["snapshot"] - boot_times["baked"]))
+
+        if readiness_summaries:
+            md_file.write("\n## Time to ready (seconds from insert)\n\n")
+            md_file.write("| mode | phase | clones | p50 | p95 | max |\n")
+            md_file.write("|---|---|---|---|---|---|\n")
+            for title, summary in readiness_summaries.items():
+                for phase, stats in summary.items():
+                    if stats["count"]:
+                        md_file.write("| %s | %s | %d | %.2f | %.2f | %.2f |\n"
+                                      % (title, phase, stats["count"], stats["p50"], stats["p95"], stats["max"]))
+
+        if zone_results:
+            md_file.write("\n## Zones\n\n")
+            md_file.write("| zone | placed | created | refused | capacity-limited | p50 clone latency (s) | max clone latency (s) | wall-clock (s) |\n")
+            md_file.write("|---|---|---|---|---|---|---|---|\n")
+            for zone, result in zone_results.items():
+                values = list(result["latencies"].values()) or [0]
+                md_file.write("| %s | %d | %d | %d | %s | %.2f | %.2f | %.2f |\n"
+                              % (zone, result["placed"], len(result["latencies"]), len(result["refused"]),
+                                 "yes" if result["capacity_limited"] else "no",
+                                 readiness.percentile(values, 50), max(values), result["total"]))
+
+        if lifecycles:
+            md_file.write("\n## Lifecycle phases (seconds)\n\n")
+            md_file.write("| mode | phase | clones | p50 | p95 | max | share of p50 total |\n")
+            md_file.write("|---|---|---|---|---|---|---|\n")
+            for title, summary in lifecycles.items():
+                for phase, stats in summary.items():
+                    if stats["count"]:
+                        share = "%.0f%%" % (stats["share"] * 100) if stats["share"] is not None else "-"
+                        md_file.write("| %s | %s | %d | %.2f | %.2f | %.2f | %s |\n"
+                                      % (title, phase, stats["count"], stats["p50"], stats["p95"], stats["max"], share))
+            md_file.write("\n")
+            for title, summary in lifecycles.items():
+                md_file.write("--- %s: %s dominates ---\n" % (title, lifecycle.dominant(summary)))
+
+        if stage_summaries:
+            md_file.write("\n## Startup-script stages (seconds, from the serial console)\n\n")
+            md_file.write("| mode | stage | clones | p50 | p95 | max |\n")
+            md_file.write("|---|---|---|---|---|---|\n")
+            for title, summary in stage_summaries.items():
+                for stage, stats in summary.items():
+                    md_file.write("| %s | %s | %d | %.2f | %.2f | %.2f |\n"
+                                  % (title, stage, stats["count"], stats["p50"], stats["p95"], stats["max"]))
+
+
+async def main_async(project, bucket, zone, instance_name, copies, concurrency):
+    """part2's workflow on the asyncio engine (see part1/aiocompute.py).
+
+    The firewall rule is ensured while the base instance provisions, tags go
+    in the insert bodies, and the clones overlap on one event loop.
+    """
+    # Imported here, so the sync engine does not pay for loading asyncio and aiohttp.
+    import asyncio
+    import aiocompute
+    labels = p1.run_labels(instance_name)
+    async with p1.build_async_compute(concurrency) as client:
+        print("Creating instance.")
+        image = await client.call("images.getFromFamily", project="ubuntu-os-cloud", family="ubuntu-2204-lts")
+        config = p1.instance_config(zone, instance_name, bucket, image["selfLink"], labels=labels)
+        config["tags"] = {"items": [p1.NETWORK_TAG]}
+        instance, _ = await asyncio.gather(
+            aiocompute.provision(client, project, zone, config),
+            aiocompute.ensure_firewall(client, project, p1.FIREWALL_RULE))
+        print(f'INSTANCE:- {instance["name"]}')
+        print(f'External_IP_address:- {instance["networkInterfaces"][0]["accessConfigs"][0]["natIP"]}\n')
+
+        snapshot_name = "base-snapshot-"+instance_name
+        image_name = "image-from-snapshot1"
+        print(f'Creating snapshot {snapshot_name} and image {image_name}...')
+        await aiocompute.snapshot_and_image(client, project, zone, instance_name, snapshot_name, image_name, labels)
+
+        print(f"Creating {copies} copies from snapshot....")
+        instance_properties = snapshot_instance_properties(project, zone, snapshot_name, bucket, labels=labels)
+        new_instance_names = [instance_name + '-copy-' + str(i + 1) for i in range(copies)]
+        latencies, records, total_time = await aiocompute.clone_instances(
+            client, project, zone, new_instance_names, instance_properties, p1.NETWORK_TAG, concurrency)
+    sections = [(f"async (concurrency {concurrency})", latencies, total_time)]
+    write_timing(sections)
+    record_results(
+        {"command": "part2", "strategy": "insert/snapshot", "zone": zone, "engine": "async",
+         "machine_type": machine_type_name(instance_properties), "concurrency": concurrency, "copies": copies},
+        sections, {}, {})
+    print("Compute calls: " + scheduler.default().summary())
+    tracing.finish()
 
 
 def main(
@@ -212,56 +497,254 @@ def main(
     zone: str,
     instance_name: str,
     wait=True,
+    copies=copies,
+    concurrency=1,
+    clone_mode="insert",
+    baked=False,
+    measure_boot=False,
+    probe=False,
+    engine="sync",
+    source="snapshot",
+    benchmark_sources=False,
+    clone_zones=None,
+    region=None,
+    placement="spread",
+    inline_scripts=False,
+    plan=False,
+    timeline=False,
+    stages=False,
 ) -> None: 
-    compute = googleapiclient.discovery.build("compute", "v1")
-
-    print("Creating instance.")
-    operation= p1.create_instance(compute, project, zone, instance_name, bucket)
-    wait_for_operation(compute, project, zone, operation["name"])
+    if engine == "async":
+        import asyncio
+        asyncio.run(main_async(project, bucket, zone, instance_name, copies, concurrency))
+        return
 
-    print("Getting all the running instances")
-    instances = list_instances(compute, project, zone)
-    print(f"Instances in project {project} and zone {zone}:")
-    for instance in instances:
-        print(f'INSTANCE:- {instance["name"]}')
-        print("Creating firewall and set network tags")
-        network_tag=create_firewall_rule(compute,project,instance['name'],zone,instance['tags']['fingerprint'])
-        setTags(compute,project,instance['name'],zone,instance['tags']['fingerprint'],network_tag)
-        print(f'External_IP_address:- {instance["networkInterfaces"][0]["accessConfigs"][0]["natIP"]}\n')
-    
-    print("Creating a snapshot from instance")
-    snapshot_name = "base-snapshot-"+instance_name
-    print(f'Creating snapshot from the instance:- {instance_name}')
-    network_tag=create_firewall_rule(compute,project,instance['name'],zone,instance['tags']['fingerprint'])
-    operation=create_snapshot(compute,project,zone,instance['name'],snapshot_name)
-    wait_for_operation(compute, project, args.zone, operation['name'])
-    print(f'snapshot:- {snapshot_name} has been created\n')
+    compute = None if plan else p1.build_compute()
+    store = None if plan or inline_scripts else ArtifactStore(p1.build_storage(), bucket)
+    labels = p1.run_labels(instance_name)
+    network_tag = p1.NETWORK_TAG
+    snapshot_name = "base-snapshot-" + instance_name
     image_name = "image-from-snapshot1"
-    print(f'Creating image {image_name} from snapshot {snapshot_name}...')
-    image = create_image_from_snapshot(compute, project, snapshot_name,image_name)
-    print(f'Image {image_name} created with ID: {image["id"]}\n')
-
-    print("Creating 3 copies from snapshot....")
-   
-    
-    for instance in instances:
-        for i in range(copies):
-            start_time = time.time()
-            new_instance_name=instance['name']+'-copy-'+str(i+1)
-            print(f'\nCreating new instance {i+1}')
-            print("new instance: " + new_instance_name)
-            operation = create_instance_from_snapshot(compute, project, zone, new_instance_name, snapshot_name,bucket)
-            wait_for_operation(compute, project, args.zone, operation['name'])
-            setTags(compute,project,new_instance_name,zone,instance['tags']['fingerprint'],network_tag)
-            print("Added network tags")
-            markdown_content = "--- Clone %d took %s seconds ---" % (i+1, time.time() - start_time)
-            if i == 0 :
-                with open(file_path, "w") as md_file:
-                    md_file.write(markdown_content)
-            else :
-                with open(file_path, "a") as md_file:
-                    md_file.write(markdown_content)
+    multi_zone = bool(clone_zones or region)
+
+    sections = []
+    clone_records = {}
+    readiness_summaries = {}
+    zone_results = {}
+    run_config = {"command": "part2", "zone": zone, "engine": engine, "baked": baked,
+                  "concurrency": concurrency, "copies": copies}
+    section_configs = {}
+    phase_records = {}
+    # Section title to (lifecycle timelines, readiness records) of its clones.
+    timelines = {}
+    stage_summaries = {}
+
+    def watch(clone_zone, prefix):
+        """A started lifecycle.Watcher of the clones named `prefix`..., or None without --timeline."""
+        return lifecycle.Watcher(compute, project, clone_zone, prefix).start() if timeline else None
+
+    probers = {}
+
+    def prober(clone_zone):
+        """The started readiness.Prober of `clone_zone`'s clones, or None without --probe.
+
+        Clones are added to it as each insert completes, so probing overlaps
+        the rest of the inserts instead of waiting for them.
+        """
+        if probe and clone_zone not in probers:
+            probers[clone_zone] = readiness.Prober(compute, project, clone_zone).start()
+        return probers.get(clone_zone)
+
+    def create_base_instance(done):
+        print("Creating instance.")
+        # Tagged in the insert body, so no setTags (and tag fingerprint) has to follow.
+        operation = p1.create_instance(compute, project, zone, instance_name, bucket, store, labels, [network_tag])
+        wait_for_operation(compute, project, zone, operation)
+        instances = p1.list_instances(compute, project, zone, name=instance_name)
+        print(f"Instances in project {project} and zone {zone}:")
+        for instance in instances:
+            print(f'INSTANCE:- {instance["name"]}')
+            print(f'External_IP_address:- {instance["networkInterfaces"][0]["accessConfigs"][0]["natIP"]}\n')
+        return instances[0]
+
+    def create_firewall(done):
+        print("Creating firewall rule")
+        operation, _ = reconcile_firewall(compute, project, p1.FIREWALL_RULE)
+        if operation:
+            wait_for_operation(compute, project, None, operation)
+
+    def take_snapshot(done):
+        print(f'Creating snapshot from the instance:- {instance_name}')
+        operation = create_snapshot(compute, project, zone, instance_name, snapshot_name, labels)
+        wait_for_operation(compute, project, zone, operation)
+        print(f'snapshot:- {snapshot_name} has been created\n')
+        properties = snapshot_instance_properties(project, zone, snapshot_name, bucket, store, labels)
+        return dict(properties, tags={"items": [network_tag]})
+
+    def create_image(done):
+        image_link = sources.ensure_image(compute, project, snapshot_name, image_name, labels)
+        print(f'Image {image_name} is ready\n')
+        return image_link
+
+    def bake_image(done):
+        return bake.bake_image(compute, project, zone, image_name, instance_name + "-baked")
+
+    def clone_inputs(done):
+        """Properties the clones start from and the image non-snapshot sources use."""
+        if baked:
+            return bake.baked_instance_properties(done["snapshot"], done["bake"]), done["bake"]
+        return done["snapshot"], done.get("image")
+
+    def measure(done):
+        return bake.measure_boot_saving(
+            compute, project, zone, done["snapshot"], clone_inputs(done)[0], instance_name + "-boot")
+
+    def clone_from_every_source(done):
+        # Same workload from every source, each probed until ready before
+        # the next source starts so the runs do not overlap.
+        instance_properties, image_link = clone_inputs(done)
+        for name in sources.SOURCES:
+            print(f"Creating {copies} copies from source {name}....")
+            with tracing.step(f"clone from {name}", copies=copies):
+                properties, insert_params = sources.clone_source(
+                    compute, project, zone, name, instance_properties, image_link, instance_name, network_tag)
+                new_instance_names = [f"{instance_name}-{name}-{i + 1}" for i in range(copies)]
+                watcher = watch(zone, f"{instance_name}-{name}-")
+                source_prober = readiness.Prober(compute, project, zone).start()
+                latencies, records, total_time = clone_instances(
+                    compute, project, zone, new_instance_names, properties, None, network_tag, concurrency,
+                    insert_params, prober=source_prober)
+            sections.append((f"source {name} (concurrency {concurrency})", latencies, total_time))
+            section_configs[sections[-1][0]] = {"strategy": f"insert/{name}"}
+            if watcher:
+                timelines[sections[-1][0]] = (watcher.finish(), records)
+            with tracing.step(f"probe {name}"):
+                source_prober.wait()
+            readiness_summaries[sections[-1][0]] = readiness.summarize(records)
+            phase_records[sections[-1][0]] = records
+
+    def clone_across_zones(done):
+        instance_properties, image_link = clone_inputs(done)
+        deploy_to = clone_zones or zones.region_zones(compute, project, region)
+        print(f"Creating {copies} copies across zones {', '.join(deploy_to)} ({placement})....")
+        properties, insert_params = sources.clone_source(
+            compute, project, zone, source, instance_properties, image_link, instance_name, network_tag)
+        new_instance_names = [instance_name + '-copy-' + str(i + 1) for i in range(copies)]
+        watchers = {clone_zone: watch(clone_zone, instance_name + '-copy-') for clone_zone in deploy_to}
+        zone_results.update(deploy_zones(
+            compute, project, deploy_to, new_instance_names, properties, None, network_tag,
+            concurrency, insert_params, placement, {clone_zone: prober(clone_zone) for clone_zone in deploy_to}))
+        for clone_zone, result in zone_results.items():
+            sections.append((f"zone {clone_zone} (concurrency {concurrency})", result["latencies"], result["total"]))
+            section_configs[sections[-1][0]] = {"strategy": f"{placement}/{source}", "zone": clone_zone}
+            clone_records[sections[-1][0]] = (clone_zone, result["records"])
+            if watchers[clone_zone]:
+                timelines[sections[-1][0]] = (watchers[clone_zone].finish(), result["records"])
 
+    def clone(done):
+        instance_properties, image_link = clone_inputs(done)
+        print(f"Creating {copies} copies from {'baked ' if baked else ''}{source}....")
+        properties, insert_params = sources.clone_source(
+            compute, project, zone, source, instance_properties, image_link, instance_name, network_tag)
+        new_instance_names = [instance_name + '-copy-' + str(i + 1) for i in range(copies)]
+        watcher = watch(zone, instance_name + '-copy-')
+        latencies, records, total_time = clone_instances(
+            compute, project, zone, new_instance_names, properties, None, network_tag, concurrency, insert_params,
+            prober=prober(zone))
+        sections.append((f"insert (concurrency {concurrency})", latencies, total_time))
+        section_configs[sections[-1][0]] = {"strategy": f"insert/{source}"}
+        clone_records[sections[-1][0]] = (zone, records)
+        if watcher:
+            timelines[sections[-1][0]] = (watcher.finish(), records)
+
+    def clone_bulk(done):
+        watcher = watch(zone, instance_name + "-bulk-")
+        latencies, records, total_time = clone_instances_bulk(
+            compute, project, zone, instance_name + "-bulk-####", copies, clone_inputs(done)[0], network_tag,
+            prober(zone))
+        sections.append(("bulkInsert", latencies, total_time))
+        section_configs[sections[-1][0]] = {"strategy": "bulkInsert", "concurrency": None}
+        clone_records[sections[-1][0]] = (zone, records)
+        if watcher:
+            timelines[sections[-1][0]] = (watcher.finish(), records)
+
+    def probe_clones(done):
+        # Probing started with each clone's insert; wait for it to finish everywhere.
+        print("Probing clones until they serve on port 5000...")
+        for clone_zone, zone_prober in probers.items():
+            with tracing.step(f"probe {clone_zone}"):
+                zone_prober.wait()
+        for title, (clone_zone, records) in clone_records.items():
+            readiness_summaries[title] = readiness.summarize(records)
+            phase_records[title] = records
+
+    def time_stages(done):
+        # The markers carry the clones' own timestamps, so reading them after
+        # the fact (and one section after another) loses no accuracy.
+        targets = {title: (zone, records) for title, records in phase_records.items()} if benchmark_sources \
+            else clone_records
+        print("Reading startup-script stages from the serial consoles...")
+        for title, (clone_zone, records) in targets.items():
+            reader = console.ConsoleReader(compute, project, clone_zone, records)
+            stage_summaries[title] = console.summarize(reader.follow())
+            console.print_summary(title, stage_summaries[title])
+            print(f"--- {title}: read {reader.bytes_read} console bytes ---")
+
+    def report(done):
+        # Summarized last, so the boot phase can use the probes' "ready" times.
+        lifecycles = {title: lifecycle.summarize(*timelines[title]) for title in timelines}
+        for title, summary in lifecycles.items():
+            lifecycle.print_summary(title, summary)
+        write_timing(sections, done.get("measure boot"), readiness_summaries or None, zone_results or None,
+                     lifecycles, stage_summaries)
+        run_config["machine_type"] = machine_type_name(clone_inputs(done)[0])
+        record_results(run_config, sections, section_configs, phase_records)
+
+    flow = workflow.Workflow()
+    flow.add("base instance", create_base_instance, estimate=STEP_ESTIMATES["base instance"])
+    # Independent of the instance: the rule only has to exist before anything is probed.
+    flow.add("firewall", create_firewall, estimate=STEP_ESTIMATES["firewall"])
+    flow.add("snapshot", take_snapshot, after=["base instance"], estimate=STEP_ESTIMATES["snapshot"])
+    # Snapshot clones do not need the image, so it is made while they provision.
+    flow.add("image", create_image, after=["snapshot"], estimate=STEP_ESTIMATES["image"])
+    clone_after = ["snapshot"]
+    if baked:
+        flow.add("bake", bake_image, after=["image"], estimate=STEP_ESTIMATES["bake"])
+        clone_after.append("bake")
+        if measure_boot:
+            flow.add("measure boot", measure, after=["bake", "firewall"], estimate=STEP_ESTIMATES["measure boot"])
+            # The clones wait, so they do not compete with the boots being timed.
+            clone_after.append("measure boot")
+    elif benchmark_sources or source in ("image", "template"):
+        clone_after.append("image")
+
+    if benchmark_sources:
+        flow.add("clone", clone_from_every_source, after=clone_after + ["firewall"], estimate=sum(
+            clone_estimate(copies, concurrency, name) + STEP_ESTIMATES["probe"] for name in sources.SOURCES))
+    elif multi_zone:
+        flow.add("clone", clone_across_zones, after=clone_after,
+                 estimate=clone_estimate(copies, concurrency, source, len(clone_zones or []) or 3))
+    elif clone_mode in ("insert", "compare"):
+        flow.add("clone", clone, after=clone_after, estimate=clone_estimate(copies, concurrency, source))
+    clone_steps = [name for name in ("clone",) if name in flow.steps]
+    if clone_mode in ("bulk", "compare") and not (benchmark_sources or multi_zone):
+        # After the inserts, so the two strategies are timed apart.
+        flow.add("bulkInsert", clone_bulk, after=clone_after + clone_steps, estimate=STEP_ESTIMATES["bulkInsert"])
+        clone_steps.append("bulkInsert")
+    if probe:
+        flow.add("probe", probe_clones, after=clone_steps + ["firewall"], estimate=STEP_ESTIMATES["probe"])
+    if stages:
+        flow.add("stages", time_stages, after=clone_steps, estimate=STEP_ESTIMATES["stages"])
+    flow.add("report", report, after=list(flow.steps))
+
+    if plan:
+        flow.plan()
+        return
+    flow.run()
+    if store:
+        print("Artifacts: " + store.summary())
+    print("Compute calls: " + scheduler.default().summary())
+    tracing.finish()
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
@@ -275,7 +758,88 @@ if __name__ == '__main__':
         help='Compute Engine zone to deploy to.')
     parser.add_argument(
         '--name', default='demo-remote-instance', help='New instance name.')
+    parser.add_argument(
+        '--copies', type=int, default=copies, help='Number of clones to create from the snapshot.')
+    parser.add_argument(
+        '--concurrency', type=int, default=1,
+        help='Maximum number of clone inserts in flight at once (1 = one after another).')
+    parser.add_argument(
+        '--clone-mode', choices=['insert', 'bulk', 'compare'], default='insert',
+        help='Create clones with per-instance inserts, one bulkInsert request, or both for comparison.')
+    parser.add_argument(
+        '--bake', action='store_true',
+        help='Bake an image with the Flask app pre-installed and clone from it with a start-only script.')
+    parser.add_argument(
+        '--measure-boot', action='store_true',
+        help='With --bake, time one snapshot clone and one baked clone until they serve on port 5000.')
+    parser.add_argument(
+        '--engine', choices=['sync', 'async'], default='sync',
+        help='Run on blocking googleapiclient calls or on the asyncio engine (needs aiohttp for the real API).')
+    parser.add_argument(
+        '--source', choices=sources.SOURCES, default='snapshot',
+        help='What insert-mode clones boot from: the base snapshot, the image made from it, '
+             'a machine image of the base VM, or an instance template.')
+    parser.add_argument(
+        '--benchmark-sources', action='store_true',
+        help='Clone --copies instances from every source in turn and compare provisioning and time-to-ready.')
+    parser.add_argument(
+        '--zones', nargs='+',
+        help='Spread the clones over these zones and provision every zone concurrently (base VM stays in --zone).')
+    parser.add_argument(
+        '--region',
+        help='Like --zones, with every zone of this region that is UP.')
+    parser.add_argument(
+        '--placement', choices=zones.PLACEMENTS, default='spread',
+        help='spread: round-robin over the zones; failover: also re-place clones a capacity-limited zone refused.')
+    parser.add_argument(
+        '--inline-scripts', action='store_true',
+        help='Put startup scripts in instance metadata instead of uploading them once to the bucket.')
+    parser.add_argument(
+        '--probe', action='store_true',
+        help='Probe every clone on port 5000 and report p50/p95/max time to RUNNING and to ready.')
+    parser.add_argument(
+        '--trace', metavar='PATH',
+        help='Record every Compute call as a span of its workflow step and write them to PATH '
+             '(.jsonl for one span per line, anything else for Chrome trace JSON).')
+    parser.add_argument(
+        '--timeline', action='store_true',
+        help='Follow every clone through PROVISIONING, STAGING and RUNNING and break its latency down by phase '
+             '(with --probe, also the boot until it serves).')
+    parser.add_argument(
+        '--stages', action='store_true',
+        help='Stream every clone\'s serial console and time its startup-script stages (apt-get, pip, git clone...).')
+    parser.add_argument(
+        '--plan', action='store_true',
+        help='Only print the workflow\'s steps, their dependencies, the critical path and an estimated duration.')
 
     args = parser.parse_args()
+    if args.concurrency < 1:
+        parser.error('--concurrency must be at least 1')
+    if args.measure_boot and not args.bake:
+        parser.error('--measure-boot requires --bake')
+    if args.engine == 'async':
+        # main_async only runs the base workflow: snapshot clones by per-instance inserts.
+        unsupported = [flag for flag, given in (
+            ('--clone-mode', args.clone_mode != 'insert'), ('--bake', args.bake), ('--measure-boot', args.measure_boot),
+            ('--source', args.source != 'snapshot'), ('--benchmark-sources', args.benchmark_sources),
+            ('--zones', args.zones), ('--region', args.region), ('--placement', args.placement != 'spread'),
+            ('--probe', args.probe), ('--timeline', args.timeline), ('--stages', args.stages), ('--plan', args.plan),
+        ) if given]
+        if unsupported:
+            parser.error(f'--engine async does not support {", ".join(unsupported)}')
+    if args.clone_mode != 'insert':
+        # bulkInsert clones one zone from the snapshot; the other workflows clone by per-instance inserts.
+        unsupported = [flag for flag, given in (
+            ('--zones', args.zones), ('--region', args.region), ('--benchmark-sources', args.benchmark_sources),
+        ) if given]
+        if unsupported:
+            parser.error(f'--clone-mode {args.clone_mode} does not support {", ".join(unsupported)}')
+    tracing.enable(args.trace)
 
-    main(args.project_id, args.bucket_name, args.zone, args.name)
\ No newline at end of file
+    main(args.project_id, args.bucket_name, args.zone, args.name,
+         copies=args.copies, concurrency=args.concurrency, clone_mode=args.clone_mode,
+         baked=args.bake, measure_boot=args.measure_boot, probe=args.probe,
+         engine=args.engine, source=args.source, benchmark_sources=args.benchmark_sources,
+         clone_zones=args.zones, region=args.region, placement=args.placement,
+         inline_scripts=args.inline_scripts, plan=args.plan, timeline=args.timeline,
+         stages=args.stages)
\ No newline at end of file
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+
+#
+# Warm pool: keep K clones provisioned, booted once and then suspended (or
+# stopped), and hand them out on demand by resuming them instead of paying
+# for an insert and a boot-time install. Claimed clones are replaced in the
+# background. Pool members carry the label hw5-pool=<name>, so the pool
+# persists between runs; teardown.py --name <name> removes it.
+#
+#   python part2/pool.py my-project my-bucket fill --size 5
+#   python part2/pool.py my-project my-bucket claim --count 2
+#   python part2/pool.py my-project my-bucket benchmark --size 5 --count 3   # writes part2/POOL.md
+#
+import argparse
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+main_script_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '../part1'))
+sys.path.append(main_script_dir)
+
+import part1 as p1
+import part2
+import bake
+import batch
+import readiness
+import results
+import scale
+import scheduler
+import tracing
+from operations import wait_for_operation, wait_for_operations
+from reconcile import reconcile_firewall
+
+file_path = "part2/POOL.md"
+POOL_LABEL = "hw5-pool"
+ACTIONS = ("fill", "claim", "status", "benchmark")
+# How members are parked and woken: (park method, wake method, parked status).
+MODES = {
+    "suspend": ("suspend", "resume", "SUSPENDED"),
+    "stop": ("stop", "start", "TERMINATED"),
+}
+MEMBER_FIELDS = "items(name,status,labels,labelFingerprint,networkInterfaces/accessConfigs/natIP),nextPageToken"
+# Rounds of clones fill() inserts before it settles for a smaller pool.
+FILL_ATTEMPTS = 3
+
+
+class WarmPool:
+    """Up to `size` parked clones of `properties`, woken by claim().
+
+    A suspended member resumes with the app still in memory; a stopped one
+    boots again but finds the app already installed on its disk. A claimed
+    member loses the pool label and belongs to the caller from then on.
+    """
+
+    def __init__(self, compute, project, zone, name, size, properties, mode="suspend", concurrency=8):
+        self.compute = compute
+        self.project = project
+        self.zone = zone
+        self.name = name
+        self.size = size
+        self.labels = {POOL_LABEL: name}
+        self.properties = dict(properties, labels=dict(properties.get("labels", {}), **self.labels))
+        self.park_method, self.wake_method, self.parked_status = MODES[mode]
+        self.concurrency = concurrency
+        self.fill_lock = threading.Lock()
+        self.refiller = None
+
+    def members(self):
+        return list(p1.iter_instances(self.compute, self.project, self.zone, labels=self.labels, fields=MEMBER_FIELDS))
+
+    def parked(self):
+        return [member for member in self.members() if member["status"] == self.parked_status]
+
+    def fill(self):
+        """Clone, warm up and park members until the pool holds `size`; returns the number added.
+
+        Clones that never serve are deleted rather than parked, and replaced
+        for up to FILL_ATTEMPTS rounds.
+        """
+        added = 0
+        with self.fill_lock:
+            for _ in range(FILL_ATTEMPTS):
+                need = self.size - len(self.members())
+                if need <= 0:
+                    break
+                print(f"Filling pool {self.name} with {need} clones...")
+                names = [f"{self.name}-{uuid.uuid4().hex[:6]}" for _ in range(need)]
+                prober = readiness.Prober(self.compute, self.project, self.zone).start()
+                part2.clone_instances(self.compute, self.project, self.zone, names, self.properties, None,
+                                      p1.NETWORK_TAG, self.concurrency, prober=prober)
+                records = prober.wait()
+                # Park only once the app serves, so waking a member skips the install.
+                ready = [name for name, record in records.items() if "ready" in record]
+                self.call_all(self.park_method, [(name, {}) for name in ready])
+                added += len(ready)
+                broken = [name for name in records if name not in ready]
+                if broken:
+                    print(f"Deleting {len(broken)} clones that never served...")
+                    self.call_all("delete", [(name, {}) for name in broken])
+        return added
+
+    def call_all(self, method, calls):
+        """Run instances().`method` for every (name, extra params) in batches and wait for all of them.
+
+        Returns {instance name: time its `method` operation finished}.
+        """
+        instances = self.compute.instances()
+        requests = [(name, getattr(instances, method)(project=self.project, zone=self.zone, instance=name, **params))
+                    for name, params in calls]
+        operations = []
+        for result in batch.execute_batch(self.compute, requests):
+            if result.error is None:
+                operations.append(result.response)
+            else:
+                print(f'Could not {method} {result.key}: {result.error}')
+        finished = {}
+        for operation in wait_for_operations(self.compute, self.project, operations, raise_on_error=False):
+            name = operation["targetLink"].rsplit("/", 1)[-1]
+            if "error" in operation:
+                print(f'{method} of {name} failed: {operation["error"]}')
+            else:
+                finished[name] = time.time()
+        return finished
+
+    def claim(self, count, refill=True):
+        """Wake up to `count` parked members, take them out of the pool and start a refill.
+
+        Returns readiness records (see readiness.probe_ready) of the claimed
+        instances, timed from the wake request and probed until they serve.
+        With `refill` False the caller starts the refill when it suits it.
+        """
+        members = self.parked()[:count]
+        if not members:
+            return {}
+        print(f"Claiming {len(members)} clones from pool {self.name} ({self.wake_method})...")
+        started = time.time()
+        woken = self.call_all(self.wake_method, [(member["name"], {}) for member in members])
+        records = {name: {"inserted": started, "api_done": done} for name, done in woken.items()}
+        # Probed while they are relabeled, so the relabeling does not count towards ready.
+        prober = readiness.Prober(self.compute, self.project, self.zone)
+        for name, record in records.items():
+            prober.add(name, record)
+        prober.start()
+        self.call_all("setLabels", [(member["name"], {"body": {
+            "labels": {key: value for key, value in member.get("labels", {}).items() if key != POOL_LABEL},
+            "labelFingerprint": member["labelFingerprint"],
+        }}) for member in members if member["name"] in woken])
+        prober.wait()
+        if refill:
+            self.refill_in_background()
+        return records
+
+    def refill_in_background(self):
+        self.refiller = threading.Thread(target=tracing.bind(self.fill), name=f"{self.name}-refill", daemon=True)
+        self.refiller.start()
+
+    def wait_for_refill(self):
+        if self.refiller is not None:
+            self.refiller.join()
+
+
+def cold_clones(compute, project, zone, name, properties, count, concurrency):
+    """Readiness records of `count` clones inserted from scratch, for comparison with claim()."""
+    print(f"Inserting {count} cold clones for comparison...")
+    names = [f"{name}-cold-{uuid.uuid4().hex[:6]}" for _ in range(count)]
+    # Each clone is probed from its own api_done, as part2 does.
+    prober = readiness.Prober(compute, project, zone).start()
+    part2.clone_instances(compute, project, zone, names, properties, None, p1.NETWORK_TAG, concurrency, prober=prober)
+    return prober.wait()
+
+
+def write_pool(pool, fill_seconds, sections):
+    """Write time-to-serving of each (title, records) section to POOL.md."""
+    with open(file_path, "w") as md_file:
+        md_file.write(f"## Warm pool {pool.name} ({pool.park_method}/{pool.wake_method}, size {pool.size})\n\n")
+        md_file.write("--- Filling the pool took %s seconds ---\n\n" % fill_seconds)
+        md_file.write("| path | clones | phase | p50 | p95 | max |\n")
+        md_file.write("|---|---|---|---|---|---|\n")
+        for title, records in sections:
+            for phase, stats in readiness.summarize(records).items():
+                if stats["count"]:
+                    md_file.write("| %s | %d | %s | %.2f | %.2f | %.2f |\n"
+                                  % (title, len(records), phase, stats["p50"], stats["p95"], stats["max"]))
+
+
+def record_results(pool, sections):
+    """Append each section to part2's results history (see report.py)."""
+    run_id = results.new_run_id()
+    machine_type = pool.properties.get("machineType", "").rsplit("/", 1)[-1]
+    results.append(part2.results_path, [
+        results.record(run_id, {"command": "pool", "strategy": strategy, "zone": pool.zone, "machine_type": machine_type,
+                                "concurrency": pool.concurrency, "copies": len(records)},
+                       {name: record["api_done"] - record["inserted"] for name, record in records.items()},
+                       None, records)
+        for strategy, records in sections
+    ])
+
+
+def main(project, bucket, zone, name, action, size=5, count=1, mode="suspend", baked=False, cold=False, concurrency=8):
+    compute = p1.build_compute()
+    if action != "status":
+        # Members are probed on port 5000 before they are parked.
+        operation, _ = reconcile_firewall(compute, project, p1.FIREWALL_RULE)
+        if operation:
+            wait_for_operation(compute, project, None, operation)
+    properties = scale.template_properties(compute, project, zone, bucket, baked)
+    properties["labels"] = p1.run_labels(name)
+    pool = WarmPool(compute, project, zone, name, size, properties, mode, concurrency)
+
+    if action == "status":
+        statuses = Counter(member["status"] for member in pool.members())
+        print(f"Pool {pool.name}: " + (", ".join(f"{n} {status}" for status, n in sorted(statuses.items())) or "empty"))
+        return
+
+    fill_seconds = None
+    if action in ("fill", "benchmark"):
+        started = time.time()
+        with tracing.step("fill"):
+            added = pool.fill()
+        fill_seconds = time.time() - started
+        print(f"--- Added {added} clones to pool {pool.name} in {fill_seconds} seconds ---")
+
+    if action in ("claim", "benchmark"):
+        with tracing.step("claim", count=count):
+            # The benchmark refills after the cold inserts so the two do not compete.
+            claimed = pool.claim(count, refill=action == "claim")
+        sections = [(f"{pool.wake_method} from pool", claimed)]
+        if len(claimed) < count:
+            # An empty pool falls back to the cold path.
+            sections.append(("cold insert (pool empty)",
+                             cold_clones(compute, project, zone, name, properties, count - len(claimed), concurrency)))
+        elif cold or action == "benchmark":
+            with tracing.step("cold insert", count=count):
+                sections.append(("cold insert", cold_clones(compute, project, zone, name, properties, count, concurrency)))
+        for title, records in sections:
+            for phase, stats in readiness.summarize(records).items():
+                if stats["count"]:
+                    print(f"--- {title}: {phase} p50 {stats['p50']} s, p95 {stats['p95']} s ---")
+        if action == "benchmark":
+            pool.refill_in_background()
+        with tracing.step("refill"):
+            pool.wait_for_refill()
+        if action == "benchmark":
+            write_pool(pool, fill_seconds, sections)
+        record_results(pool, [(f"{mode}/warm" if title.endswith("from pool") else "cold", records)
+                              for title, records in sections if records])
+    print("Compute calls: " + scheduler.default().summary())
+    tracing.finish()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('project_id', help='Your Google Cloud project ID.')
+    parser.add_argument('bucket_name', help='Your Google Cloud Storage bucket name.')
+    parser.add_argument(
+        'action', choices=ACTIONS,
+        help='fill: top the pool up to --size; claim: wake --count members and refill; status: count members; '
+             'benchmark: fill, then claim --count next to as many cold inserts and write POOL.md.')
+    parser.add_argument(
+        '--zone',
+        default='us-east1-d',
+        help='Compute Engine zone of the pool.')
+    parser.add_argument(
+        '--name', default='demo-pool', help='Pool name: member label value and name prefix.')
+    parser.add_argument(
+        '--size', type=int, default=5, help='Number of parked clones to keep.')
+    parser.add_argument(
+        '--count', type=int, default=1, help='Number of clones to claim.')
+    parser.add_argument(
+        '--mode', choices=MODES, default='suspend',
+        help='Park members suspended (memory kept, fastest to wake) or stopped (boot again on start).')
+    parser.add_argument(
+        '--bake', action='store_true',
+        help=f'Clone from the newest {bake.IMAGE_FAMILY} image instead of installing at first boot.')
+    parser.add_argument(
+        '--cold', action='store_true', help='With claim, also insert --count cold clones and compare.')
+    parser.add_argument(
+        '--concurrency', type=int, default=8, help='Maximum number of inserts in flight while filling.')
+    parser.add_argument(
+        '--trace', metavar='PATH', help='Write a span per Compute call to PATH (.jsonl or Chrome trace JSON).')
+
+    args = parser.parse_args()
+    if args.concurrency < 1:
+        parser.error('--concurrency must be at least 1')
+    tracing.enable(args.trace)
+
+    main(args.project_id, args.bucket_name, args.zone, args.name, args.action, args.size, args.count,
+         args.mode, args.bake, args.cold, args.concurrency)
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+#
+# Report on the benchmark history part2.py appends to part2/results.jsonl:
+# p50/p95 of every series in a run, compared with the same series
+# (same strategy, zone, machine type, concurrency, copies, engine and
+# baking) in a baseline run, flagging statistically significant slowdowns.
+#
+#   python part2/report.py                      # latest run vs the run before it
+#   python part2/report.py --baseline 20231018T101500-1a2b3c --metric ready
+#   python part2/report.py --list
+#
+# Exits with status 1 when a regression is found, so it can gate a CI job.
+#
+import argparse
+import os
+import sys
+
+main_script_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '../part1'))
+sys.path.append(main_script_dir)
+
+import readiness
+import results
+
+results_path = "part2/results.jsonl"
+
+
+def baseline_series(records, run, baseline=None):
+    """{series key: record} to compare `run` against.
+
+    With an explicit `baseline` run id that run's series are used;
+    otherwise each series of `run` is matched with its most recent earlier
+    occurrence, so runs that measured different strategies still line up.
+    """
+    order = results.runs(records)
+    matches = {}
+    for item in records:
+        if baseline is not None:
+            if item["run"] == baseline:
+                matches[results.series_key(item)] = item
+        elif order.index(item["run"]) < order.index(run):
+            matches[results.series_key(item)] = item
+    return matches
+
+
+def report(records, run=None, baseline=None, metric="latency", alpha=0.05, min_change=0.05):
+    """Print the comparison table and return the number of regressions."""
+    order = results.runs(records)
+    if not order:
+        print(f"No results in {results_path} yet; run part2.py first.")
+        return 0
+    run = run or order[-1]
+    baselines = baseline_series(records, run, baseline)
+    print(f"## Run {run} vs {baseline or 'previous runs'} ({metric}, seconds)\n")
+    print("| series | baseline run | n | p50 | p95 | n | p50 | p95 | p50 change | p-value | verdict |")
+    print("|---|---|---|---|---|---|---|---|---|---|---|")
+    regressions = 0
+    for item in records:
+        if item["run"] != run or not item["metrics"].get(metric):
+            continue
+        key = results.series_key(item)
+        current = item["metrics"][metric]
+        base = baselines.get(key)
+        if base is None or not base["metrics"].get(metric):
+            print("| %s | - | | | | %d | %.2f | %.2f | | | no baseline |" % (
+                results.series_name(key), len(current),
+                readiness.percentile(current, 50), readiness.percentile(current, 95)))
+            continue
+        comparison = results.compare(base["metrics"][metric], current, alpha, min_change)
+        regressions += comparison["verdict"] == "REGRESSION"
+        print("| %s | %s | %d | %.2f | %.2f | %d | %.2f | %.2f | %+.1f%% | %s | %s |" % (
+            results.series_name(key), base["run"],
+            comparison["baseline"]["count"], comparison["baseline"]["p50"], comparison["baseline"]["p95"],
+            comparison["current"]["count"], comparison["current"]["p50"], comparison["current"]["p95"],
+            comparison["change"] * 100,
+            "-" if comparison["p_value"] is None else "%.4f" % comparison["p_value"],
+            comparison["verdict"]))
+    return regressions
+
+
+def list_runs(records):
+    for run in results.runs(records):
+        items = [item for item in records if item["run"] == run]
+        print(f"{run}  {items[0]['time']}  " + ", ".join(
+            results.series_name(results.series_key(item)) for item in items))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        '--results', default=results_path, help='Results file written by part2.py.')
+    parser.add_argument(
+        '--run', help='Run to report on (default: the latest).')
+    parser.add_argument(
+        '--baseline', help='Run to compare against (default: the latest earlier run of each series).')
+    parser.add_argument(
+        '--metric', choices=results.METRICS, default='latency',
+        help='latency: insert accepted until RUNNING; api_done/running/ready: seconds from insert to that phase (needs --probe).')
+    parser.add_argument(
+        '--alpha', type=float, default=0.05, help='Significance level of the one-sided Mann-Whitney U test.')
+    parser.add_argument(
+        '--min-change', type=float, default=0.05,
+        help='Smallest p50 slowdown (as a fraction) reported as a regression.')
+    parser.add_argument(
+        '--list', action='store_true', help='List the recorded runs and their series.')
+
+    args = parser.parse_args()
+    results_path = args.results
+    records = results.load(results_path)
+    for flag, run in (('--run', args.run), ('--baseline', args.baseline)):
+        if run is not None and run not in results.runs(records):
+            parser.error(f'{flag} {run} is not a run in {results_path} (see --list)')
+    if args.list:
+        list_runs(records)
+    else:
+        sys.exit(1 if report(records, args.run, args.baseline, args.metric, args.alpha, args.min_change) else 0)
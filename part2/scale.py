@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+
+#
+# Scale the Flask app out with a managed instance group: the part1 instance
+# config becomes an instance template, the group is created (or resized) to
+# the target size, and every resize is timed until the group is stable.
+#
+#   python part2/scale.py my-project my-bucket --size 20 --resize 40 5
+#
+import argparse
+import os
+import sys
+import time
+
+main_script_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '../part1'))
+sys.path.append(main_script_dir)
+
+import part1 as p1
+import bake
+import clients
+import scheduler
+import tracing
+import sources
+from operations import wait_for_operation
+from reconcile import reconcile_firewall
+
+file_path = "part2/SCALING.md"
+GROUP_NAME = "demo-flask-group"
+STABLE_POLL = 1
+STABLE_TIMEOUT = 30 * 60
+
+
+def template_properties(compute, project, zone, bucket, baked=False):
+    """part1's instance config as template properties, tagged for the firewall rule."""
+    if baked:
+        source_disk_image = clients.image_link(compute, project, bake.IMAGE_FAMILY)
+        startup_script = bake.read_script("startup-script-serve.sh")
+    else:
+        source_disk_image = clients.image_link(compute, "ubuntu-os-cloud", "ubuntu-2204-lts")
+        startup_script = None
+    properties = p1.instance_config(zone, "template", bucket, source_disk_image, startup_script)
+    del properties["name"]
+    properties["tags"] = {"items": [p1.NETWORK_TAG]}
+    return properties
+
+
+def wait_until_stable(compute, project, zone, group_name, size, timeout=STABLE_TIMEOUT):
+    """Poll the group until it holds `size` instances with no action pending."""
+    deadline = time.time() + timeout
+    while True:
+        group = compute.instanceGroupManagers().get(
+            project=project, zone=zone, instanceGroupManager=group_name).execute()
+        if group["targetSize"] == size and group["status"]["isStable"]:
+            return group
+        if time.time() > deadline:
+            raise Exception(f'{group_name} did not reach {size} stable instances within {timeout} seconds')
+        time.sleep(STABLE_POLL)
+
+
+def scale_group(compute, project, zone, group_name, template_link, size):
+    """Create the group at `size`, or resize it if it exists; return seconds until stable."""
+    start_time = time.time()
+    group = sources.find(compute.instanceGroupManagers().get(
+        project=project, zone=zone, instanceGroupManager=group_name))
+    if group is None:
+        print(f'Creating instance group {group_name} with {size} instances...')
+        group_body = {
+            "name": group_name,
+            "baseInstanceName": group_name,
+            "instanceTemplate": template_link,
+            "targetSize": size,
+        }
+        operation = compute.instanceGroupManagers().insert(project=project, zone=zone, body=group_body).execute()
+    else:
+        if group["instanceTemplate"].rsplit("/", 1)[-1] != template_link.rsplit("/", 1)[-1]:
+            # Only instances created from now on use it; the running ones keep their template.
+            print(f'Switching instance group {group_name} to template {template_link.rsplit("/", 1)[-1]}...')
+            operation = compute.instanceGroupManagers().setInstanceTemplate(
+                project=project, zone=zone, instanceGroupManager=group_name,
+                body={"instanceTemplate": template_link}).execute()
+            wait_for_operation(compute, project, zone, operation)
+        print(f'Resizing instance group {group_name} from {group["targetSize"]} to {size} instances...')
+        operation = compute.instanceGroupManagers().resize(
+            project=project, zone=zone, instanceGroupManager=group_name, size=size).execute()
+    wait_for_operation(compute, project, zone, operation)
+    wait_until_stable(compute, project, zone, group_name, size)
+    elapsed = time.time() - start_time
+    print(f"--- {group_name} was stable at {size} instances after {elapsed} seconds ---")
+    return elapsed
+
+
+def write_scaling(group_name, steps):
+    """Write each (from size, to size, seconds) step to SCALING.md."""
+    with open(file_path, "w") as md_file:
+        md_file.write(f"## Scaling {group_name}\n\n")
+        md_file.write("| from | to | seconds until stable | seconds per instance changed |\n")
+        md_file.write("|---|---|---|---|\n")
+        for before, after, seconds in steps:
+            md_file.write("| %d | %d | %.2f | %.2f |\n" % (before, after, seconds, seconds / max(abs(after - before), 1)))
+
+
+def main(project, bucket, zone, group_name, size, resize=(), baked=False):
+    compute = p1.build_compute()
+    operation, _ = reconcile_firewall(compute, project, p1.FIREWALL_RULE)
+    if operation:
+        wait_for_operation(compute, project, None, operation)
+
+    with tracing.step("instance template"):
+        properties = template_properties(compute, project, zone, bucket, baked)
+        template_link = sources.ensure_instance_template(compute, project, group_name + "-template", properties)
+
+    group = sources.find(compute.instanceGroupManagers().get(
+        project=project, zone=zone, instanceGroupManager=group_name))
+    current = group["targetSize"] if group else 0
+    steps = []
+    for target in (size,) + tuple(resize):
+        with tracing.step(f"scale {current} to {target}"):
+            steps.append((current, target, scale_group(compute, project, zone, group_name, template_link, target)))
+        current = target
+    write_scaling(group_name, steps)
+    print("Compute calls: " + scheduler.default().summary())
+    tracing.finish()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('project_id', help='Your Google Cloud project ID.')
+    parser.add_argument('bucket_name', help='Your Google Cloud Storage bucket name.')
+    parser.add_argument(
+        '--zone',
+        default='us-east1-d',
+        help='Compute Engine zone to deploy to.')
+    parser.add_argument(
+        '--name', default=GROUP_NAME, help='Managed instance group (and template prefix) name.')
+    parser.add_argument(
+        '--size', type=int, default=10, help='Number of serving replicas to scale to first.')
+    parser.add_argument(
+        '--resize', type=int, nargs='*', default=[],
+        help='Further target sizes to resize to, one after another, e.g. --resize 40 5.')
+    parser.add_argument(
+        '--bake', action='store_true',
+        help=f'Boot replicas from the newest {bake.IMAGE_FAMILY} image (see part2.py --bake) instead of installing at boot.')
+
+    parser.add_argument(
+        '--trace', metavar='PATH', help='Write a span per Compute call to PATH (.jsonl or Chrome trace JSON).')
+
+    args = parser.parse_args()
+    tracing.enable(args.trace)
+
+    main(args.project_id, args.bucket_name, args.zone, args.name, args.size, args.resize, args.bake)
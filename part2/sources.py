@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+
+#
+# Clone sources: a clone can boot from the base snapshot, from a custom
+# image made from that snapshot, from a machine image of the base VM or from
+# an instance template. Each source is created once, waited on until it is
+# ready, and reused by later runs (an image only while its snapshot is the
+# same).
+#
+import copy
+import hashlib
+import json
+import time
+
+from googleapiclient.errors import HttpError
+
+from operations import wait_for_operation
+
+SOURCES = ("snapshot", "image", "machine-image", "template")
+READY_POLL = 5
+
+
+def find(request):
+    """Resource returned by `request`, or None if it does not exist."""
+    try:
+        return request.execute()
+    except HttpError as error:
+        if error.resp.status != 404:
+            raise
+        return None
+
+
+def wait_until_ready(get_request, kind, name):
+    """Poll a resource left PENDING/CREATING by an earlier run until it is READY."""
+    resource = get_request().execute()
+    while resource.get("status", "READY") != "READY":
+        if resource["status"] == "FAILED":
+            raise Exception(f'{kind} {name} failed to build')
+        time.sleep(READY_POLL)
+        resource = get_request().execute()
+    return resource
+
+
+def ensure_image(compute, project, snapshot_name, image_name, labels=None):
+    """selfLink of `image_name`, created from the snapshot unless it already exists.
+
+    The snapshot is re-taken under the same name by every run, so an
+    existing image is only reused if its sourceSnapshotId is the current
+    snapshot's; one built from an older snapshot is replaced.
+    """
+    get_image = lambda: compute.images().get(project=project, image=image_name)
+    image = find(get_image())
+    if image is not None:
+        snapshot = compute.snapshots().get(project=project, snapshot=snapshot_name).execute()
+        if image.get("sourceSnapshotId") != snapshot["id"]:
+            print(f'Replacing image {image_name}, built from an older snapshot {snapshot_name}...')
+            operation = compute.images().delete(project=project, image=image_name).execute()
+            wait_for_operation(compute, project, None, operation)
+            image = None
+    if image is None:
+        print(f'Creating image {image_name} from snapshot {snapshot_name}...')
+        image_body = {
+            "name": image_name,
+            "sourceSnapshot": "global/snapshots/%s" % snapshot_name,
+        }
+        if labels:
+            image_body["labels"] = dict(labels)
+        operation = compute.images().insert(project=project, body=image_body).execute()
+        wait_for_operation(compute, project, None, operation)
+    else:
+        print(f'Reusing image {image_name}')
+    return wait_until_ready(get_image, "image", image_name)["selfLink"]
+
+
+def ensure_machine_image(compute, project, zone, instance_name, machine_image_name):
+    """selfLink of a machine image of `instance_name`, created unless it already exists."""
+    get_machine_image = lambda: compute.machineImages().get(project=project, machineImage=machine_image_name)
+    if find(get_machine_image()) is None:
+        print(f'Creating machine image {machine_image_name} from instance {instance_name}...')
+        machine_image_body = {
+            "name": machine_image_name,
+            "sourceInstance": f"projects/{project}/zones/{zone}/instances/{instance_name}",
+        }
+        operation = compute.machineImages().insert(project=project, body=machine_image_body).execute()
+        wait_for_operation(compute, project, None, operation)
+    else:
+        print(f'Reusing machine image {machine_image_name}')
+    return wait_until_ready(get_machine_image, "machine image", machine_image_name)["selfLink"]
+
+
+def ensure_instance_template(compute, project, template_name, instance_properties):
+    """selfLink of an instance template holding `instance_properties`, created unless it exists.
+
+    Templates cannot be changed, so the name gets a digest of the properties
+    appended: a different configuration (another image, script or machine
+    type) gets a template of its own instead of reusing a stale one.
+    """
+    properties = copy.deepcopy(instance_properties)
+    # Templates are not zonal: they take the bare machine type name.
+    properties["machineType"] = properties["machineType"].rsplit("/", 1)[-1]
+    digest = hashlib.sha256(json.dumps(properties, sort_keys=True).encode()).hexdigest()[:8]
+    template_name = f"{template_name}-{digest}"
+    template = find(compute.instanceTemplates().get(project=project, instanceTemplate=template_name))
+    if template is None:
+        print(f'Creating instance template {template_name}...')
+        template_body = {"name": template_name, "properties": properties}
+        operation = compute.instanceTemplates().insert(project=project, body=template_body).execute()
+        wait_for_operation(compute, project, None, operation)
+        template = compute.instanceTemplates().get(project=project, instanceTemplate=template_name).execute()
+    else:
+        print(f'Reusing instance template {template_name}')
+    return template["selfLink"]
+
+
+def image_instance_properties(instance_properties, image_link):
+    """Clone properties that boot from `image_link`; the disk goes away with the clone."""
+    properties = copy.deepcopy(instance_properties)
+    properties["disks"][0]["autoDelete"] = True
+    properties["disks"][0]["initializeParams"] = {"sourceImage": image_link}
+    return properties
+
+
+def clone_source(compute, project, zone, source, instance_properties, image_link, instance_name, network_tag):
+    """Instance properties and extra insert() parameters for cloning from `source`.
+
+    `instance_properties` are the snapshot clone properties and `image_link`
+    the image made from the same snapshot. Apart from "snapshot", the tag
+    (and the run labels, for teardown.py) travel in the insert body so no
+    setTags call follows.
+    """
+    if source == "snapshot":
+        return instance_properties, {}
+    tags = {"items": [network_tag]}
+    image_properties = dict(image_instance_properties(instance_properties, image_link), tags=tags)
+    if source == "image":
+        return image_properties, {}
+    if source == "machine-image":
+        link = ensure_machine_image(compute, project, zone, instance_name, instance_name + "-machine-image")
+        # Set on every clone rather than left to what the machine image recorded of the base VM.
+        properties = {"sourceMachineImage": link, "tags": tags}
+        if "labels" in instance_properties:
+            properties["labels"] = dict(instance_properties["labels"])
+        return properties, {}
+    if source == "template":
+        link = ensure_instance_template(compute, project, instance_name + "-template", image_properties)
+        return {"tags": tags}, {"sourceInstanceTemplate": link}
+    raise ValueError(f"unknown clone source {source!r}, expected one of {SOURCES}")
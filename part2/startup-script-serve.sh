@@ -0,0 +1,7 @@
+#!/bin/bash
+# Clones of the baked image already have the app installed; just serve it.
+# Stage markers on the serial console, timed by part1/console.py.
+stage() { echo "HW5-STAGE $1 $(date +%s.%N)" > /dev/ttyS0; }
+stage start-service
+sudo systemctl start flaskr.service
+stage done
@@ -1,10 +1,32 @@
+# Stage markers on the serial console, timed by part1/console.py.
+stage() { echo "HW5-STAGE $1 $(date +%s.%N)" > /dev/ttyS0; }
+# Startup scripts run on every boot: once installed (a stopped pool member
+# being started again), only serve the app from where it was installed.
+INSTALLED=/var/lib/hw5-installed
+if [ -f "$INSTALLED" ]; then
+    stage serve
+    cd "$(cat "$INSTALLED")"
+    export FLASK_APP=flaskr
+    nohup flask run -h 0.0.0.0 &
+    stage done
+    exit 0
+fi
+stage apt-update
 sudo apt-get update
+stage apt-install
 sudo apt-get install -y python3 python3-pip git
+stage git-clone
 git clone https://github.com/cu-csci-4253-datacenter/flask-tutorial
 cd flask-tutorial
+stage setup-install
 sudo python3 setup.py install
+stage pip-install
 sudo pip3 install -e .
 
+stage init-db
 export FLASK_APP=flaskr
 flask init-db
-nohup flask run -h 0.0.0.0 &
\ No newline at end of file
+echo "$PWD" | sudo tee "$INSTALLED" > /dev/null
+stage serve
+nohup flask run -h 0.0.0.0 &
+stage done
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+
+#
+# Delete what part2.py (and scale.py) left behind: instance groups, clones,
+# their kept disks, templates, machine images, images and snapshots.
+#
+# A resource belongs to the run if it carries the run's label
+# (hw5-run=<name>, see part1.run_labels), if its name is one the run gives
+# what it creates (<name>-copy-3, base-snapshot-<name>, <name>-template-...
+# and, with --group, the scale.py group and its templates), or if its name
+# starts with one of the --prefix options. Deletes go out concurrently, one tier at a time, in dependency
+# order: a tier's operations are all waited on together before the next
+# tier starts, since e.g. a disk cannot go while an instance still uses it.
+#
+#   python part2/teardown.py my-project --name demo-remote-instance --dry-run
+#   python part2/teardown.py my-project --zones us-east1-b us-east1-c --keep images snapshots
+#   python part2/teardown.py my-project --prefix image-from-snapshot     # older, unlabelled runs
+#   python part2/teardown.py my-project --group demo-flask-group          # and scale.py's group
+#
+import argparse
+import os
+import re
+import sys
+import time
+
+main_script_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '../part1'))
+sys.path.append(main_script_dir)
+
+import part1 as p1
+import batch
+import scheduler
+import tracing
+import zones
+from operations import wait_for_operations
+
+# Deleted in this order; nothing in a tier is still needed by a later one.
+TIERS = (
+    ("instance groups", ("instanceGroupManagers",)),
+    ("instances", ("instances",)),
+    ("templates and machine images", ("instanceTemplates", "machineImages")),
+    ("disks", ("disks",)),
+    ("images", ("images",)),
+    ("snapshots", ("snapshots",)),
+)
+ZONAL = ("instanceGroupManagers", "instances", "disks")
+# Name of the delete() parameter identifying the resource.
+RESOURCE_PARAMS = {
+    "instanceGroupManagers": "instanceGroupManager",
+    "instances": "instance",
+    "instanceTemplates": "instanceTemplate",
+    "machineImages": "machineImage",
+    "disks": "disk",
+    "images": "image",
+    "snapshots": "snapshot",
+}
+KINDS = tuple(RESOURCE_PARAMS)
+# Names part2.py, bake.py and pool.py give what a run named {name} creates.
+RUN_NAMES = (
+    r"{name}",
+    r"{name}-copy-\d+",
+    r"{name}-bulk-\d+",
+    r"{name}-(snapshot|image|machine-image|template)-\d+",
+    r"{name}-boot-(snapshot|baked)",
+    r"{name}-baked(-vm)?",
+    r"{name}-machine-image",
+    r"{name}-template-[0-9a-f]{{8}}",
+    r"{name}-(cold-)?[0-9a-f]{{6}}",
+    r"base-snapshot-{name}",
+)
+# Names of a scale.py group {name}: the group, its templates and its members.
+GROUP_NAMES = (
+    r"{name}",
+    r"{name}-template-[0-9a-f]{{8}}",
+    r"{name}-[a-z0-9]{{4}}",
+)
+# Only what matching needs; templates keep their labels under properties.
+LIST_FIELDS = {
+    "instanceGroupManagers": "items(name,selfLink),nextPageToken",
+    "instances": "items(name,selfLink,labels),nextPageToken",
+    "instanceTemplates": "items(name,selfLink,properties/labels),nextPageToken",
+    "machineImages": "items(name,selfLink),nextPageToken",
+    "disks": "items(name,selfLink,labels,users),nextPageToken",
+    "images": "items(name,selfLink,labels),nextPageToken",
+    "snapshots": "items(name,selfLink,labels),nextPageToken",
+}
+
+
+def name_patterns(name, group=None):
+    """Regular expressions of every name the run `name` and the scale.py group `group` use."""
+    patterns = [pattern.format(name=re.escape(name)) for pattern in RUN_NAMES]
+    if group:
+        patterns += [pattern.format(name=re.escape(group)) for pattern in GROUP_NAMES]
+    return [re.compile(pattern) for pattern in patterns]
+
+
+def matches(resource, labels, patterns, prefixes=()):
+    """True if `resource` carries all of `labels`, has one of the names
+    `patterns` match in full, or its name starts with one of `prefixes`."""
+    if any(pattern.fullmatch(resource["name"]) for pattern in patterns):
+        return True
+    if any(resource["name"].startswith(prefix) for prefix in prefixes):
+        return True
+    own = resource.get("labels") or resource.get("properties", {}).get("labels") or {}
+    return bool(labels) and all(own.get(key) == value for key, value in labels.items())
+
+
+def iter_resources(compute, project, collection, zone=None):
+    """Every resource of `collection` (in `zone` for zonal ones), following nextPageToken."""
+    resources = getattr(compute, collection)()
+    location = {"zone": zone} if collection in ZONAL else {}
+    request = resources.list(project=project, fields=LIST_FIELDS[collection], **location)
+    while request is not None:
+        response = request.execute()
+        yield from response.get("items", [])
+        request = resources.list_next(previous_request=request, previous_response=response)
+
+
+def find_targets(compute, project, collection, clone_zones, labels, patterns, prefixes):
+    """(collection, zone, resource) of everything in `collection` that belongs to the run."""
+    targets = []
+    for zone in (clone_zones if collection in ZONAL else [None]):
+        for resource in iter_resources(compute, project, collection, zone):
+            if matches(resource, labels, patterns, prefixes):
+                targets.append((collection, zone, resource))
+    return targets
+
+
+def delete_request(compute, project, collection, zone, name):
+    location = {"zone": zone} if collection in ZONAL else {}
+    return getattr(compute, collection)().delete(project=project, **location, **{RESOURCE_PARAMS[collection]: name})
+
+
+def delete_all(compute, project, targets):
+    """Issue every delete in batches, then wait on all the operations together.
+
+    Resources that are already gone count as deleted. Returns the number of
+    resources that could not be deleted.
+    """
+    results = batch.execute_batch(compute, [
+        ((collection, zone, resource["name"]), delete_request(compute, project, collection, zone, resource["name"]))
+        for collection, zone, resource in targets
+    ])
+    operations = []
+    failed = 0
+    for result in results:
+        if result.error is None:
+            operations.append(result.response)
+        elif scheduler.error_status(result.error) != 404:
+            print(f'Could not delete {result.key[2]}: {result.error}')
+            failed += 1
+    for operation in wait_for_operations(compute, project, operations, raise_on_error=False):
+        if "error" in operation:
+            print(f'Deleting {operation["targetLink"].rsplit("/", 1)[-1]} failed: {operation["error"]}')
+            failed += 1
+    return failed
+
+
+def teardown(compute, project, clone_zones, labels, patterns, prefixes=(), keep=(), dry_run=False):
+    """Delete the run's resources tier by tier; returns [(tier, resources, failed, seconds)]."""
+    summary = []
+    doomed = set()
+    for tier, collections in TIERS:
+        targets = []
+        for collection in collections:
+            if collection not in keep:
+                targets.extend(find_targets(compute, project, collection, clone_zones, labels, patterns, prefixes))
+        for collection, zone, resource in list(targets):
+            users = set(resource.get("users", []))
+            # Attached disks go with (or are released by) their instance; one kept
+            # by an instance outside the run must stay.
+            if users and not (dry_run and users <= doomed):
+                print(f'Skipping disk {resource["name"]}: in use by {", ".join(sorted(users))}')
+                targets.remove((collection, zone, resource))
+        doomed.update(resource["selfLink"] for _, _, resource in targets if "selfLink" in resource)
+        if not targets:
+            continue
+        print(f"{'Would delete' if dry_run else 'Deleting'} {len(targets)} {tier}: "
+              + ", ".join(resource["name"] for _, _, resource in targets))
+        if dry_run:
+            continue
+        started = time.time()
+        with tracing.step(f"delete {tier}", count=len(targets)):
+            failed = delete_all(compute, project, targets)
+        summary.append((tier, len(targets), failed, time.time() - started))
+        print(f"--- {len(targets) - failed} {tier} deleted in {summary[-1][3]} seconds ---")
+    return summary
+
+
+def main(project, zone, name, prefixes=None, clone_zones=None, region=None, keep=(), dry_run=False,
+         group=None):
+    compute = p1.build_compute()
+    clone_zones = clone_zones or (zones.region_zones(compute, project, region) if region else [zone])
+    labels = p1.run_labels(name)
+    prefixes = list(prefixes or [])
+    print(f"Tearing down run {name}" + (f" and group {group}" if group else "") + f" in {', '.join(clone_zones)} "
+          f"(label {p1.RUN_LABEL}={labels[p1.RUN_LABEL]}"
+          + (f", prefixes {', '.join(prefixes)}" if prefixes else "") + ")")
+    started = time.time()
+    summary = teardown(compute, project, clone_zones, labels, name_patterns(name, group), prefixes, keep, dry_run)
+    if not dry_run:
+        deleted = sum(count - failed for _, count, failed, _ in summary)
+        failed = sum(failed for _, _, failed, _ in summary)
+        print(f"--- Reclaimed {deleted} resources in {time.time() - started} seconds"
+              + (f", {failed} could not be deleted" if failed else "") + " ---")
+    print("Compute calls: " + scheduler.default().summary())
+    tracing.finish()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('project_id', help='Your Google Cloud project ID.')
+    parser.add_argument(
+        '--zone',
+        default='us-east1-d',
+        help='Zone the run deployed to.')
+    parser.add_argument(
+        '--zones', nargs='+',
+        help='Look for instances, disks and instance groups in all of these zones instead.')
+    parser.add_argument(
+        '--region',
+        help='Like --zones, with every zone of this region that is UP.')
+    parser.add_argument(
+        '--name', default='demo-remote-instance',
+        help='The run\'s --name: its label value and the stem of everything it named after itself.')
+    parser.add_argument(
+        '--group',
+        help='Also delete this scale.py instance group (its --name), its templates and its members.')
+    parser.add_argument(
+        '--prefix', action='append', default=[],
+        help='Also delete resources whose name starts with this (repeatable).')
+    parser.add_argument(
+        '--keep', nargs='+', choices=KINDS, default=[],
+        help='Resource kinds to leave alone, e.g. --keep images snapshots for a faster next run.')
+    parser.add_argument(
+        '--dry-run', action='store_true', help='Only list what would be deleted.')
+    parser.add_argument(
+        '--trace', metavar='PATH', help='Write a span per Compute call to PATH (.jsonl or Chrome trace JSON).')
+
+    args = parser.parse_args()
+    tracing.enable(args.trace)
+
+    main(args.project_id, args.zone, args.name, args.prefix, args.zones, args.region, args.keep, args.dry_run,
+         args.group)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+#
+# Package the VM1 launcher as one self-contained zipapp: launch_vm2_inside.py,
+# operations.py, the VM2 startup script and the Google client libraries,
+# vendored for the stock python3 of the VM image, so VM1 needs neither apt
+# nor pip before it can launch VM2.
+#
+#   python part3/build_launcher.py            # writes part3/dist/launcher.pyz
+#
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import zipapp
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_OUTPUT = os.path.join(HERE, "dist", "launcher.pyz")
+
+REQUIREMENTS = ["google-api-python-client", "google-auth", "google-auth-httplib2"]
+# ubuntu-2204-lts ships Python 3.10 on x86_64.
+TARGET_PYTHON = "3.10"
+TARGET_PLATFORM = "manylinux2014_x86_64"
+# Bundled discovery documents to keep; the rest are ~100 MB of other APIs.
+KEEP_DOCUMENTS = ("compute.v1.json",)
+
+APP_FILES = {
+    "launch_vm2_inside.py": os.path.join(HERE, "launch_vm2_inside.py"),
+    "startup-script-remote.sh": os.path.join(HERE, "startup-script-remote.sh"),
+    "operations.py": os.path.join(HERE, "..", "part1", "operations.py"),
+    "__main__.py": os.path.join(HERE, "launcher_main.py"),
+}
+
+
+def vendor(site_dir):
+    subprocess.run([
+        sys.executable, "-m", "pip", "install", "--quiet", "--target", site_dir,
+        "--only-binary=:all:", "--platform", TARGET_PLATFORM,
+        "--python-version", TARGET_PYTHON, "--implementation", "cp",
+        *REQUIREMENTS,
+    ], check=True)
+    documents = os.path.join(site_dir, "googleapiclient", "discovery_cache", "documents")
+    for name in os.listdir(documents):
+        if name not in KEEP_DOCUMENTS:
+            os.remove(os.path.join(documents, name))
+    for name in ("bin", "__pycache__"):
+        shutil.rmtree(os.path.join(site_dir, name), ignore_errors=True)
+
+
+def is_stale(output):
+    """True if `output` is missing or older than one of the files it packages."""
+    if not os.path.exists(output):
+        return True
+    built = os.path.getmtime(output)
+    return any(os.path.getmtime(path) > built for path in list(APP_FILES.values()) + [__file__])
+
+
+def build(output=DEFAULT_OUTPUT):
+    """Build the launcher zipapp at `output` and return its path."""
+    with tempfile.TemporaryDirectory() as staging:
+        print(f"Vendoring {', '.join(REQUIREMENTS)} for Python {TARGET_PYTHON}...")
+        vendor(os.path.join(staging, "site-packages"))
+        for name, path in APP_FILES.items():
+            shutil.copy(path, os.path.join(staging, name))
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+        zipapp.create_archive(staging, output, interpreter="/usr/bin/env python3", compressed=True)
+    print(f"Launcher written to {output} ({os.path.getsize(output) // 1024} KiB)")
+    return output
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help='Where to write the zipapp.')
+    args = parser.parse_args()
+    build(args.output)
@@ -6,14 +6,14 @@ import sys
 
 import googleapiclient.discovery
 import google.auth
-import google.oauth2.service_account as service_account
+
+from operations import wait_for_operation
 
 #
-# Use Google Service Account - See https://google-auth.readthedocs.io/en/latest/reference/google.oauth2.service_account.html#module-google.oauth2.service_account
+# Runs on VM1 as VM1's attached service account: google.auth.default() gets
+# its token from the metadata server, so no key file is shipped to the VM.
+# (the client is built in __main__ below, not at import time)
 #
-credentials = service_account.Credentials.from_service_account_file(filename='service-credentials.json',scopes=['https://www.googleapis.com/auth/cloud-platform'])
-service = googleapiclient.discovery.build('compute', 'v1', credentials=credentials)
-
 project = "week5-project-401419"
 zone='us-east1-d'
 vm2_name="dhba-vm2-inside"
@@ -23,21 +23,6 @@ def list_instances(compute, project, zone):
     result = compute.instances().list(project=project, zone=zone).execute()
     return result['items'] if 'items' in result else None
 
-def wait_for_operation(compute, project, zone, operation):
-    print('Waiting for operation {} to finish...'.format(operation))
-    while True:
-        result = compute.zoneOperations().get(
-            project=project,
-            zone=zone,
-            operation=operation).execute()
-
-        if result['status'] == 'DONE':
-            print("done.")
-            if 'error' in result:
-                raise Exception(result['error'])
-            return result
-
-        time.sleep(1)
 def create_instance(compute,project,zone,name,bucket):
     
     image_response = (
@@ -92,10 +77,8 @@ def create_instance(compute,project,zone,name,bucket):
     except Exception as ex:
         print(ex)
         exit(1)
-    for instance in list_instances(service, project, zone):
-        if instance['name'] == name:
-            print(instance['name'])
-            break
+    instance = service.instances().get(project=project, zone=zone, instance=name).execute()
+    print(instance['name'])
 
     ip = instance["networkInterfaces"][0]["accessConfigs"][0]["natIP"]
 
@@ -108,4 +91,7 @@ def create_instance(compute,project,zone,name,bucket):
 
     print("VM instance {} created successfully.".format(vm2_name))
 
-create_instance(service,project,zone,vm2_name,bucket)
\ No newline at end of file
+if __name__ == '__main__':
+    credentials, _ = google.auth.default(scopes=['https://www.googleapis.com/auth/compute'])
+    service = googleapiclient.discovery.build('compute', 'v1', credentials=credentials, static_discovery=True)
+    create_instance(service,project,zone,vm2_name,bucket)
@@ -0,0 +1,37 @@
+#
+# Entry point of launcher.pyz (copied in as __main__.py by build_launcher.py).
+#
+# Some vendored packages read data files from their own directory, which
+# does not work from inside a zip, so the archive is unpacked once into a
+# cache directory named after its hash and run from there. Later runs of
+# the same archive start immediately.
+#
+import hashlib
+import os
+import runpy
+import sys
+import tempfile
+import zipfile
+
+CACHE_ROOT = os.environ.get("LAUNCHER_CACHE", os.path.join(tempfile.gettempdir(), "vm1-launcher"))
+
+
+def unpack(archive):
+    with open(archive, "rb") as archive_file:
+        digest = hashlib.sha256(archive_file.read()).hexdigest()[:16]
+    target = os.path.join(CACHE_ROOT, digest)
+    if not os.path.isdir(target):
+        os.makedirs(CACHE_ROOT, exist_ok=True)
+        staging = tempfile.mkdtemp(dir=CACHE_ROOT)
+        with zipfile.ZipFile(archive) as bundle:
+            bundle.extractall(staging)
+        try:
+            os.rename(staging, target)
+        except OSError:  # another run unpacked it first
+            pass
+    return target
+
+
+app_dir = unpack(sys.argv[0])
+sys.path[:0] = [app_dir, os.path.join(app_dir, "site-packages")]
+runpy.run_path(os.path.join(app_dir, "launch_vm2_inside.py"), run_name="__main__")
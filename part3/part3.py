@@ -7,65 +7,87 @@ import traceback
 import sys
 from pprint import pprint
 
-import googleapiclient.discovery
-import google.auth
-import google.oauth2.service_account as service_account
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../part1')))
+import build_launcher
+import clients
+import part1 as p1
+import console
+import lifecycle
+import readiness
+import tracing
+from artifacts import ArtifactStore, startup_script_item
+from googleapiclient.errors import HttpError
+from launch_vm2_inside import vm2_name
+from operations import wait_for_operation
+from reconcile import reconcile_firewall_and_tags
 
 
 #
 # Use Google Service Account - See https://google-auth.readthedocs.io/en/latest/reference/google.oauth2.service_account.html#module-google.oauth2.service_account
 #
-credentials = service_account.Credentials.from_service_account_file(filename='part3/service-credentials.json',scopes=['https://www.googleapis.com/auth/cloud-platform'])
-service = googleapiclient.discovery.build('compute', 'v1', credentials=credentials)
+def get_credentials():
+    def load_credentials():
+        import google.oauth2.service_account as service_account
+        return service_account.Credentials.from_service_account_file(filename='part3/service-credentials.json',scopes=['https://www.googleapis.com/auth/cloud-platform'])
+    return clients.cached_client("part3-service-account", load_credentials)
+
+def get_service():
+    """Compute client authorized as the service account, built on first use
+    (or the fake backend, see part1.build_compute)."""
+    return p1.build_compute(get_credentials)
 
 project = "week5-project-401419"
 zone='us-east1-d'
 vm1_name="dhba-vm1-outside"
 bucket="dharini-week5-bucket1"
 
-def list_instances(compute, project, zone):
-    result = compute.instances().list(project=project, zone=zone).execute()
-    return result['items'] if 'items' in result else None
-
-def wait_for_operation(compute, project, zone, operation):
-    print('Waiting for operation {} to finish...'.format(operation))
-    while True:
-        result = compute.zoneOperations().get(
-            project=project,
-            zone=zone,
-            operation=operation).execute()
-
-        if result['status'] == 'DONE':
-            print("done.")
-            if 'error' in result:
-                raise Exception(result['error'])
-            return result
+# "pip" installs the client libraries on VM1 at boot (startup-script-sdk.sh);
+# "zipapp" downloads the prebuilt launcher.pyz from the bucket and runs it.
+LAUNCHERS = ("pip", "zipapp")
+file_path = "part3/TIMING.md"
+LAUNCH_POLL = 2
+LAUNCH_TIMEOUT = 30 * 60
 
-        time.sleep(30)
-
-def create_instance():
+def create_instance(service, store, launcher="zipapp", launcher_url=None):
+    """Create VM1. Every payload goes to the bucket through `store` (an
+    ArtifactStore) and VM1's metadata only holds "<key>-url" references,
+    which its startup script downloads with the VM's own token.
+    """
     # Get the latest Debian Jessie image.
-    image_response = (
-        service.images()
-        .getFromFamily(project="ubuntu-os-cloud", family="ubuntu-2204-lts")
-        .execute()
-    )
-    source_disk_image = image_response["selfLink"]
+    source_disk_image = clients.image_link(service, "ubuntu-os-cloud", "ubuntu-2204-lts")
 
     # Configure the machine
     machine_type = "zones/%s/machineTypes/f1-micro" % zone
-    startup_script = open(
+    startup_script = clients.read_script(
         os.path.join(
-            os.path.dirname(__file__), 'startup-script-sdk.sh'), 'r').read()
-    vm2_startup_script = open(
+            os.path.dirname(__file__), 'startup-script-zipapp.sh' if launcher == "zipapp" else 'startup-script-sdk.sh'))
+    vm2_startup_script = clients.read_script(
         os.path.join(
-            os.path.dirname(__file__), 'startup-script-remote.sh'), 'r').read()
-    vm2_launch_code = open(
+            os.path.dirname(__file__), 'startup-script-remote.sh'))
+    vm2_launch_code = clients.read_script(
         os.path.join(
-            os.path.dirname(__file__), 'launch_vm2_inside.py'), 'r').read()
-    service_credentials = open(
+            os.path.dirname(__file__), 'launch_vm2_inside.py'))
+    operations_module = clients.read_script(
         os.path.join(
-            os.path.dirname(__file__), 'service-credentials.json'), 'r').read()
+            os.path.dirname(__file__), '../part1/operations.py'))
+    if launcher == "zipapp":
+        # The launcher brings its own code, VM2 script and operations module.
+        launcher_items = [{'key': 'launcher-url', 'value': launcher_url}]
+    else:
+        launcher_items = [
+            {
+                'key': 'vm2_startup_script-url',
+                'value': store.download_url(store.put(vm2_startup_script, '.sh'))
+            },
+            {
+                'key': 'vm1_launch_vm2-url',
+                'value': store.download_url(store.put(vm2_launch_code, '.py'))
+            },
+            {
+                'key': 'operations_module-url',
+                'value': store.download_url(store.put(operations_module, '.py'))
+            },
+        ]
     config = {
         "name": vm1_name,
         "machineType": machine_type,
@@ -86,24 +108,21 @@ def create_instance():
         ],
         "metadata": {
              "items": [
-                {
-                     'key': 'startup-script',
-                     'value': startup_script
-                },
-                {
-                    'key': 'service-credentials',
-                    'value': service_credentials
-                },
-                {
-                    'key': 'vm2_startup_script',
-                    'value': vm2_startup_script
-                },
-                {
-                    'key': 'vm1_launch_vm2',
-                    'value': vm2_launch_code
-                },
-            ]
+                startup_script_item(store, startup_script),
+            ] + launcher_items
         },
+        "tags": {"items": [p1.NETWORK_TAG]},
+        # VM1 launches VM2 as its own service account (no key file leaves this
+        # machine) and fetches its payloads from the bucket read-only.
+        "serviceAccounts": [
+            {
+                "email": "default",
+                "scopes": [
+                    "https://www.googleapis.com/auth/compute",
+                    "https://www.googleapis.com/auth/devstorage.read_only",
+                ],
+            }
+        ],
     }
     operation = service.instances().insert(project=project, zone=zone, body=config).execute()
 
@@ -115,39 +134,123 @@ def create_instance():
 
     print("VM instance {} created successfully.".format(vm1_name))
 
-    print("creating firewall rule...")
-    target="allow-5000"
-    firewall_rule_body = {
-    "name": "allow-5000",
-    "allowed": [
-        {
-            "IPProtocol": "tcp",
-            "ports": ["5000"]
-        }
-    ],
-    "sourceRanges": ["0.0.0.0/0"],  # Allow access from anywhere
-    "targetTags": ["allow-5000"],
-    }
-    try:
-        request = service.firewalls().insert(project=project, body=firewall_rule_body)
-        response = request.execute()
-    except Exception as e:
-        print('Could not create firewall rule. Check if the rule already exists')
-        pass
-    current_fingerprint = service.instances().get(project=project, zone=zone, instance=vm1_name).execute()['tags']['fingerprint']
-
-    tags_body = {
-        "items": [
-            target
-        ],
-        "fingerprint": current_fingerprint
-    }
-    requestAdd = service.instances().setTags(project=project, zone=zone, instance=vm1_name, body=tags_body)
-    response = requestAdd.execute()
+    instance = service.instances().get(project=project, zone=zone, instance=vm1_name).execute()
+    reconcile_firewall_and_tags(service, project, zone, [instance], p1.FIREWALL_RULE)
     print("Network tag added to instance:-\n", vm1_name)
 
-create_instance()
+def find_instance(service, name):
+    try:
+        return service.instances().get(project=project, zone=zone, instance=name).execute()
+    except HttpError as error:
+        if error.resp.status != 404:
+            raise
+        return None
+
+def measure_launch(service, started):
+    """Follow VM1 booting until VM2 serves the app; return when each phase was first seen.
+
+    Phases are "vm1_running", "vm2_created", "vm2_running" and
+    "vm2_serving", as time.time() values polled every LAUNCH_POLL seconds.
+    """
+    phases = {}
+    ip = None
+    while "vm2_serving" not in phases:
+        if time.time() > started + LAUNCH_TIMEOUT:
+            raise Exception(f'{vm2_name} did not serve within {LAUNCH_TIMEOUT} seconds')
+        if "vm1_running" not in phases:
+            if find_instance(service, vm1_name)["status"] == "RUNNING":
+                phases["vm1_running"] = time.time()
+        elif "vm2_running" not in phases:
+            vm2 = find_instance(service, vm2_name)
+            if vm2 is not None:
+                phases.setdefault("vm2_created", time.time())
+                if vm2["status"] == "RUNNING":
+                    phases["vm2_running"] = time.time()
+                    ip = vm2["networkInterfaces"][0]["accessConfigs"][0]["natIP"]
+        elif readiness.serves_http(ip):
+            phases["vm2_serving"] = time.time()
+        time.sleep(LAUNCH_POLL)
+    return phases
+
+def write_timing(launcher, started, phases):
+    """Append one launcher's phase breakdown to part3/TIMING.md, so runs before and after can be compared."""
+    with open(file_path, "a") as md_file:
+        md_file.write(f"## VM1 launcher: {launcher}\n\n")
+        md_file.write("| phase | seconds after VM1 insert | seconds after previous phase |\n")
+        md_file.write("|---|---|---|\n")
+        previous = started
+        for phase, seen in phases.items():
+            md_file.write("| %s | %.1f | %.1f |\n" % (phase, seen - started, seen - previous))
+            previous = seen
+        md_file.write("\n--- VM1 RUNNING to VM2 serving took %.1f seconds ---\n\n"
+                      % (phases["vm2_serving"] - phases["vm1_running"]))
+
+def main(launcher="zipapp", measure=False, timeline=False, stages=False):
+    service = get_service()
+    store = ArtifactStore(p1.build_storage(get_credentials), bucket)
+    launcher_url = None
+    if launcher == "zipapp":
+        path = build_launcher.DEFAULT_OUTPUT
+        if build_launcher.is_stale(path):
+            build_launcher.build(path)
+        with tracing.step("upload launcher"):
+            launcher_url = store.download_url(store.put_file(path))
+    watcher = None
+    if timeline:
+        # VM2 is only inserted later, by VM1; until then its gets are 404s.
+        watcher = lifecycle.Watcher(service, project, zone)
+        watcher.watch([vm1_name, vm2_name] if measure else [vm1_name])
+        watcher.start()
+    started = time.time()
+    with tracing.step("create vm1"):
+        create_instance(service, store, launcher, launcher_url)
+    if measure:
+        with tracing.step("measure launch"):
+            phases = measure_launch(service, started)
+        write_timing(launcher, started, phases)
+        for phase, seen in phases.items():
+            print(f"--- {phase} after {seen - started} seconds ---")
+    if watcher:
+        timelines = watcher.finish()
+        records = {vm1_name: {"inserted": started}}
+        if measure:
+            # VM1 inserts VM2, so only its serving time is known here.
+            records[vm2_name] = {"ready": phases["vm2_serving"]}
+        for name, record in records.items():
+            lifecycle.print_summary(name, lifecycle.summarize({name: timelines.get(name, {})}, {name: record}))
+    if stages:
+        print("Reading startup-script stages from the serial consoles...")
+        with tracing.step("startup stages"):
+            # VM2 only exists once VM1's launcher created it.
+            names = [vm1_name, vm2_name] if measure else [vm1_name]
+            durations = console.ConsoleReader(service, project, zone, names).follow()
+        for name, stages_seconds in durations.items():
+            console.print_summary(name, console.summarize({name: stages_seconds}))
+
+    print("Your running instances are:")
+    for name in (vm1_name, vm2_name):
+        for instance in p1.iter_instances(service, project, zone, name=name):
+            print(instance['name'])
+    tracing.finish()
 
-print("Your running instances are:")
-for instance in list_instances(service, project,zone):
-    print(instance['name'])
\ No newline at end of file
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        '--launcher', choices=LAUNCHERS, default='zipapp',
+        help='How VM1 gets its launcher: the prebuilt zipapp from the bucket, or apt/pip at boot (the old way).')
+    parser.add_argument(
+        '--measure', action='store_true',
+        help='Time VM1 boot to VM2 serving and append the breakdown to part3/TIMING.md.')
+    parser.add_argument(
+        '--timeline', action='store_true',
+        help='Time the PROVISIONING, STAGING and RUNNING phases of VM1 (and of VM2 with --measure).')
+    parser.add_argument(
+        '--stages', action='store_true',
+        help='Time the startup-script stages of VM1 (and of VM2 with --measure) from their serial consoles.')
+    parser.add_argument(
+        '--trace', metavar='PATH', help='Write a span per Compute call to PATH (.jsonl or Chrome trace JSON).')
+    args = parser.parse_args()
+    tracing.enable(args.trace)
+    main(args.launcher, args.measure, args.timeline, args.stages)
@@ -16,14 +16,25 @@
 
 # [START startup_script]
 
+# Stage markers on the serial console, timed by part1/console.py.
+stage() { echo "HW5-STAGE $1 $(date +%s.%N)" > /dev/ttyS0; }
+
+stage apt-update
 sudo apt-get update
+stage apt-install
 sudo apt-get install -y python3 python3-pip git
+stage git-clone
 git clone https://github.com/cu-csci-4253-datacenter/flask-tutorial
 cd flask-tutorial
+stage setup-install
 sudo python3 setup.py install
+stage pip-install
 sudo pip3 install -e .
 
 #run the program
+stage init-db
 export FLASK_APP=flaskr
 flask init-db
-nohup flask run -h 0.0.0.0 &
\ No newline at end of file
+stage serve
+nohup flask run -h 0.0.0.0 &
+stage done
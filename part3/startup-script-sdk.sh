@@ -2,13 +2,32 @@
 #cd /srv
 cd /home/dhba5060
 
-curl http://metadata/computeMetadata/v1/instance/attributes/service-credentials -H "Metadata-Flavor: Google">service-credentials.json
-curl http://metadata/computeMetadata/v1/instance/attributes/vm1_launch_vm2 -H "Metadata-Flavor: Google">launch_vm2_inside.py
-curl http://metadata/computeMetadata/v1/instance/attributes/vm2_startup_script -H "Metadata-Flavor: Google">startup-script-remote.sh
+# Stage markers on the serial console, timed by part1/console.py.
+stage() { echo "HW5-STAGE $1 $(date +%s.%N)" > /dev/ttyS0; }
+stage fetch
+
+# Payloads live in the bucket (see part1/artifacts.py); metadata only holds
+# their URLs, fetched here with the VM's own service-account token.
+METADATA=http://metadata/computeMetadata/v1/instance
+TOKEN=$(curl -s $METADATA/service-accounts/default/token -H "Metadata-Flavor: Google" \
+    | python3 -c 'import json, sys; print(json.load(sys.stdin)["access_token"])')
+fetch() {
+    curl -s "$(curl -s $METADATA/attributes/$1-url -H "Metadata-Flavor: Google")" \
+        -H "Authorization: Bearer $TOKEN" -o $2
+}
+
+fetch vm1_launch_vm2 launch_vm2_inside.py
+fetch operations_module operations.py
+fetch vm2_startup_script startup-script-remote.sh
 export GOOGLE_CLOUD_PROJECT= "week5-project-401419"
 
+stage apt-update
 sudo apt-get update
+stage apt-install
 sudo apt-get install -y python3 python3-pip git
 
+stage pip-install
 pip3 install --upgrade google-api-python-client google-auth-httplib2 google-auth-oauthlib
-python3 ./launch_vm2_inside.py
\ No newline at end of file
+stage launch-vm2
+python3 ./launch_vm2_inside.py
+stage done
@@ -0,0 +1,25 @@
+#mkdir -p /srv
+#cd /srv
+cd /home/dhba5060
+
+# Stage markers on the serial console, timed by part1/console.py.
+stage() { echo "HW5-STAGE $1 $(date +%s.%N)" > /dev/ttyS0; }
+stage fetch
+
+# No apt-get or pip: everything VM1 needs is inside launcher.pyz, which part3.py
+# uploaded to the bucket (see build_launcher.py). It runs on the image's python3.
+METADATA=http://metadata/computeMetadata/v1/instance
+
+TOKEN=$(curl -s $METADATA/service-accounts/default/token -H "Metadata-Flavor: Google" \
+    | python3 -c 'import json, sys; print(json.load(sys.stdin)["access_token"])')
+fetch() {
+    curl -s "$(curl -s $METADATA/attributes/$1-url -H "Metadata-Flavor: Google")" \
+        -H "Authorization: Bearer $TOKEN" -o $2
+}
+
+fetch launcher launcher.pyz
+export GOOGLE_CLOUD_PROJECT="week5-project-401419"
+
+stage launch-vm2
+python3 launcher.pyz
+stage done